@@ -4,11 +4,12 @@ Apply official working URLs for Moroccan/Arabic channels
 Based on latest iptv-org repo + verified sources
 """
 
-import re
 import requests
 from pathlib import Path
 from datetime import datetime
 
+import m3u_parser
+
 TIMEOUT = 8
 PLAYLIST_FILE = Path(__file__).parent / "Arabic.m3u"
 
@@ -41,57 +42,25 @@ def test_url(url: str, referer: str = None) -> bool:
 
 
 def parse_and_fix_m3u():
-    """Parse M3U, apply fixes, return fixed content"""
-    with open(PLAYLIST_FILE, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    lines = content.split('\n')
-    fixed_lines = []
-    i = 0
+    """Parse M3U, apply fixes, return the fixed playlist"""
+    playlist = m3u_parser.Playlist.load(PLAYLIST_FILE)
     fixes_applied = 0
     
-    while i < len(lines):
-        line = lines[i]
-        
-        if line.startswith('#EXTINF'):
-            # Extract channel name
-            match = re.search(r',\s*(.+?)$', line)
-            channel_name = match.group(1).strip() if match else ""
-            
-            # Keep metadata line
-            fixed_lines.append(line)
-            i += 1
-            
-            # Find URL line
-            while i < len(lines) and (lines[i].strip().startswith('#') or not lines[i].strip()):
-                fixed_lines.append(lines[i])
-                i += 1
+    for entry in playlist.entries:
+        # Check if we have an official fix for this channel
+        if entry.name in OFFICIAL_FIXES:
+            new_url = OFFICIAL_FIXES[entry.name]
             
-            if i < len(lines):
-                current_url = lines[i].strip()
-                
-                # Check if we have an official fix for this channel
-                if channel_name in OFFICIAL_FIXES:
-                    new_url = OFFICIAL_FIXES[channel_name]
-                    
-                    # Test it
-                    print(f"Testing {channel_name}...", end=" ")
-                    if test_url(new_url):
-                        print(f"✓ Working!")
-                        fixed_lines.append(new_url)
-                        fixes_applied += 1
-                    else:
-                        print(f"✗ Failed, keeping original")
-                        fixed_lines.append(current_url)
-                else:
-                    fixed_lines.append(current_url)
-                
-                i += 1
-        else:
-            fixed_lines.append(line)
-            i += 1
+            # Test it
+            print(f"Testing {entry.name}...", end=" ")
+            if test_url(new_url):
+                print(f"✓ Working!")
+                entry.url = new_url
+                fixes_applied += 1
+            else:
+                print(f"✗ Failed, keeping original")
     
-    return '\n'.join(fixed_lines), fixes_applied
+    return playlist, fixes_applied
 
 
 def create_backup():
@@ -115,11 +84,10 @@ def main():
     create_backup()
     
     print("Testing and applying fixes...\n")
-    fixed_content, count = parse_and_fix_m3u()
+    playlist, count = parse_and_fix_m3u()
     
     if count > 0:
-        with open(PLAYLIST_FILE, 'w', encoding='utf-8') as f:
-            f.write(fixed_content)
+        playlist.save(PLAYLIST_FILE)
         
         print(f"\n✅ Applied {count} official fixes to {PLAYLIST_FILE}")
     else:
@@ -1,7 +1,13 @@
 #!/bin/bash
 #
 # SNRT Token Auto-Refresh
-# Runs token extractor every hour and reloads proxy
+# Keeps a warm token extraction service running
+#
+# snrt_simple_proxy.py refreshes each channel itself shortly before its
+# expires= time (see --token-margin) and asks this service for the token when
+# it is running, so by default the service extracts on request only.
+# Proxies run with --token-margin 0 need a fixed cycle instead:
+#   SNRT_EXTRACT_INTERVAL=120 ./auto_refresh_tokens.sh
 #
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
@@ -15,38 +21,7 @@ echo ""
 # Activate venv
 source venv/bin/activate
 
-while true; do
-    echo "[$(date '+%Y-%m-%d %H:%M:%S')] 🔄 Extracting fresh tokens (all channels)..."
-    
-    # Extract all channels in parallel (~36s total)
-    python3 extract_all_snrt_channels.py
-    
-    # Reload proxy immediately after extraction
-    echo "[$(date '+%Y-%m-%d %H:%M:%S')] 📡 Reloading proxy..."
-    curl -s http://localhost:9000/reload > /dev/null
-    echo "[$(date '+%Y-%m-%d %H:%M:%S')] ✅ Proxy reloaded"
-    
-    # Count how many channels have fresh tokens (>2 min remaining)
-    FRESH=$(python3 -c "
-import json, time, re
-with open('snrt_streams.json') as f:
-    data = json.load(f)
-now = int(time.time())
-count = 0
-for ch, url in data.items():
-    if url:
-        m = re.search(r'expires=(\d+)', url)
-        if m and int(m.group(1)) > now + 120:
-            count += 1
-        elif not m:
-            count += 1
-print(count)
-" 2>/dev/null)
-    
-    TOTAL=$(python3 -c "import json; d=json.load(open('snrt_streams.json')); print(len(d))" 2>/dev/null)
-    echo "[$(date '+%Y-%m-%d %H:%M:%S')] 📊 Fresh tokens: $FRESH/$TOTAL channels"
-    echo "[$(date '+%Y-%m-%d %H:%M:%S')] ⏰ Next refresh in 2 minutes..."
-    echo ""
-    
-    sleep 120
-done
+# One warm browser for every extraction (was: 7 cold Chromium launches every
+# 2 minutes). The service merges results into snrt_streams.json, which the
+# proxy watches, and prints fresh/total after each cycle.
+exec python3 extract_all_snrt_channels.py --serve --interval "${SNRT_EXTRACT_INTERVAL:-0}"
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+On-disk channel name index over source playlists (iptv-org, Free-TV, ...)
+Every entry of every indexed .m3u is stored in SQLite under its normalized
+name; each distinct name is indexed by its words and character trigrams. Updating re-reads
+only playlists whose size or mtime changed, so re-running it after a
+`git pull` of the source repos is cheap. Lookups pick candidates through
+the query's rarest word and trigrams and rank them by name similarity.
+
+Usage:
+    python3 channel_index.py update /tmp/iptv-org/streams /tmp/freetv-iptv
+    python3 channel_index.py search "Al Jazeera Mubasher"
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+from collections import namedtuple
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import m3u_parser
+
+INDEX_FILE = "/tmp/iptv-channel-index.sqlite3"
+PLAYLIST_SUFFIXES = ('.m3u', '.m3u8')
+SEED_GRAMS = 6          # rarest query trigrams used to collect candidates
+MAX_CANDIDATES = 150    # distinct names scored per lookup
+MIN_SCORE = 0.6         # below this a "match" is just a shared word or two
+
+# Words that say nothing about which channel it is
+STOPWORDS = {'tv', 'hd', 'fhd', 'uhd', 'sd', '4k', 'channel', 'arabic', 'arb',
+             'international', 'inter', 'live', 'the'}
+BRACKETS_RE = re.compile(r'\([^)]*\)|\[[^\]]*\]')  # (1080p), [Geo-blocked], [Not 24/7]
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    norm TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    name_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    url TEXT NOT NULL,
+    tvg_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channels_source ON channels (source);
+CREATE INDEX IF NOT EXISTS channels_name ON channels (name_id);
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT NOT NULL,
+    name_id INTEGER NOT NULL,
+    PRIMARY KEY (token, name_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS trigrams (
+    gram TEXT NOT NULL,
+    name_id INTEGER NOT NULL,
+    PRIMARY KEY (gram, name_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tokens_name ON tokens (name_id);
+CREATE INDEX IF NOT EXISTS trigrams_name ON trigrams (name_id);
+CREATE TABLE IF NOT EXISTS token_counts (token TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS gram_counts (gram TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+"""
+
+Match = namedtuple('Match', 'score name url source tvg_id')
+
+
+def normalize_name(name: str) -> str:
+    """'Al Jazeera Mubasher (1080p) [Geo-blocked]' -> 'al jazeera mubasher'"""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch)).lower()
+    name = BRACKETS_RE.sub(' ', name)
+    words = [w for w in NON_WORD_RE.sub(' ', name).split() if w not in STOPWORDS]
+    return ' '.join(words)
+
+
+def trigrams(norm: str) -> set:
+    padded = f" {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(query_norm: str, query_grams: set, norm: str) -> float:
+    """Dice coefficient over trigrams, nudged up for whole-word containment"""
+    if norm == query_norm:
+        return 1.0
+    grams = trigrams(norm)
+    if not grams or not query_grams:
+        return 0.0
+    score = 2 * len(query_grams & grams) / (len(query_grams) + len(grams))
+    # "al jazeera" vs "al jazeera arabic news" — the old substring match, ranked lower
+    if f" {query_norm} " in f" {norm} " or f" {norm} " in f" {query_norm} ":
+        score = max(score, 0.5) + 0.2 * (1 - score)
+    return min(score, 0.99)
+
+
+def playlist_files(roots: Iterable) -> List[Path]:
+    files = []
+    for root in roots:
+        root = Path(root)
+        if root.is_file():
+            files.append(root)
+        elif root.is_dir():
+            files.extend(p for p in root.rglob('*') if p.suffix.lower() in PLAYLIST_SUFFIXES and p.is_file())
+    return sorted(set(files))
+
+
+class ChannelIndex:
+    """SQLite-backed name index; one per INDEX_FILE"""
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = str(path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- ingestion ---------------------------------------------------------
+
+    def _remove_source(self, path: str):
+        self.db.execute('DELETE FROM channels WHERE source = ?', (path,))
+        self.db.execute('DELETE FROM sources WHERE path = ?', (path,))
+
+    def _name_id(self, norm: str) -> int:
+        row = self.db.execute('SELECT id FROM names WHERE norm = ?', (norm,)).fetchone()
+        if row:
+            return row[0]
+        name_id = self.db.execute('INSERT INTO names (norm) VALUES (?)', (norm,)).lastrowid
+        self.db.executemany('INSERT INTO tokens VALUES (?, ?)', ((t, name_id) for t in set(norm.split())))
+        self.db.executemany('INSERT INTO trigrams VALUES (?, ?)', ((g, name_id) for g in trigrams(norm)))
+        return name_id
+
+    def _add_source(self, path: str, st) -> int:
+        count = 0
+        for entry in m3u_parser.iter_entries(path):
+            name = entry.name
+            norm = normalize_name(name)
+            if not norm or not entry.url:
+                continue
+            self.db.execute('INSERT INTO channels (source, name_id, name, url, tvg_id) VALUES (?, ?, ?, ?, ?)',
+                            (path, self._name_id(norm), name, entry.url, entry.tvg_id))
+            count += 1
+        self.db.execute('INSERT INTO sources VALUES (?, ?, ?)', (path, st.st_mtime_ns, st.st_size))
+        return count
+
+    def _drop_orphans(self):
+        """Names no playlist uses any more, with their postings"""
+        orphans = 'SELECT id FROM names WHERE id NOT IN (SELECT name_id FROM channels)'
+        self.db.execute(f'DELETE FROM tokens WHERE name_id IN ({orphans})')
+        self.db.execute(f'DELETE FROM trigrams WHERE name_id IN ({orphans})')
+        self.db.execute(f'DELETE FROM names WHERE id IN ({orphans})')
+
+    def update(self, roots: Iterable, prune: bool = True) -> dict:
+        """Index new/changed playlists under roots; with prune, forget ones that disappeared"""
+        roots = [Path(r).resolve() for r in roots]
+        known = {path: (mtime, size) for path, mtime, size in
+                 self.db.execute('SELECT path, mtime_ns, size FROM sources')}
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'channels': 0}
+        seen = set()
+        with self.db:
+            for file in playlist_files(roots):
+                path = str(file.resolve())
+                seen.add(path)
+                st = file.stat()
+                if known.get(path) == (st.st_mtime_ns, st.st_size):
+                    stats['unchanged'] += 1
+                    continue
+                if path in known:
+                    self._remove_source(path)
+                    stats['updated'] += 1
+                else:
+                    stats['added'] += 1
+                try:
+                    stats['channels'] += self._add_source(path, st)
+                except (OSError, UnicodeError) as e:
+                    print(f"  Warning: can't index {path}: {e}")
+            if prune:
+                for path in known:
+                    under_root = any(path == str(r) or path.startswith(str(r) + os.sep) for r in roots)
+                    if under_root and path not in seen:
+                        self._remove_source(path)
+                        stats['removed'] += 1
+            if stats['updated'] or stats['removed']:
+                self._drop_orphans()
+            if stats['added'] or stats['updated'] or stats['removed']:
+                self.db.execute('DELETE FROM token_counts')
+                self.db.execute('INSERT INTO token_counts SELECT token, COUNT(*) FROM tokens GROUP BY token')
+                self.db.execute('DELETE FROM gram_counts')
+                self.db.execute('INSERT INTO gram_counts SELECT gram, COUNT(*) FROM trigrams GROUP BY gram')
+        return stats
+
+    # -- lookup ------------------------------------------------------------
+
+    def lookup(self, name: str, limit: int = 10, sources: Optional[Iterable] = None,
+               min_score: float = MIN_SCORE) -> List[Match]:
+        """Best-matching entries for a channel name, highest score first
+
+        sources restricts results to playlists at or under these paths.
+        """
+        query_norm = normalize_name(name)
+        if not query_norm:
+            return []
+        query_grams = trigrams(query_norm)
+        prefixes = tuple(str(Path(s).resolve()) for s in sources) if sources is not None else None
+
+        # Candidate names: the exact normalized name, every name containing the
+        # query's rarest word, and the names sharing most of its rarest trigrams
+        # (typos, joined words). Document frequencies keep every posting list short.
+        words = list(set(query_norm.split()))
+        grams = list(query_grams)
+        # With sources, candidates are drawn from those playlists only, so the
+        # LIMITs below can't fill up with names from other sources
+        source_filter, source_params = '', ()
+        if prefixes is not None:
+            ranges = ' OR '.join(['c.source = ? OR (c.source >= ? AND c.source < ?)'] * len(prefixes)) or '0'
+            # Checked per posting through channels_name; a name usually has a handful of rows
+            source_filter = f'AND EXISTS (SELECT 1 FROM channels c WHERE c.name_id = {{}} AND ({ranges})) '
+            # Everything under p/ sorts between p + sep and p + the character after sep
+            source_params = tuple(v for p in prefixes for v in (p, p + os.sep, p + chr(ord(os.sep) + 1)))
+        candidates = dict(self.db.execute(
+            f'SELECT id, norm FROM names WHERE norm = ? {source_filter.format("names.id")}',
+            (query_norm, *source_params)))
+        candidates.update(self.db.execute(
+            f'SELECT n.id, n.norm FROM tokens t JOIN names n ON n.id = t.name_id WHERE t.token = '
+            f'(SELECT token FROM token_counts WHERE token IN ({",".join("?" * len(words))}) ORDER BY df LIMIT 1) '
+            f'{source_filter.format("t.name_id")}LIMIT ?', (*words, *source_params, MAX_CANDIDATES)))
+        candidates.update(self.db.execute(
+            f'SELECT n.id, n.norm FROM names n JOIN '
+            f'(SELECT name_id, COUNT(*) AS shared FROM trigrams WHERE gram IN '
+            f'(SELECT gram FROM gram_counts WHERE gram IN ({",".join("?" * len(grams))}) ORDER BY df LIMIT ?) '
+            f'{source_filter.format("trigrams.name_id")}GROUP BY name_id ORDER BY shared DESC LIMIT ?) s ON n.id = s.name_id',
+            (*grams, SEED_GRAMS, *source_params, MAX_CANDIDATES)))
+
+        ranked = sorted(((similarity(query_norm, query_grams, norm), norm, name_id)
+                         for name_id, norm in candidates.items()), reverse=True)
+        matches, seen = [], set()
+        for score, _, name_id in ranked:
+            if score < min_score or len(matches) >= limit:
+                break
+            rows = self.db.execute('SELECT name, url, source, tvg_id FROM channels WHERE name_id = ? '
+                                   'ORDER BY source, id', (name_id,))
+            for row_name, url, source, tvg_id in rows:
+                if url in seen or (prefixes is not None and not any(
+                        source == p or source.startswith(p + os.sep) for p in prefixes)):
+                    continue
+                seen.add(url)
+                matches.append(Match(round(score, 3), row_name, url, source, tvg_id))
+        return matches[:limit]
+
+    def count(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM channels').fetchone()[0]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) >= 2 and argv[0] == 'update':
+        started = time.perf_counter()
+        with ChannelIndex() as index:
+            stats = index.update(argv[1:])
+            total = index.count()
+        print(f"✓ {INDEX_FILE}: {stats['added']} added, {stats['updated']} updated, "
+              f"{stats['removed']} removed, {stats['unchanged']} unchanged playlists "
+              f"({total} channels, {time.perf_counter() - started:.2f}s)")
+        return 0
+    if len(argv) == 2 and argv[0] == 'search':
+        with ChannelIndex() as index:
+            started = time.perf_counter()
+            matches = index.lookup(argv[1])
+            elapsed = (time.perf_counter() - started) * 1000
+        for m in matches:
+            print(f"{m.score:.2f}  {m.name}  {m.url}  ({Path(m.source).name})")
+        print(f"({len(matches)} matches, {elapsed:.2f}ms)")
+        return 0
+    print("usage: channel_index.py update DIR|FILE... | search NAME", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
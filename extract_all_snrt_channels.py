@@ -2,13 +2,61 @@
 """
 Extract tokens for ALL SNRT channels - runs ALL channels in PARALLEL
 Tokens are short-lived (~5-10 min), so parallel extraction is critical
+
+All channels share one Chromium (BrowserPool). With --serve the browser
+stays up between cycles and the pool's contexts are reused, so each cycle
+skips the cold launch; the proxy can also ask it for one channel at a
+time over HTTP (GET /extract/<channel>).
 """
+import argparse
 import asyncio
-from playwright.async_api import async_playwright
+import contextlib
+import hashlib
 import json
+import os
+import re
 import sys
 import time
-import re
+from urllib.parse import urlparse
+
+from playwright.async_api import async_playwright
+
+import snrt_token_store
+import token_replay
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+MAX_PAGES = 3               # player pages open at once in the shared browser
+CONTEXT_MAX_USES = 20       # recycle a browser context after this many extractions
+STATE_FILE = "snrt_browser_state.json"  # cookies + localStorage carried between runs
+SERVICE_PORT = 9010         # --serve: GET /extract/<channel> on 127.0.0.1
+SERVICE_INTERVAL = 120      # --serve: seconds between full extraction cycles
+CAPTURE_DEADLINE = 35       # seconds per channel before settling for the best URL seen
+PLAY_CLICK_DELAY = 8        # seconds without a usable URL before trying the play button
+MIN_REMAINING = 120         # a token needs this many seconds left to end capture early
+ASSET_CACHE_DIR = ".snrt_asset_cache"   # player scripts/styles kept between runs
+ASSET_MAX_AGE = 24 * 3600   # seconds before a cached player asset is fetched again
+
+# Never needed to capture the token URL
+BLOCKED_RESOURCE_TYPES = {'image', 'font', 'media'}
+SEGMENT_RE = re.compile(r'\.(ts|m4s|aac|mp4|m4a|m4v|vtt|webvtt)(\?|$)')
+TRACKER_HOSTS = (
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net',
+    'googlesyndication.com', 'googleadservices.com', 'facebook.net', 'facebook.com',
+    'hotjar.com', 'scorecardresearch.com', 'chartbeat.com', 'chartbeat.net',
+    'nr-data.net', 'newrelic.com', 'sentry.io', 'xiti.com', 'gemius.pl', 'yandex.ru',
+)
+CACHED_RESOURCE_TYPES = {'script', 'stylesheet'}
+PLAYER_DOMAIN = 'easybroadcast.io'  # player, token API and CDN — never cut off
+TOKEN_HOST = 'token.easybroadcast.io'
+RECORD_TIMEOUT = 5          # seconds to wait for recorded response bodies
+
+PLAY_SELECTORS = [
+    'button[aria-label*="play"]',
+    'button.play',
+    '[class*="play-button"]',
+    'button[title*="Play"]',
+    '.vjs-big-play-button'
+]
 
 CHANNELS = {
     "al-aoula": "https://snrt.player.easybroadcast.io/events/73_aloula_w1dqfwm",
@@ -20,62 +68,305 @@ CHANNELS = {
     "attakafiya": "https://snrt.player.easybroadcast.io/events/73_arrabia_hthcj4p"
 }
 
-async def extract_channel(channel_id, iframe_url):
-    """Extract M3U8 URL for a single channel"""
+def is_tracker(host):
+    return any(host == t or host.endswith('.' + t) for t in TRACKER_HOSTS)
+
+
+class AssetCache:
+    """Player scripts and stylesheets on disk, served to the browser through page routing
+
+    Routing a page turns off Chromium's own HTTP cache for it, and a fresh
+    context starts with an empty one anyway, so this is what keeps the
+    player's JavaScript from being downloaded on every extraction.
+    """
+
+    def __init__(self, directory=ASSET_CACHE_DIR, max_age=ASSET_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+        self.hits = 0
+        self.stored = 0
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.body', base + '.json'
+
+    def load(self, url):
+        """(headers, body) if url is cached and fresh, else None"""
+        body_path, meta_path = self._paths(url)
+        try:
+            if time.time() - os.path.getmtime(meta_path) > self.max_age:
+                return None
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        self.hits += 1
+        return meta['headers'], body
+
+    def store(self, url, headers, body):
+        os.makedirs(self.directory, exist_ok=True)
+        body_path, meta_path = self._paths(url)
+        kept = {k: v for k, v in headers.items()
+                if k.lower() in ('content-type', 'access-control-allow-origin')}
+        for path, data in ((body_path, body),
+                           (meta_path, json.dumps({'url': url, 'headers': kept}).encode('utf-8'))):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)   # meta last: a meta file always has its body
+        self.stored += 1
+
+
+class BrowserPool:
+    """One long-lived Chromium handing out pages from reusable contexts
+
+    A context goes back to the pool after its page closes, keeping cookies
+    and the player's cached assets for the next extraction; its storage
+    state is also saved to state_file so a restarted service starts warm.
+    At most max_pages pages are open at once. If Chromium dies it is
+    relaunched on the next request.
+    """
+
+    def __init__(self, max_pages=MAX_PAGES, state_file=STATE_FILE, assets=None):
+        self.max_pages = max_pages
+        self.state_file = state_file
+        self.assets = assets if assets is not None else AssetCache()
+        self.launches = 0
+        self.blocked = 0
+        self._slots = asyncio.Semaphore(max_pages)
+        self._idle = []          # [(context, uses)] belonging to the current browser
+        self._launch_lock = asyncio.Lock()
+        self._playwright = None
+        self._browser = None
+
+    async def __aenter__(self):
+        self._playwright = await async_playwright().start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _ensure_browser(self):
+        async with self._launch_lock:
+            if self._browser is None or not self._browser.is_connected():
+                self._idle.clear()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+                self.launches += 1
+                print(f"🌐 Browser launched (#{self.launches})", flush=True)
+            return self._browser
+
+    async def _acquire_context(self):
+        browser = await self._ensure_browser()
+        if self._idle:
+            return self._idle.pop()
+        if os.path.exists(self.state_file):
+            try:
+                context = await browser.new_context(user_agent=USER_AGENT, storage_state=self.state_file)
+                return context, 0
+            except Exception as e:
+                print(f"  ⚠️  Ignoring browser state {self.state_file}: {e}", flush=True)
+        return await browser.new_context(user_agent=USER_AGENT), 0
+
+    async def _save_state(self, context):
+        state = await context.storage_state()
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+
+    def router(self, playlist_seen):
+        """Route handler for a player page
+
+        Nothing is aborted until playlist_seen() is true, so the player
+        loads as it normally would; after that images, fonts, media
+        segments, trackers and anything not served by the player's own
+        domain are. Player scripts and styles come from the asset cache.
+        """
+        async def route_request(route):
+            request = route.request
+            url = request.url
+            kind = request.resource_type
+            host = urlparse(url).hostname or ''
+            if playlist_seen() and (kind in BLOCKED_RESOURCE_TYPES
+                                    or SEGMENT_RE.search(url.split('#')[0])
+                                    or is_tracker(host)
+                                    or (host != PLAYER_DOMAIN and not host.endswith('.' + PLAYER_DOMAIN))):
+                self.blocked += 1
+                await route.abort()
+                return
+            if kind not in CACHED_RESOURCE_TYPES or request.method != 'GET':
+                await route.continue_()
+                return
+            cached = self.assets.load(url)
+            if cached is not None:
+                headers, body = cached
+                await route.fulfill(status=200, headers=headers, body=body)
+                return
+            response = await route.fetch()
+            body = await response.body()
+            if response.status == 200:
+                self.assets.store(url, response.headers, body)
+            await route.fulfill(response=response, body=body)
+
+        async def guarded(route):
+            try:
+                await route_request(route)
+            except Exception:
+                # Page closed mid-request, or the fetch failed — let it fail quietly
+                with contextlib.suppress(Exception):
+                    await route.abort()
+
+        return guarded
+
+    @contextlib.asynccontextmanager
+    async def page(self):
+        async with self._slots:
+            context, uses = await self._acquire_context()
+            healthy = False
+            page = None
+            try:
+                page = await context.new_page()
+                yield page
+                healthy = True
+            finally:
+                try:
+                    if page is not None:
+                        await page.close()
+                    if healthy:
+                        await self._save_state(context)
+                except Exception:
+                    healthy = False
+                if healthy and uses + 1 < CONTEXT_MAX_USES and len(self._idle) < self.max_pages:
+                    self._idle.append((context, uses + 1))
+                else:
+                    with contextlib.suppress(Exception):
+                        await context.close()
+
+    async def close(self):
+        for context, _ in self._idle:
+            with contextlib.suppress(Exception):
+                await context.close()
+        self._idle.clear()
+        if self._browser is not None:
+            with contextlib.suppress(Exception):
+                await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+def usable_remaining(url, now=None):
+    """Seconds left on a playlist_dvr URL if that's more than MIN_REMAINING, else None"""
+    if 'playlist_dvr' not in url:
+        return None
+    m = re.search(r'expires=(\d+)', url)
+    if not m:
+        return None
+    remaining = int(m.group(1)) - int(time.time() if now is None else now)
+    return remaining if remaining > MIN_REMAINING else None
+
+
+async def wait_for_event(event, timeout):
+    if timeout <= 0:
+        return event.is_set()
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+async def click_play(page):
+    for selector in PLAY_SELECTORS:
+        try:
+            button = await page.query_selector(selector)
+            if button:
+                await button.click()
+                return True
+        except Exception:
+            pass
+    return False
+
+
+async def read_step(response):
+    """(method, url, headers, body, response text) of one recorded request"""
+    request = response.request
+    return (request.method, response.url, await request.all_headers(),
+            request.post_data, await response.text())
+
+
+async def extract_channel(pool, channel_id, iframe_url, deadline=CAPTURE_DEADLINE, recorder=None):
+    """Extract M3U8 URL for a single channel
+
+    Returns as soon as a usable token URL is requested by the player, or
+    after deadline seconds with the best URL seen so far. With a recorder,
+    the page and token API exchanges are recorded for token_replay.
+    """
     print(f"🔍 Starting {channel_id}...", flush=True)
 
     m3u8_urls = []
+    usable = asyncio.Event()
+    recordings = []
 
-    async with async_playwright() as p:
-        try:
-            browser = await p.chromium.launch(headless=True)
-            context = await browser.new_context(
-                user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-            )
-            page = await context.new_page()
+    try:
+        async with pool.page() as page:
+            started = time.monotonic()
 
             # Capture M3U8 requests — only real stream URLs
             def log_request(request):
                 url = request.url
-                if 'token.easybroadcast.io' in url:
+                if TOKEN_HOST in url:
                     return
                 if '.m3u8' in url and 'cdn.live.easybroadcast' in url:
                     if url not in m3u8_urls:
                         m3u8_urls.append(url)
-                        print(f"  📡 {channel_id}: captured URL", flush=True)
+                        if recorder is not None:
+                            recorder.note_playlist(url, request.headers)
+                        print(f"  📡 {channel_id}: captured URL "
+                              f"({time.monotonic() - started:.1f}s)", flush=True)
+                        if usable_remaining(url):
+                            usable.set()
+
+            # Token API calls and the page itself, in the order they came back
+            def log_response(response):
+                if TOKEN_HOST in response.url or response.request.resource_type == 'document':
+                    recordings.append(asyncio.ensure_future(read_step(response)))
 
             page.on("request", log_request)
+            if recorder is not None:
+                page.on("response", log_response)
+            await page.route("**/*", pool.router(lambda: bool(m3u8_urls)))
 
+            # Navigation runs alongside the wait — the token request often
+            # goes out before the page reports domcontentloaded
+            navigation = asyncio.ensure_future(
+                page.goto(iframe_url, wait_until="domcontentloaded", timeout=deadline * 1000))
             try:
-                await page.goto(iframe_url, wait_until="domcontentloaded", timeout=45000)
-            except:
-                pass
+                if not await wait_for_event(usable, min(PLAY_CLICK_DELAY, deadline)):
+                    # Player didn't start by itself — try to click play
+                    await click_play(page)
+                    await wait_for_event(usable, deadline - (time.monotonic() - started))
+            finally:
+                navigation.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await navigation
+                # Bodies are gone once the page closes
+                if recordings:
+                    await asyncio.wait(recordings, timeout=RECORD_TIMEOUT)
+                for recording in recordings:
+                    if recording.done() and not recording.cancelled() and not recording.exception():
+                        recorder.add_step(*recording.result())
+                    else:
+                        recording.cancel()
 
-            await asyncio.sleep(20)
-
-            # Try to click play
-            selectors = [
-                'button[aria-label*="play"]',
-                'button.play',
-                '[class*="play-button"]',
-                'button[title*="Play"]',
-                '.vjs-big-play-button'
-            ]
-            for selector in selectors:
-                try:
-                    button = await page.query_selector(selector)
-                    if button:
-                        await button.click()
-                        await asyncio.sleep(3)
-                        break
-                except:
-                    pass
-
-            await asyncio.sleep(15)
-            await browser.close()
-
-        except Exception as e:
-            print(f"  ❌ {channel_id}: {e}", flush=True)
+    except Exception as e:
+        print(f"  ❌ {channel_id}: {e}", flush=True)
 
     if m3u8_urls:
         now = int(time.time())
@@ -85,14 +376,10 @@ async def extract_channel(channel_id, iframe_url):
         best_remaining = -1
 
         for url in m3u8_urls:
-            if 'playlist_dvr' in url:
-                m = re.search(r'expires=(\d+)', url)
-                if m:
-                    expires = int(m.group(1))
-                    remaining = expires - now
-                    if remaining > 120 and remaining > best_remaining:  # > 2 min
-                        best_url = url
-                        best_remaining = remaining
+            remaining = usable_remaining(url, now)  # > 2 min
+            if remaining and remaining > best_remaining:
+                best_url = url
+                best_remaining = remaining
 
         if best_url:
             mins = best_remaining // 60
@@ -113,50 +400,178 @@ async def extract_channel(channel_id, iframe_url):
     return None
 
 
-async def main():
-    start = time.time()
-    print("╔══════════════════════════════════════════════════════════════╗")
-    print("║     Extracting ALL SNRT Channels (PARALLEL)                 ║")
-    print("╚══════════════════════════════════════════════════════════════╝")
-    print(flush=True)
-
-    # Run ALL channels simultaneously
-    tasks = [extract_channel(cid, url) for cid, url in CHANNELS.items()]
-    channel_ids = list(CHANNELS.keys())
-    results_list = await asyncio.gather(*tasks)
-    results = dict(zip(channel_ids, results_list))
-
-    elapsed = time.time() - start
-    print(f"\n{'='*60}")
-    print(f"RESULTS ({elapsed:.0f}s):")
-    print("="*60)
-
-    success_count = 0
-    for channel_id, url in results.items():
-        if url:
-            print(f"✅ {channel_id}")
-            success_count += 1
-        else:
-            print(f"❌ {channel_id}")
+class ExtractionService:
+    """Runs extractions on a shared BrowserPool; concurrent requests for the same channel share one"""
 
-    print(f"\n{success_count}/{len(CHANNELS)} channels extracted")
+    def __init__(self, pool, output, deadline=CAPTURE_DEADLINE, recipes=token_replay.RECIPE_FILE):
+        self.pool = pool
+        self.output = output
+        self.deadline = deadline
+        self.recipes = recipes   # token_replay recipe file, None = browser only
+        self.latency = {}        # channel_id -> seconds the last extraction took
+        self._inflight = {}
 
-    # Merge with existing — only update successful extractions
-    try:
-        with open("snrt_streams.json", 'r') as f:
-            existing = json.load(f)
-    except:
-        existing = {}
+    async def _extract(self, channel_id):
+        started = time.monotonic()
+        url = None
+        if self.recipes:
+            loop = asyncio.get_running_loop()
+            url = await loop.run_in_executor(None, token_replay.replay_channel, channel_id, self.recipes)
+        if url is None:
+            recorder = token_replay.Recorder() if self.recipes else None
+            url = await extract_channel(self.pool, channel_id, CHANNELS[channel_id], self.deadline, recorder)
+            if url and recorder is not None:
+                recipe = recorder.recipe(url)
+                # No recipe means the token didn't come from a recorded call — drop the stale one
+                token_replay.save_recipe(channel_id, recipe, self.recipes)
+                note = 'recorded token replay recipe' if recipe else 'no replayable token calls'
+                print(f"  📝 {channel_id}: {note}", flush=True)
+        self.latency[channel_id] = time.monotonic() - started
+        return url
+
+    def extract(self, channel_id):
+        task = self._inflight.get(channel_id)
+        if task is None:
+            task = asyncio.ensure_future(self._extract(channel_id))
+            self._inflight[channel_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(channel_id, None))
+        return asyncio.shield(task)
+
+    async def run_cycle(self, channel_ids):
+        start = time.time()
+        blocked, hits, stored = self.pool.blocked, self.pool.assets.hits, self.pool.assets.stored
+        print("╔══════════════════════════════════════════════════════════════╗")
+        print("║     Extracting ALL SNRT Channels (PARALLEL)                 ║")
+        print("╚══════════════════════════════════════════════════════════════╝")
+        print(flush=True)
+
+        # Run ALL channels at once — the pool caps how many pages actually load
+        results_list = await asyncio.gather(*(self.extract(cid) for cid in channel_ids))
+        results = dict(zip(channel_ids, results_list))
 
-    for channel_id, url in results.items():
-        if url is not None:
-            existing[channel_id] = url
+        elapsed = time.time() - start
+        print(f"\n{'='*60}")
+        print(f"RESULTS ({elapsed:.0f}s):")
+        print("="*60)
 
-    with open("snrt_streams.json", 'w') as f:
-        json.dump(existing, f, indent=2)
+        success_count = 0
+        for channel_id, url in results.items():
+            seconds = self.latency.get(channel_id, 0)
+            if url:
+                print(f"✅ {channel_id:<14} {seconds:5.1f}s")
+                success_count += 1
+            else:
+                print(f"❌ {channel_id:<14} {seconds:5.1f}s")
 
-    print(f"💾 Saved to snrt_streams.json\n", flush=True)
+        latencies = sorted(self.latency.get(cid, 0) for cid in channel_ids)
+        print(f"\n{success_count}/{len(channel_ids)} channels extracted "
+              f"(median {latencies[len(latencies) // 2]:.1f}s, slowest {latencies[-1]:.1f}s)")
+        print(f"🧹 Requests blocked: {self.pool.blocked - blocked}, player assets from disk: "
+              f"{self.pool.assets.hits - hits} (newly stored {self.pool.assets.stored - stored})")
+
+        # Merge with existing — only update successful extractions. The store
+        # swaps the file in atomically, so the proxy never reads a partial write
+        snapshot = snrt_token_store.update_tokens(self.output, results)
+
+        now = time.time()
+        fresh = sum(1 for e in snapshot.entries.values()
+                    if e.url and (e.expires is None or e.expires > now + 120))
+        print(f"💾 Saved to {self.output} (version {snapshot.version}, "
+              f"fresh: {fresh}/{len(snapshot.entries)})\n", flush=True)
+        return results
+
+    async def handle_request(self, reader, writer):
+        """GET /extract/<channel> -> {"channel": ..., "url": ...}; the caller stores the URL"""
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            path = parts[1] if len(parts) > 1 else '/'
+            channel_id = path[len('/extract/'):] if path.startswith('/extract/') else None
+            if channel_id in CHANNELS:
+                url = await self.extract(channel_id)
+                status = '200 OK' if url else '502 Bad Gateway'
+                body = json.dumps({'channel': channel_id, 'url': url,
+                                   'seconds': round(self.latency.get(channel_id, 0), 1)})
+            else:
+                status = '404 Not Found'
+                body = json.dumps({'error': 'unknown channel', 'channels': sorted(CHANNELS)})
+            data = body.encode('utf-8')
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, channel_ids, port, interval):
+        server = await asyncio.start_server(self.handle_request, '127.0.0.1', port)
+        print(f"🛰️  Extraction service on http://127.0.0.1:{port}/extract/<channel> "
+              f"(max {self.pool.max_pages} pages)", flush=True)
+        async with server:
+            while True:
+                if interval:
+                    await self.run_cycle(channel_ids)
+                    print(f"⏰ Next cycle in {interval}s (browser launches so far: {self.pool.launches})",
+                          flush=True)
+                    await asyncio.sleep(interval)
+                else:
+                    await asyncio.sleep(3600)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract SNRT channel tokens")
+    parser.add_argument('--channel', action='append', choices=sorted(CHANNELS), metavar='ID',
+                        help="only extract this channel (repeatable; default: all)")
+    parser.add_argument('--output', default="snrt_streams.json",
+                        help="token file to merge results into (default: snrt_streams.json)")
+    parser.add_argument('--max-pages', type=int, default=MAX_PAGES,
+                        help=f"player pages loading at once (default: {MAX_PAGES})")
+    parser.add_argument('--state-file', default=STATE_FILE,
+                        help=f"browser cookies/storage kept between runs (default: {STATE_FILE})")
+    parser.add_argument('--asset-cache', default=ASSET_CACHE_DIR,
+                        help=f"directory for cached player scripts/styles (default: {ASSET_CACHE_DIR})")
+    parser.add_argument('--deadline', type=float, default=CAPTURE_DEADLINE,
+                        help=f"seconds per channel before settling for the best URL seen "
+                             f"(default: {CAPTURE_DEADLINE})")
+    parser.add_argument('--recipes', default=token_replay.RECIPE_FILE,
+                        help="recorded token calls to replay over plain HTTP before using the browser")
+    parser.add_argument('--no-replay', action='store_true',
+                        help="always use the browser (no HTTP token replay)")
+    parser.add_argument('--serve', action='store_true',
+                        help="keep the browser warm: extract every --interval seconds and "
+                             "answer GET /extract/<channel> on --port")
+    parser.add_argument('--interval', type=int, default=SERVICE_INTERVAL,
+                        help=f"--serve: seconds between full cycles, 0 = on request only "
+                             f"(default: {SERVICE_INTERVAL})")
+    parser.add_argument('--port', type=int, default=SERVICE_PORT,
+                        help=f"--serve: local port for on-demand extraction (default: {SERVICE_PORT})")
+    args = parser.parse_args(argv)
+    if args.max_pages < 1:
+        parser.error("--max-pages must be at least 1")
+    if args.deadline <= 0:
+        parser.error("--deadline must be positive")
+    return args
+
+
+async def main():
+    args = parse_args()
+    channel_ids = args.channel or list(CHANNELS)
+
+    assets = AssetCache(args.asset_cache)
+    async with BrowserPool(args.max_pages, args.state_file, assets) as pool:
+        service = ExtractionService(pool, args.output, args.deadline,
+                                    None if args.no_replay else args.recipes)
+        if args.serve:
+            await service.serve(channel_ids, args.port, args.interval)
+        else:
+            await service.run_cycle(channel_ids)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
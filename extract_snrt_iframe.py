@@ -6,6 +6,8 @@ SNRT Stream Extraction - Navigate into iframe
 import asyncio
 from playwright.async_api import async_playwright
 
+import snrt_token_store
+
 async def extract_from_iframe():
     """Extract stream by navigating directly to the iframe URL"""
     
@@ -97,10 +99,8 @@ if __name__ == "__main__":
         for url in urls:
             print(f"\n{url}")
         
-        # Save to file
-        import json
-        with open('snrt_streams.json', 'w') as f:
-            json.dump({"al-aoula": urls[0] if urls else None}, f, indent=2)
+        # Save to file (atomic merge — see snrt_token_store)
+        snrt_token_store.update_tokens('snrt_streams.json', {"al-aoula": urls[0]})
         print(f"\n💾 Saved to snrt_streams.json")
     else:
         print(f"\n❌ No M3U8 URLs found")
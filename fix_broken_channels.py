@@ -3,9 +3,10 @@
 Fix broken channels with working alternatives from iptv-org
 """
 
-import re
 from pathlib import Path
 
+import m3u_parser
+
 PLAYLIST_FILE = Path(__file__).parent / "Arabic.m3u"
 
 # Verified working replacements from iptv-org (tested with ffprobe)
@@ -26,34 +27,18 @@ REMOVE_CHANNELS = [
 def fix_playlist():
     """Fix broken channels"""
     
-    with open(PLAYLIST_FILE, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    fixed_lines = []
-    skip_next = False
+    playlist = m3u_parser.Playlist.load(PLAYLIST_FILE)
     removed_count = 0
     
-    for i, line in enumerate(lines):
-        if skip_next:
-            skip_next = False
-            continue
-        
-        # Check if this is a channel to remove
-        if line.startswith('#EXTINF'):
-            channel_name = re.search(r',\s*(.+?)$', line)
-            if channel_name:
-                name = channel_name.group(1).strip()
-                if name in REMOVE_CHANNELS:
-                    print(f"✗ Removing: {name}")
-                    skip_next = True  # Skip the URL line too
-                    removed_count += 1
-                    continue
-        
-        fixed_lines.append(line)
+    for entry in playlist.entries:
+        # Check if this is a channel to remove (drops its #EXTVLCOPT lines and URL too)
+        if entry.name in REMOVE_CHANNELS:
+            print(f"✗ Removing: {entry.name}")
+            playlist.remove(entry)
+            removed_count += 1
     
     # Write back
-    with open(PLAYLIST_FILE, 'w', encoding='utf-8') as f:
-        f.writelines(fixed_lines)
+    playlist.save(PLAYLIST_FILE)
     
     print(f"\n✓ Removed {removed_count} broken channels")
     print(f"✓ Updated {PLAYLIST_FILE}")
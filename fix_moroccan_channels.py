@@ -9,7 +9,10 @@ from pathlib import Path
 from typing import Optional
 import sys
 
+import channel_index
+
 TIMEOUT = 8
+MAX_ALTERNATIVES = 5  # best-matching Free-TV streams to test per channel
 
 # Official SNRT Morocco CDN URLs (from web search + testing variants)
 OFFICIAL_SNRT_URLS = {
@@ -81,26 +84,15 @@ def search_alternative_repos(channel_name: str) -> Optional[str]:
         except:
             return None
     
-    # Search in playlists
-    search_files = list(freetv_dir.glob("**/*.m3u"))
-    normalized_name = channel_name.lower()
+    # Closest names first; the index only re-reads playlists a pull changed
+    with channel_index.ChannelIndex() as index:
+        index.update([freetv_dir])
+        matches = index.lookup(channel_name, limit=MAX_ALTERNATIVES, sources=[freetv_dir])
     
-    for m3u_file in search_files:
-        try:
-            with open(m3u_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            for i, line in enumerate(lines):
-                if line.startswith('#EXTINF') and normalized_name in line.lower():
-                    # Get URL from next non-comment line
-                    for j in range(i + 1, min(i + 5, len(lines))):
-                        url = lines[j].strip()
-                        if url and not url.startswith('#'):
-                            # Test it
-                            if test_url(url):
-                                return url
-        except:
-            continue
+    for match in matches:
+        # Test it
+        if test_url(match.url):
+            return match.url
     
     return None
 
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+In-process HLS deep probe - a cheap stand-in for spawning ffprobe per channel
+Follows master playlist -> variant -> one media segment, reads only the
+first few hundred KB of that segment and checks it is real MPEG-TS: sync
+bytes every 188 bytes, a PAT pointing at a PMT that lists elementary
+streams, and no continuity counter gaps. Download throughput is compared
+with the variant's advertised BANDWIDTH.
+
+Usage:
+    python3 hls_probe.py URL...
+    python3 hls_probe.py --playlist Arabic.m3u
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import m3u_parser
+
+PROBE_TIMEOUT = 10              # seconds per request
+PLAYLIST_LIMIT = 1024 * 1024    # playlists bigger than this aren't HLS playlists
+SEGMENT_BYTES = 188 * 2000      # ~376KB of the segment is plenty to find PAT/PMT
+MAX_HOPS = 3                    # master -> variant (-> nested master, seen in the wild)
+LIVE_EDGE = 3                   # live playlists: probe this many segments from the end
+PROBE_WORKERS = 64
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Firefox/134.0'
+
+TS_PACKET = 188
+TS_SYNC = 0x47
+NULL_PID = 0x1FFF
+STREAM_TYPES = {0x01: 'mpeg1video', 0x02: 'mpeg2video', 0x03: 'mp3', 0x04: 'mp3', 0x0f: 'aac',
+                0x11: 'aac-latm', 0x15: 'id3', 0x1b: 'h264', 0x24: 'hevc', 0x81: 'ac3', 0x87: 'eac3'}
+
+
+class ProbeError(Exception):
+    pass
+
+
+class NotPlaylist(ProbeError):
+    """The URL answered with something other than an HLS playlist"""
+
+
+class ProbeResult:
+    """What a probe found; ok means a segment decoded as sane MPEG-TS"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.ok = False
+        self.error = None           # why not ok
+        self.unsupported = False    # reachable, but not something we can check (fMP4, AES, non-HLS)
+        self.variant_url = None
+        self.segment_url = None
+        self.bandwidth = None       # advertised bits/s of the probed variant
+        self.throughput = None      # measured bits/s while reading the segment
+        self.bytes_read = 0
+        self.packets = 0
+        self.sync_errors = 0
+        self.cc_errors = 0
+        self.pmt_pids = []
+        self.streams = {}           # elementary PID -> codec name from the PMT
+        self.elapsed = 0.0
+
+    @property
+    def ratio(self) -> Optional[float]:
+        """Measured throughput / advertised bandwidth (< 1 means it can't keep up)"""
+        if self.throughput and self.bandwidth:
+            return self.throughput / self.bandwidth
+        return None
+
+    def summary(self) -> str:
+        if not self.ok:
+            return self.error or 'failed'
+        codecs = '+'.join(sorted(set(self.streams.values()))) or 'no streams'
+        rate = f"{self.throughput / 1e6:.1f} Mbps" if self.throughput else '? Mbps'
+        if self.bandwidth:
+            rate += f" vs {self.bandwidth / 1e6:.1f} advertised"
+        return f"{self.packets} TS packets, {codecs}, {rate}"
+
+
+def new_session() -> requests.Session:
+    """Session sized for PROBE_WORKERS threads sharing it"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=PROBE_WORKERS, pool_maxsize=PROBE_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def parse_attributes(text: str) -> Dict[str, str]:
+    """BANDWIDTH=1280000,CODECS="avc1.4d401f,mp4a.40.2" -> dict (quotes stripped)"""
+    attrs, key, value, quoted, in_value = {}, '', '', False, False
+    for ch in text + ',':
+        if in_value:
+            if ch == '"':
+                quoted = not quoted
+            elif ch == ',' and not quoted:
+                attrs[key.strip().upper()] = value
+                key, value, in_value = '', '', False
+            else:
+                value += ch
+        elif ch == '=':
+            in_value = True
+        else:
+            key += ch
+    return attrs
+
+
+def parse_playlist(text: str, base: str):
+    """('master', [(bandwidth, url), ...]) or ('media', {'segments': [...], 'live', 'map', 'key'})"""
+    lines = [line.strip() for line in text.splitlines()]
+    if not lines or not lines[0].lstrip('\ufeff').startswith('#EXTM3U'):
+        raise NotPlaylist('not an HLS playlist')
+    variants, segments = [], []
+    media = {'live': True, 'map': False, 'key': None}
+    pending_bandwidth = None
+    for line in lines[1:]:
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            pending_bandwidth = int(attrs.get('BANDWIDTH', '0') or 0)
+        elif line.startswith('#EXT-X-ENDLIST'):
+            media['live'] = False
+        elif line.startswith('#EXT-X-MAP:'):
+            media['map'] = True
+        elif line.startswith('#EXT-X-KEY:'):
+            method = parse_attributes(line.split(':', 1)[1]).get('METHOD', 'NONE')
+            media['key'] = None if method == 'NONE' else method
+        elif line and not line.startswith('#'):
+            if pending_bandwidth is not None:
+                variants.append((pending_bandwidth, urljoin(base, line)))
+                pending_bandwidth = None
+            else:
+                segments.append(urljoin(base, line))
+    if variants:
+        return 'master', variants
+    if not segments:
+        raise ProbeError('playlist has no segments')
+    media['segments'] = segments
+    return 'media', media
+
+
+def find_sync(data: bytes) -> Optional[int]:
+    """Offset of the first packet: a sync byte followed by two more, 188 bytes apart"""
+    return next((i for i in range(min(TS_PACKET, len(data)))
+                 if data[i] == TS_SYNC and data[i + TS_PACKET:i + TS_PACKET + 1] == b'\x47'
+                 and data[i + 2 * TS_PACKET:i + 2 * TS_PACKET + 1] == b'\x47'), None)
+
+
+def analyze_ts(data: bytes) -> dict:
+    """Packet-level sanity of an MPEG-TS buffer: sync, PAT/PMT, continuity counters"""
+    start = find_sync(data)
+    report = {'packets': 0, 'sync_errors': 0, 'cc_errors': 0, 'pmt_pids': [], 'streams': {}}
+    if start is None:
+        return report
+    continuity = {}
+    pmt_pids = set()
+    for offset in range(start, len(data) - TS_PACKET + 1, TS_PACKET):
+        packet = data[offset:offset + TS_PACKET]
+        report['packets'] += 1
+        if packet[0] != TS_SYNC:
+            report['sync_errors'] += 1
+            continue
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        pusi = packet[1] & 0x40
+        control = (packet[3] >> 4) & 0x3
+        counter = packet[3] & 0x0F
+        payload_at = 4
+        discontinuity = False
+        if control & 0x2:   # adaptation field
+            length = packet[4]
+            discontinuity = length > 0 and bool(packet[5] & 0x80)
+            payload_at = 5 + length
+        if pid == NULL_PID:
+            continue
+
+        if control & 0x1:   # counter only advances on packets with payload
+            last = continuity.get(pid)
+            if last is not None and not discontinuity and counter not in ((last + 1) & 0x0F, last):
+                report['cc_errors'] += 1
+            continuity[pid] = counter
+
+        if not pusi or not control & 0x1 or payload_at >= TS_PACKET:
+            continue
+        section = packet[payload_at + 1 + packet[payload_at]:]   # skip pointer field
+        if len(section) < 8:
+            continue
+        table_id = section[0]
+        section_length = ((section[1] & 0x0F) << 8) | section[2]
+        body = section[8:3 + section_length - 4]   # without header and CRC
+        if pid == 0 and table_id == 0x00:
+            for i in range(0, len(body) - 3, 4):
+                program = (body[i] << 8) | body[i + 1]
+                if program:
+                    pmt_pids.add(((body[i + 2] & 0x1F) << 8) | body[i + 3])
+        elif pid in pmt_pids and table_id == 0x02 and len(body) >= 4:
+            info_length = ((body[2] & 0x0F) << 8) | body[3]
+            i = 4 + info_length
+            while i + 5 <= len(body):
+                stream_type = body[i]
+                es_pid = ((body[i + 1] & 0x1F) << 8) | body[i + 2]
+                report['streams'][es_pid] = STREAM_TYPES.get(stream_type, f"0x{stream_type:02x}")
+                i += 5 + (((body[i + 3] & 0x0F) << 8) | body[i + 4])
+    report['pmt_pids'] = sorted(pmt_pids)
+    return report
+
+
+def _get_text(session: requests.Session, url: str, headers: Dict[str, str], timeout: float) -> Tuple[str, str]:
+    """(final URL, body) of a playlist, refusing anything that isn't playlist-sized"""
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code >= 400:
+            raise ProbeError(f"HTTP {response.status_code}")
+        body = b''
+        for chunk in response.iter_content(64 * 1024):
+            body += chunk
+            if len(body) > PLAYLIST_LIMIT:
+                raise ProbeError('response too large for a playlist')
+            if len(body) >= 7 and not body.lstrip(b'\xef\xbb\xbf').startswith(b'#EXTM3U'):
+                raise NotPlaylist('not an HLS playlist')
+        return response.url, body.decode('utf-8', 'replace')
+
+
+def _read_segment(session: requests.Session, url: str, headers: Dict[str, str],
+                  timeout: float, result: ProbeResult) -> bytes:
+    """First SEGMENT_BYTES of a segment; sets throughput (body bytes over body time)"""
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code >= 400:
+            raise ProbeError(f"segment HTTP {response.status_code}")
+        started = time.perf_counter()
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data += chunk
+            if len(data) >= SEGMENT_BYTES:
+                break
+        seconds = time.perf_counter() - started
+    result.bytes_read = len(data)
+    if seconds > 0 and len(data) >= 64 * 1024:   # too little data says nothing about speed
+        result.throughput = len(data) * 8 / seconds
+    return bytes(data[:SEGMENT_BYTES])
+
+
+def _check_ts(data: bytes, result: ProbeResult):
+    """Fill result from analyze_ts; raises ProbeError when the data isn't sane TS"""
+    report = analyze_ts(data)
+    result.packets = report['packets']
+    result.sync_errors = report['sync_errors']
+    result.cc_errors = report['cc_errors']
+    result.pmt_pids = report['pmt_pids']
+    result.streams = report['streams']
+    if not result.packets:
+        # fMP4/progressive MP4, DASH, ...: reachable, just not ours to judge
+        result.unsupported = data[4:8] in (b'ftyp', b'styp', b'moof', b'sidx')
+        raise ProbeError('not MPEG-TS')
+    if result.sync_errors > result.packets // 100:
+        raise ProbeError(f"{result.sync_errors} lost sync bytes")
+    if not result.pmt_pids:
+        raise ProbeError('no PAT in stream')
+    if not result.streams:
+        raise ProbeError('no PMT in stream')
+    if result.cc_errors > result.packets // 100:
+        raise ProbeError(f"{result.cc_errors} continuity errors")
+
+
+def probe(url: str, headers: Optional[Dict[str, str]] = None, session: Optional[requests.Session] = None,
+          timeout: float = PROBE_TIMEOUT, highest: bool = False) -> ProbeResult:
+    """Deep-probe one HLS (or plain MPEG-TS) URL; never raises, see result.ok / result.error
+
+    Probes the lowest-bandwidth variant (cheapest) unless highest is set.
+    """
+    result = ProbeResult(url)
+    session = session or new_session()
+    headers = headers or {}
+    started = time.perf_counter()
+    try:
+        playlist_url = url
+        try:
+            for _ in range(MAX_HOPS):
+                playlist_url, text = _get_text(session, playlist_url, headers, timeout)
+                kind, parsed = parse_playlist(text, playlist_url)
+                if kind == 'media':
+                    break
+                bandwidth, playlist_url = (max if highest else min)(parsed)
+                result.bandwidth = bandwidth or None
+                result.variant_url = playlist_url
+            else:
+                raise ProbeError('too many nested master playlists')
+        except NotPlaylist:
+            if playlist_url != url:
+                raise
+            # Plain MPEG-TS over HTTP (common in IPTV lists): check the stream itself
+            result.segment_url = url
+            data = _read_segment(session, url, headers, timeout, result)
+            if find_sync(data) is None:
+                result.unsupported = True   # DASH, MP4, ...: reachable, leave it to ffprobe
+                raise ProbeError('not HLS or MPEG-TS')
+            _check_ts(data, result)
+            result.ok = True
+            return result
+
+        segments = parsed['segments']
+        # Live: the oldest segments are about to be deleted; players start near the edge
+        index = max(0, len(segments) - LIVE_EDGE) if parsed['live'] else 0
+        result.segment_url = segments[index]
+        data = _read_segment(session, result.segment_url, headers, timeout, result)
+        if parsed['key'] or parsed['map']:
+            result.unsupported = True
+            raise ProbeError('encrypted segments' if parsed['key'] else 'fMP4 segments')
+        _check_ts(data, result)
+        result.ok = True
+    except ProbeError as e:
+        result.error = str(e)
+    except requests.RequestException as e:
+        result.error = f"{type(e).__name__}"
+    except (ValueError, UnicodeError) as e:
+        result.error = f"bad response: {e}"
+    finally:
+        result.elapsed = time.perf_counter() - started
+    return result
+
+
+def probe_many(targets: List[Tuple[str, Optional[Dict[str, str]]]],
+               workers: int = PROBE_WORKERS) -> List[ProbeResult]:
+    """Probe (url, headers) pairs concurrently; results in input order"""
+    session = new_session()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda target: probe(target[0], target[1], session), targets))
+
+
+def entry_headers(entry: m3u_parser.Entry) -> Dict[str, str]:
+    """HTTP headers a player would send for this entry (#EXTVLCOPT referrer / user agent)"""
+    options = entry.vlc_options
+    headers = {}
+    if options.get('http-referrer'):
+        headers['Referer'] = options['http-referrer']
+    if options.get('http-user-agent'):
+        headers['User-Agent'] = options['http-user-agent']
+    return headers
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 2 and argv[0] == '--playlist':
+        entries = list(m3u_parser.iter_entries(argv[1]))
+        names = [entry.name for entry in entries]
+        targets = [(entry.url, entry_headers(entry)) for entry in entries]
+    elif argv and not argv[0].startswith('-'):
+        names, targets = list(argv), [(url, None) for url in argv]
+    else:
+        print("usage: hls_probe.py URL... | --playlist PLAYLIST", file=sys.stderr)
+        return 2
+    started = time.perf_counter()
+    results = probe_many(targets)
+    for name, result in zip(names, results):
+        mark = '✅' if result.ok else ('⚠️ ' if result.unsupported else '✗')
+        print(f"{mark} {name}: {result.summary()} ({result.elapsed:.1f}s)")
+    working = sum(result.ok for result in results)
+    print(f"\n📊 {working}/{len(results)} verified in {time.perf_counter() - started:.1f}s")
+    return 0 if working == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
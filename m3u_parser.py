@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Streaming M3U playlist parser shared by the playlist tools
+Reads bytes line by line and keeps every line as read, so a playlist that
+isn't modified is written back byte-for-byte (CRLF, blank lines, unknown
+directives and all). Entries only split their #EXTINF line into name and
+attributes when asked.
+
+Usage from shell scripts:
+    python3 m3u_parser.py --tsv Arabic.m3u     # name<TAB>url per channel
+"""
+
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+EXTINF = b'#EXTINF'
+BOM = b'\xef\xbb\xbf'
+ATTR_RE = re.compile(r'([A-Za-z0-9_-]+)="([^"]*)"')
+READ_BUFFER = 1 << 20   # bytes per read for multi-megabyte community playlists
+
+
+def split_extinf(line: str):
+    """(duration, attribute text, name) of an #EXTINF line; commas inside quotes don't split"""
+    body = line.split(':', 1)[1] if ':' in line else ''
+    quoted = False
+    for i, ch in enumerate(body):
+        if ch == '"':
+            quoted = not quoted
+        elif ch == ',' and not quoted:
+            head, name = body[:i], body[i + 1:]
+            break
+    else:
+        head, name = body, ''
+    head = head.strip()
+    duration, _, attributes = head.partition(' ')
+    return duration, attributes, name.strip()
+
+
+class Entry:
+    """One channel: the #EXTINF line, any directive/blank lines after it, and the URL line
+
+    Lines are kept as raw bytes with their line endings; name, attrs and
+    options are decoded on first access.
+    """
+
+    __slots__ = ('_lines', '_parsed', '_attrs')
+
+    def __init__(self, lines: List[bytes]):
+        self._lines = lines     # [#EXTINF ..., (#EXTVLCOPT... | blank)*, url]
+        self._parsed = None     # (duration, attribute text, name)
+        self._attrs = None
+
+    @classmethod
+    def new(cls, name: str, url: str, attrs: Optional[Dict[str, str]] = None,
+            duration: str = '-1', options: Optional[List[str]] = None) -> 'Entry':
+        """Build an entry for appending to a playlist"""
+        attr_text = ''.join(f' {k}="{v}"' for k, v in (attrs or {}).items())
+        lines = [f"#EXTINF:{duration}{attr_text},{name}\n".encode('utf-8')]
+        lines += [f"{option}\n".encode('utf-8') for option in options or ()]
+        lines.append(f"{url}\n".encode('utf-8'))
+        return cls(lines)
+
+    def _extinf(self):
+        if self._parsed is None:
+            self._parsed = split_extinf(self.metadata)
+        return self._parsed
+
+    @property
+    def metadata(self) -> str:
+        """The #EXTINF line, decoded, without its line ending"""
+        return self._lines[0].rstrip(b'\r\n').decode('utf-8', 'replace')
+
+    @property
+    def name(self) -> str:
+        return self._extinf()[2]
+
+    @property
+    def duration(self) -> str:
+        return self._extinf()[0]
+
+    @property
+    def attrs(self) -> Dict[str, str]:
+        """tvg-id, tvg-name, tvg-logo, group-title, ... as written"""
+        if self._attrs is None:
+            self._attrs = dict(ATTR_RE.findall(self._extinf()[1]))
+        return self._attrs
+
+    @property
+    def tvg_id(self) -> str:
+        return self.attrs.get('tvg-id', '')
+
+    @property
+    def group_title(self) -> str:
+        return self.attrs.get('group-title', '')
+
+    @property
+    def options(self) -> List[str]:
+        """Directive lines between #EXTINF and the URL (#EXTVLCOPT:..., #KODIPROP:..., ...)"""
+        return [line.strip().decode('utf-8', 'replace') for line in self._lines[1:-1] if line.strip()]
+
+    @property
+    def vlc_options(self) -> Dict[str, str]:
+        """#EXTVLCOPT:key=value pairs, e.g. {'http-referrer': ..., 'http-user-agent': ...}"""
+        opts = {}
+        for option in self.options:
+            if option.startswith('#EXTVLCOPT:'):
+                key, _, value = option[len('#EXTVLCOPT:'):].partition('=')
+                opts[key.strip()] = value.strip()
+        return opts
+
+    @property
+    def url(self) -> str:
+        return self._lines[-1].strip().decode('utf-8', 'replace')
+
+    @url.setter
+    def url(self, url: str):
+        old = self._lines[-1]
+        if url == self.url:
+            return
+        ending = old[len(old.rstrip(b'\r\n')):]
+        self._lines[-1] = url.encode('utf-8') + ending
+
+    def to_bytes(self) -> bytes:
+        return b''.join(self._lines)
+
+    def __repr__(self):
+        return f"Entry({self.name!r}, {self.url!r})"
+
+
+def _open(source):
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, 'rb', buffering=READ_BUFFER), True
+    return source, False
+
+
+def iter_items(source) -> Iterator[Union[bytes, Entry]]:
+    """Everything in a playlist in order: Entry objects and raw bytes for the lines between them
+
+    source is a path or a binary file object. b''.join of the items (with
+    entries as to_bytes()) is the input, byte for byte. An #EXTINF with no
+    URL before the next #EXTINF or the end of file is passed through as raw
+    bytes, not as an Entry.
+    """
+    f, owned = _open(source)
+    try:
+        raw = []        # lines outside any entry
+        pending = None  # lines of the entry being read
+        first = True
+        for line in f:
+            if first:
+                first = False
+                probe = line[len(BOM):] if line.startswith(BOM) else line
+            else:
+                probe = line
+            if probe.startswith(EXTINF):
+                if pending is not None:
+                    raw.extend(pending)   # previous #EXTINF never got a URL
+                if raw:
+                    yield b''.join(raw)
+                    raw = []
+                pending = [line]
+            elif pending is not None:
+                pending.append(line)
+                if line[:1] != b'#' and line.strip():
+                    yield Entry(pending)
+                    pending = None
+            else:
+                raw.append(line)
+        if pending is not None:
+            raw.extend(pending)
+        if raw:
+            yield b''.join(raw)
+    finally:
+        if owned:
+            f.close()
+
+
+def iter_entries(source) -> Iterator[Entry]:
+    """Just the channel entries, streamed"""
+    for item in iter_items(source):
+        if item.__class__ is Entry:
+            yield item
+
+
+class Playlist:
+    """A whole playlist kept as items, for editing and writing back"""
+
+    def __init__(self, items: Optional[List[Union[bytes, Entry]]] = None):
+        self.items = items if items is not None else [b'#EXTM3U\n']
+
+    @classmethod
+    def load(cls, source) -> 'Playlist':
+        return cls(list(iter_items(source)))
+
+    @property
+    def entries(self) -> List[Entry]:
+        return [item for item in self.items if item.__class__ is Entry]
+
+    def remove(self, entry: Entry):
+        self.items.remove(entry)
+
+    def append(self, entry: Entry):
+        last = self.items[-1] if self.items else b''
+        last = last.to_bytes() if last.__class__ is Entry else last
+        if last and not last.endswith(b'\n'):
+            self.items.append(b'\n')
+        self.items.append(entry)
+
+    def to_bytes(self) -> bytes:
+        return b''.join(item.to_bytes() if item.__class__ is Entry else item for item in self.items)
+
+    def save(self, path):
+        """Write atomically (temp file + rename) so readers never see half a playlist"""
+        path = Path(path)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.' + path.name + '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for item in self.items:
+                    f.write(item.to_bytes() if item.__class__ is Entry else item)
+            if path.exists():
+                os.chmod(tmp, path.stat().st_mode & 0o777)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+
+def write_tsv(source, out):
+    """name<TAB>url per entry; tabs/newlines in names become spaces"""
+    for entry in iter_entries(source):
+        name = entry.name.replace('\t', ' ')
+        out.write(f"{name}\t{entry.url}\n")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2 or argv[0] != '--tsv':
+        print("usage: m3u_parser.py --tsv PLAYLIST", file=sys.stderr)
+        return 2
+    write_tsv(argv[1], sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
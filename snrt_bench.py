@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark for the SNRT proxies against a local fake CDN
+Starts snrt_bench_origin.py and one proxy (snrt_simple_proxy.py or
+snrt_proxy.py) pointed at it, then runs N TiviMate-style viewers: each
+opens a channel, picks the top variant and keeps polling it, downloading
+every new segment, until the run ends. Latency percentiles, requests/s,
+egress, upstream request amplification and the proxy's peak RSS / CPU are
+printed and saved as JSON so runs can be compared.
+
+Usage:
+    python3 snrt_bench.py --proxy simple --clients 100 --duration 60
+    python3 snrt_bench.py --proxy simple --proxy-args="--mode async" --latency-ms 50 --forbidden-rate 0.01
+    python3 snrt_bench.py --proxy proxy --clients 200 --bandwidth-kbps 20000
+    python3 snrt_bench.py --compare bench-results/a.json bench-results/b.json
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+
+import hls_probe
+import snrt_bench_origin
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+CLIENT_AGENT = f"{snrt_bench_origin.CLIENT_AGENT}/4.7.0 (Linux; Android 11)"
+RESULTS_DIR = "bench-results"
+STARTUP_TIMEOUT = 20       # seconds for origin/proxy to start listening
+REQUEST_TIMEOUT = 15
+LIVE_EDGE = 3              # segments a viewer loads when tuning in
+RETUNE_AFTER = 3           # failed variant polls before reopening the channel
+
+# script, extra arguments (no token refreshes: there is nothing to extract from)
+PROXIES = {
+    'simple': ('snrt_simple_proxy.py', ['--token-margin', '0']),
+    'proxy': ('snrt_proxy.py', []),
+}
+TARGET_DURATION_RE = re.compile(rb'#EXT-X-TARGETDURATION:(\d+)')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, proc: subprocess.Popen, log_path: Path):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            tail = log_path.read_text(errors='replace')[-2000:]
+            raise RuntimeError(f"{proc.args[1]} exited ({proc.returncode}):\n{tail}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port} after {STARTUP_TIMEOUT}s")
+
+
+def start(script: str, args: List[str], cwd: str, log_path: Path) -> subprocess.Popen:
+    log = open(log_path, 'wb')
+    return subprocess.Popen([sys.executable, str(SCRIPT_DIR / script), *args], cwd=cwd,
+                            stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def stop(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+# --- Proxy process accounting (Linux /proc; None elsewhere) ----------------
+
+def process_tree(pid: int) -> List[int]:
+    """pid and all its descendants (--workers forks)"""
+    pids, queue = [], [pid]
+    while queue:
+        current = queue.pop()
+        pids.append(current)
+        for task in Path(f"/proc/{current}/task").glob('*'):
+            try:
+                queue.extend(int(child) for child in (task / 'children').read_text().split())
+            except (OSError, ValueError):
+                pass
+    return pids
+
+
+def peak_rss_mb(pids: List[int]) -> Optional[float]:
+    """Sum of each process's own peak RSS (VmHWM)"""
+    total = None
+    for pid in pids:
+        try:
+            for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+                if line.startswith('VmHWM:'):
+                    total = (total or 0) + int(line.split()[1]) / 1024
+        except (OSError, ValueError):
+            pass
+    return round(total, 1) if total is not None else None
+
+
+def cpu_seconds(pids: List[int]) -> Optional[float]:
+    total = None
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    for pid in pids:
+        try:
+            fields = Path(f"/proc/{pid}/stat").read_text().rsplit(')', 1)[1].split()
+            total = (total or 0) + (int(fields[11]) + int(fields[12])) / ticks   # utime + stime
+        except (OSError, ValueError, IndexError):
+            pass
+    return round(total, 2) if total is not None else None
+
+
+# --- Viewers ----------------------------------------------------------------
+
+class Viewer(threading.Thread):
+    """One TiviMate-style client: open channel, pick a variant, poll it, fetch new segments"""
+
+    def __init__(self, proxy_base: str, channel_path: str, start_at: float, deadline: float, samples: list):
+        super().__init__(daemon=True)
+        self.proxy_base = proxy_base
+        self.channel_url = proxy_base + channel_path
+        self.start_at = start_at
+        self.deadline = deadline
+        self.samples = samples   # shared; list.append is atomic
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = CLIENT_AGENT
+
+    def get(self, url: str, kind: str):
+        """(status, body) — status 0 on a network error; every attempt is recorded"""
+        started = time.monotonic()
+        ttfb, status, body, error = None, 0, b'', None
+        try:
+            with self.session.get(url, timeout=REQUEST_TIMEOUT, stream=True) as response:
+                ttfb = time.monotonic() - started
+                status = response.status_code
+                body = response.content
+        except requests.RequestException as e:
+            error = type(e).__name__
+        self.samples.append({
+            't': started, 'kind': kind, 'proxy': url.startswith(self.proxy_base), 'status': status,
+            'error': error, 'seconds': time.monotonic() - started, 'ttfb': ttfb, 'bytes': len(body),
+        })
+        return status, body
+
+    def pause(self, seconds: float):
+        time.sleep(max(0.0, min(seconds, self.deadline - time.monotonic())))
+
+    def tune(self) -> Optional[str]:
+        """Open the channel; returns the media playlist URL to poll"""
+        while time.monotonic() < self.deadline:
+            status, body = self.get(self.channel_url, 'master')
+            if status == 200:
+                try:
+                    kind, parsed = hls_probe.parse_playlist(body.decode('utf-8', 'replace'), self.channel_url)
+                except hls_probe.ProbeError:
+                    kind = None
+                if kind == 'master':
+                    return max(parsed)[1]
+                if kind == 'media':
+                    return self.channel_url
+            self.pause(1)
+        return None
+
+    def run(self):
+        self.pause(self.start_at - time.monotonic())
+        variant_url = self.tune()
+        seen = set()
+        failures = 0
+        while variant_url and time.monotonic() < self.deadline:
+            polled = time.monotonic()
+            status, body = self.get(variant_url, 'variant')
+            target = float(m.group(1)) if (m := TARGET_DURATION_RE.search(body)) else 4.0
+            try:
+                if status != 200:
+                    raise hls_probe.ProbeError(f"HTTP {status}")
+                kind, parsed = hls_probe.parse_playlist(body.decode('utf-8', 'replace'), variant_url)
+                if kind != 'media':
+                    raise hls_probe.ProbeError('expected a media playlist')
+            except hls_probe.ProbeError:
+                failures += 1
+                if failures >= RETUNE_AFTER:
+                    failures = 0
+                    variant_url = self.tune()
+                self.pause(1)
+                continue
+            failures = 0
+            segments = parsed['segments']
+            new = [url for url in segments if url not in seen]
+            if not seen:
+                new = new[-LIVE_EDGE:]
+            for url in new:
+                if time.monotonic() >= self.deadline:
+                    return
+                self.get(url, 'segment')
+            seen = set(segments)
+            # Players re-poll a live playlist about once per target duration
+            self.pause(target - (time.monotonic() - polled))
+
+
+# --- Reporting --------------------------------------------------------------
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def at(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+    return {'count': len(values), 'p50': at(0.50), 'p95': at(0.95), 'p99': at(0.99),
+            'max': round(values[-1] * 1000, 2)}
+
+
+def summarize(samples: list, seconds: float, origin_before: dict, origin_after: dict) -> dict:
+    proxied = [s for s in samples if s['proxy']]
+    ok = [s for s in proxied if s['status'] == 200]
+    errors = {}
+    for s in samples:
+        if s['status'] != 200:
+            key = s['error'] or str(s['status'])
+            errors[key] = errors.get(key, 0) + 1
+    upstream = {}
+    for key, count in origin_after['requests'].items():
+        caller, kind = key.split('.', 1)
+        if caller == 'proxy':
+            upstream[kind] = count - origin_before['requests'].get(key, 0)
+    upstream_total = sum(upstream.values())
+    proxy_bytes = sum(s['bytes'] for s in proxied)
+    return {
+        'requests': len(samples),
+        'proxy_requests': len(proxied),
+        'direct_requests': len(samples) - len(proxied),   # viewers fetching CDN URLs the proxy handed out
+        'errors': errors,
+        'requests_per_second': round(len(samples) / seconds, 1),
+        'proxy_requests_per_second': round(len(proxied) / seconds, 1),
+        'egress_mbps': round(proxy_bytes * 8 / seconds / 1e6, 2),
+        'client_mbps': round(sum(s['bytes'] for s in samples) * 8 / seconds / 1e6, 2),
+        'latency_ms': {
+            'proxy': percentiles([s['seconds'] for s in ok]),
+            **{kind: percentiles([s['seconds'] for s in ok if s['kind'] == kind])
+               for kind in ('master', 'variant', 'segment')},
+            'direct': percentiles([s['seconds'] for s in samples if not s['proxy'] and s['status'] == 200]),
+        },
+        'segment_ttfb_ms': percentiles([s['ttfb'] for s in ok if s['kind'] == 'segment']),
+        'upstream_requests': upstream,
+        'amplification': round(upstream_total / len(proxied), 3) if proxied else None,
+    }
+
+
+def print_report(result: dict):
+    m = result['metrics']
+    print(f"\n📊 {result['proxy']} {' '.join(result['proxy_args'])} — {result['config']['clients']} viewers, "
+          f"{result['seconds']:.0f}s measured")
+    print(f"   requests: {m['requests']} ({m['requests_per_second']}/s), via proxy {m['proxy_requests']} "
+          f"({m['proxy_requests_per_second']}/s), direct to CDN {m['direct_requests']}")
+    print(f"   egress: {m['egress_mbps']} Mbps from proxy, {m['client_mbps']} Mbps total to viewers")
+    for kind, stats in m['latency_ms'].items():
+        if stats['count']:
+            print(f"   latency {kind:<8} p50 {stats['p50']:>8} ms  p95 {stats['p95']:>8} ms  "
+                  f"p99 {stats['p99']:>8} ms  (n={stats['count']})")
+    print(f"   upstream: {sum(m['upstream_requests'].values())} requests {m['upstream_requests']}, "
+          f"amplification {m['amplification']}")
+    print(f"   proxy: peak RSS {result['peak_rss_mb']} MB, CPU {result['cpu_seconds']} s")
+    if m['errors']:
+        print(f"   errors: {m['errors']}")
+
+
+def flatten(data: dict, prefix: str = '') -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(old_path: str, new_path: str):
+    """Side-by-side of two result files"""
+    old, new = (json.loads(Path(p).read_text()) for p in (old_path, new_path))
+    a = flatten({**old['metrics'], 'peak_rss_mb': old['peak_rss_mb'] or 0, 'cpu_seconds': old['cpu_seconds'] or 0})
+    b = flatten({**new['metrics'], 'peak_rss_mb': new['peak_rss_mb'] or 0, 'cpu_seconds': new['cpu_seconds'] or 0})
+    print(f"{'metric':<32} {Path(old_path).stem:>16} {Path(new_path).stem:>16}   change")
+    for key in sorted(set(a) | set(b)):
+        before, after = a.get(key), b.get(key)
+        change = f"{(after - before) / before * 100:+.1f}%" if before and after is not None else ''
+        print(f"{key:<32} {before if before is not None else '-':>16} {after if after is not None else '-':>16}   {change}")
+
+
+def run(args) -> dict:
+    script, default_args = PROXIES[args.proxy]
+    proxy_args = default_args + shlex.split(args.proxy_args)
+    with tempfile.TemporaryDirectory(prefix='snrt-bench-') as tmp:
+        tmp_path = Path(tmp)
+        origin_port, proxy_port = free_port(), free_port()
+        origin_base = f"http://127.0.0.1:{origin_port}"
+        proxy_base = f"http://127.0.0.1:{proxy_port}"
+
+        origin_args = ['--port', str(origin_port), '--latency-ms', str(args.latency_ms),
+                       '--jitter-ms', str(args.jitter_ms), '--bandwidth-kbps', str(args.bandwidth_kbps),
+                       '--forbidden-rate', str(args.forbidden_rate), '--segment-seconds', str(args.segment_seconds)]
+        if args.no_token:
+            origin_args.append('--no-token')
+        origin = start('snrt_bench_origin.py', origin_args, tmp, tmp_path / 'origin.log')
+        proxy = None
+        try:
+            wait_for_port(origin_port, origin, tmp_path / 'origin.log')
+            channels = snrt_bench_origin.channel_urls(origin_base)
+            (tmp_path / 'channels.json').write_text(json.dumps(channels))
+            # cwd is the temp dir, so the proxy doesn't pick up a real snrt_streams.json
+            proxy = start(script, ['--port', str(proxy_port), '--channels', 'channels.json', *proxy_args],
+                          tmp, tmp_path / 'proxy.log')
+            wait_for_port(proxy_port, proxy, tmp_path / 'proxy.log')
+            print(f"🧪 origin {origin_base}, {args.proxy} proxy {proxy_base} (pid {proxy.pid})", flush=True)
+
+            paths = [f"/{cid}.m3u8" for cid in channels['channels']]
+            if args.proxy == 'simple':
+                paths += [f"/{cid}.m3u8" for cid in channels['static_channels']]
+            paths = paths[:args.channels] if args.channels else paths
+
+            samples = []
+            now = time.monotonic()
+            measure_from = now + args.ramp
+            deadline = measure_from + args.duration
+            viewers = [Viewer(proxy_base, paths[i % len(paths)], now + args.ramp * i / args.clients,
+                              deadline, samples) for i in range(args.clients)]
+            for viewer in viewers:
+                viewer.start()
+            print(f"👥 {args.clients} viewers over {len(paths)} channels, ramp {args.ramp}s, "
+                  f"measuring {args.duration}s...", flush=True)
+            time.sleep(max(0.0, measure_from - time.monotonic()))
+            origin_before = requests.get(f"{origin_base}/_stats", timeout=5).json()
+            for viewer in viewers:
+                viewer.join(timeout=max(0.0, deadline - time.monotonic()) + REQUEST_TIMEOUT)
+            origin_after = requests.get(f"{origin_base}/_stats", timeout=5).json()
+            seconds = origin_after['time'] - origin_before['time']
+            pids = process_tree(proxy.pid)
+            rss, cpu = peak_rss_mb(pids), cpu_seconds(pids)
+        finally:
+            if proxy is not None:
+                stop(proxy)
+            stop(origin)
+
+    window = [s for s in samples if measure_from <= s['t'] < deadline]
+    return {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'proxy': args.proxy,
+        'proxy_args': proxy_args,
+        'config': {'clients': args.clients, 'duration': args.duration, 'ramp': args.ramp,
+                   'channels': len(paths), 'origin': {
+                       'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+                       'bandwidth_kbps': args.bandwidth_kbps, 'forbidden_rate': args.forbidden_rate,
+                       'segment_seconds': args.segment_seconds, 'token': not args.no_token}},
+        'seconds': round(seconds, 2),
+        'metrics': summarize(window, seconds, origin_before, origin_after),
+        'peak_rss_mb': rss,
+        'cpu_seconds': cpu,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load benchmark for the SNRT proxies against a fake CDN")
+    parser.add_argument('--proxy', choices=sorted(PROXIES), default='simple')
+    parser.add_argument('--proxy-args', default='', help='extra proxy arguments, e.g. "--mode async --workers 2"')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=int, default=30, help="measured seconds (after the ramp)")
+    parser.add_argument('--ramp', type=int, default=5, help="seconds over which viewers tune in")
+    parser.add_argument('--channels', type=int, default=0, help="spread viewers over the first N channels (0 = all)")
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--bandwidth-kbps', type=int, default=0)
+    parser.add_argument('--forbidden-rate', type=float, default=0.0)
+    parser.add_argument('--segment-seconds', type=int, default=snrt_bench_origin.SEGMENT_SECONDS)
+    parser.add_argument('--no-token', action='store_true', help="origin accepts SNRT URLs without a token")
+    parser.add_argument('--output', help=f"result JSON (default {RESULTS_DIR}/<proxy>-<time>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    result = run(args)
+    print_report(result)
+    output = Path(args.output or f"{RESULTS_DIR}/{args.proxy}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2) + '\n')
+    print(f"\n💾 {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Fake SNRT/2M CDN for load tests - synthetic live HLS on localhost
+Serves easybroadcast-style tokenized channels (playlist_dvr.m3u8 -> variant
+chunks_dvr.m3u8 -> TS segments) and a 2M-style static channel, all rolling
+in real time, with configurable latency, jitter, per-connection bandwidth
+and injected 403s. Segments are valid MPEG-TS (PAT/PMT + one video PID).
+
+Requests are counted per kind and per caller: anything whose User-Agent
+starts with CLIENT_AGENT is a simulated viewer, everything else is the
+proxy. GET /_stats returns the counters as JSON.
+
+Usage:
+    python3 snrt_bench_origin.py --port 8700 --latency-ms 40 --jitter-ms 20 --forbidden-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PORT = 8700
+TOKEN = "bench-token"
+TOKEN_LIFETIME = 6 * 3600      # seconds; expires= handed out in channel URLs
+SEGMENT_SECONDS = 4
+WINDOW = 6                     # segments listed in a live playlist
+KEEP_SEGMENTS = 3 * WINDOW     # segments still downloadable after leaving the window
+VARIANTS = [(800_000, "640x360"), (2_500_000, "1280x720")]
+SNRT_CHANNELS = ["al-aoula", "arriadia", "assadissa", "al-maghribia", "tamazight", "laayoune"]
+STATIC_CHANNEL = "2m"
+CLIENT_AGENT = "TiviMate"      # User-Agent prefix of simulated viewers
+WRITE_CHUNK = 16 * 1024        # throttled writes go out in chunks this size
+
+TS_PACKET = 188
+PMT_PID = 0x100
+VIDEO_PID = 0x101
+
+
+def crc32_mpeg2(data):
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def _section_packet(pid, section):
+    section += crc32_mpeg2(section).to_bytes(4, 'big')
+    payload = b'\x00' + section   # pointer field
+    return bytes([0x47, 0x40 | (pid >> 8), pid & 0xFF, 0x10]) + payload + b'\xff' * (184 - len(payload))
+
+
+def make_segment(bandwidth, seconds=SEGMENT_SECONDS):
+    """bandwidth * seconds worth of MPEG-TS: PAT, PMT, then H.264-typed filler packets"""
+    pat = bytes([0x00, 0xB0, 13, 0x00, 0x01, 0xC1, 0x00, 0x00,
+                 0x00, 0x01, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF])
+    pmt = bytes([0x02, 0xB0, 18, 0x00, 0x01, 0xC1, 0x00, 0x00,
+                 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00,
+                 0x1B, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00])
+    packets = [_section_packet(0, pat), _section_packet(PMT_PID, pmt)]
+    count = max(1, bandwidth * seconds // 8 // TS_PACKET - 2)
+    payload = bytes(184)
+    for cc in range(count):
+        packets.append(bytes([0x47, VIDEO_PID >> 8, VIDEO_PID & 0xFF, 0x10 | (cc & 0x0F)]) + payload)
+    return b''.join(packets)
+
+
+class OriginConfig:
+    def __init__(self, latency_ms=0, jitter_ms=0, bandwidth_kbps=0, forbidden_rate=0.0,
+                 segment_seconds=SEGMENT_SECONDS, require_token=True):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bandwidth_kbps = bandwidth_kbps   # per response; 0 = unthrottled
+        self.forbidden_rate = forbidden_rate   # share of requests answered 403 at random
+        self.segment_seconds = segment_seconds
+        self.require_token = require_token
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class OriginStats:
+    """Request counters by (caller, kind), safe to bump from handler threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.bytes = {}
+
+    def count(self, caller, kind, nbytes=0):
+        key = f"{caller}.{kind}"
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.bytes[caller] = self.bytes.get(caller, 0) + nbytes
+
+    def snapshot(self):
+        with self.lock:
+            return {'requests': dict(self.counts), 'bytes': dict(self.bytes), 'time': time.time()}
+
+
+def channel_urls(base_url, expires=None):
+    """Proxy --channels overrides pointing every channel at this origin"""
+    expires = expires or int(time.time()) + TOKEN_LIFETIME
+    query = f"token={TOKEN}&expires={expires}"
+    return {
+        'channels': {cid: f"{base_url}/abr_corp/{cid}/playlist_dvr.m3u8?{query}" for cid in SNRT_CHANNELS},
+        'static_channels': {STATIC_CHANNEL: {'master_url': f"{base_url}/{STATIC_CHANNEL}/hls/master.m3u8",
+                                             'base_url': f"{base_url}/{STATIC_CHANNEL}/hls/",
+                                             'headers': {}}},
+    }
+
+
+def make_handler(config, stats):
+    segments = {bandwidth: make_segment(bandwidth, config.segment_seconds) for bandwidth, _ in VARIANTS}
+
+    def live_edge():
+        return int(time.time() // config.segment_seconds)
+
+    def master_playlist(variant_uri):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        for bandwidth, resolution in VARIANTS:
+            lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={resolution},"
+                         f'CODECS="avc1.64001f"')
+            lines.append(variant_uri(bandwidth))
+        return "\n".join(lines) + "\n"
+
+    def media_playlist(segment_uri):
+        edge = live_edge()
+        first = edge - WINDOW + 1
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{config.segment_seconds}",
+                 f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+        for seq in range(first, edge + 1):
+            lines.append(f"#EXTINF:{config.segment_seconds:.3f},")
+            lines.append(segment_uri(seq))
+        return "\n".join(lines) + "\n"
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def caller(self):
+            return 'client' if self.headers.get('User-Agent', '').startswith(CLIENT_AGENT) else 'proxy'
+
+        def reply(self, kind, status, body, content_type='application/vnd.apple.mpegurl'):
+            if config.latency_ms or config.jitter_ms:
+                time.sleep((config.latency_ms + random.uniform(0, config.jitter_ms)) / 1000)
+            if status == 200 and config.forbidden_rate and random.random() < config.forbidden_rate:
+                status, body, kind, content_type = 403, b'injected 403', 'forbidden', 'text/plain'
+            stats.count(self.caller(), kind, len(body) if status == 200 else 0)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command == 'HEAD':
+                return
+            if not config.bandwidth_kbps:
+                self.wfile.write(body)
+                return
+            rate = config.bandwidth_kbps * 1000 / 8
+            started = time.monotonic()
+            for offset in range(0, len(body), WRITE_CHUNK):
+                self.wfile.write(body[offset:offset + WRITE_CHUNK])
+                ahead = (offset + WRITE_CHUNK) / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        def token_ok(self, query):
+            if not config.require_token:
+                return True
+            try:
+                return query.get('token') == TOKEN and int(query.get('expires', '0')) > time.time()
+            except ValueError:
+                return False
+
+        def segment(self, bandwidth, name):
+            try:
+                seq = int(name[len('seg_'):-len('.ts')])
+            except ValueError:
+                return self.reply('notfound', 404, b'not found', 'text/plain')
+            if not live_edge() - KEEP_SEGMENTS <= seq <= live_edge():
+                return self.reply('notfound', 404, b'segment not available', 'text/plain')
+            self.reply('segment', 200, segments[bandwidth], 'video/mp2t')
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            path = parts.path.strip('/').split('/')
+            bandwidths = {str(bandwidth): bandwidth for bandwidth, _ in VARIANTS}
+
+            if parts.path == '/_stats':
+                body = json.dumps(stats.snapshot()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            # /abr_corp/<channel>/playlist_dvr.m3u8 | /<channel>_<bw>/chunks_dvr.m3u8 | /<channel>_<bw>/seg_N.ts
+            if len(path) >= 3 and path[0] == 'abr_corp' and path[1] in SNRT_CHANNELS:
+                if not self.token_ok(query):
+                    return self.reply('forbidden', 403, b'bad token', 'text/plain')
+                channel = path[1]
+                token = f"?{parts.query}" if parts.query else ''
+                if path[2:] == ['playlist_dvr.m3u8']:
+                    body = master_playlist(lambda bw: f"{channel}_{bw}/chunks_dvr.m3u8")
+                    return self.reply('master', 200, body.encode())
+                variant = path[2].rsplit('_', 1)[-1]
+                if len(path) == 4 and variant in bandwidths:
+                    if path[3] == 'chunks_dvr.m3u8':
+                        body = media_playlist(lambda seq: f"seg_{seq}.ts{token}")
+                        return self.reply('variant', 200, body.encode())
+                    if path[3].startswith('seg_'):
+                        return self.segment(bandwidths[variant], path[3])
+
+            # /2m/hls/master.m3u8 | /2m/hls/stream_<bw>/index.m3u8 | /2m/hls/stream_<bw>/seg_N.ts
+            elif path[:2] == [STATIC_CHANNEL, 'hls']:
+                if path[2:] == ['master.m3u8']:
+                    body = master_playlist(lambda bw: f"stream_{bw}/index.m3u8")
+                    return self.reply('master', 200, body.encode())
+                if len(path) == 4 and path[2].startswith('stream_') and path[2][7:] in bandwidths:
+                    if path[3] == 'index.m3u8':
+                        return self.reply('variant', 200, media_playlist(lambda seq: f"seg_{seq}.ts").encode())
+                    if path[3].startswith('seg_'):
+                        return self.segment(bandwidths[path[2][7:]], path[3])
+
+            self.reply('notfound', 404, b'not found', 'text/plain')
+
+    return Handler
+
+
+class OriginServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(port=PORT, config=None):
+    config = config or OriginConfig()
+    stats = OriginStats()
+    server = OriginServer(('127.0.0.1', port), make_handler(config, stats))
+    return server, stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fake SNRT/2M CDN for load tests")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--latency-ms', type=float, default=0, help="added before every response")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="uniform extra delay, 0..N ms")
+    parser.add_argument('--bandwidth-kbps', type=int, default=0, help="per-response throttle (0 = off)")
+    parser.add_argument('--forbidden-rate', type=float, default=0.0, help="share of requests answered 403")
+    parser.add_argument('--segment-seconds', type=int, default=SEGMENT_SECONDS)
+    parser.add_argument('--no-token', action='store_true', help="don't check token/expires on SNRT paths")
+    parser.add_argument('--print-channels', action='store_true',
+                        help="print the proxy --channels JSON for this origin and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    base_url = f"http://127.0.0.1:{args.port}"
+    if args.print_channels:
+        print(json.dumps(channel_urls(base_url), indent=2))
+        return
+    config = OriginConfig(args.latency_ms, args.jitter_ms, args.bandwidth_kbps, args.forbidden_rate,
+                          args.segment_seconds, not args.no_token)
+    server, _ = serve(args.port, config)
+    print(f"🧪 Fake CDN on {base_url} ({json.dumps(config.as_dict())})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Circuit breakers for the SNRT proxy's upstreams
+One breaker per (upstream host, channel). After FAILURE_THRESHOLD failures
+in a row it opens and requests fail at once instead of each waiting out
+the upstream timeout; after a cool-down one trial request is let through
+(half-open) and its outcome closes the breaker or opens it for longer.
+Breakers hold no awaitable state, so both server modes share them.
+"""
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURE_THRESHOLD = 5    # consecutive failures that open a breaker
+OPEN_SECONDS = 5         # first cool-down before a trial request, doubling
+OPEN_MAX = 120           # cap on the cool-down
+TRIAL_TIMEOUT = 30       # seconds before a trial that never reported is given up on
+HISTORY = 20             # transitions remembered per breaker (admin endpoint)
+
+
+class CircuitOpen(Exception):
+    """Upstream is failing; the request was not sent"""
+
+    def __init__(self, breaker, retry_after):
+        super().__init__(f"circuit open for {breaker.channel_id}@{breaker.host} "
+                         f"(retry in {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+def is_failure_status(status):
+    """Statuses that mean the upstream itself is in trouble (4xx answers are quick and not its fault)"""
+    return status >= 500 or status == 429
+
+
+class Breaker:
+    """Closed / open / half-open state of one upstream host for one channel"""
+
+    def __init__(self, host, channel_id, on_transition=None):
+        self.host = host
+        self.channel_id = channel_id
+        self.state = CLOSED
+        self.failures = 0            # consecutive
+        self.opened_at = None
+        self.open_for = OPEN_SECONDS
+        self.trial_started = None    # monotonic time the half-open trial went out
+        self.rejected = 0            # requests failed fast while open
+        self.last_error = None
+        self.transitions = deque(maxlen=HISTORY)
+        self._on_transition = on_transition
+        self._lock = threading.Lock()
+
+    def _move(self, state, reason):
+        previous, self.state = self.state, state
+        self.transitions.append({'at': time.time(), 'from': previous, 'to': state, 'reason': reason})
+        if self._on_transition:
+            self._on_transition(self, previous, state)
+
+    def allow(self):
+        """Raise CircuitOpen unless a request may go upstream now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_for - now
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(self, remaining)
+                self._move(HALF_OPEN, 'cool-down over, sending a trial request')
+                self.trial_started = now
+                return
+            # Half-open: one trial at a time; a trial that never reported is replaced
+            if now - self.trial_started < TRIAL_TIMEOUT:
+                self.rejected += 1
+                raise CircuitOpen(self, TRIAL_TIMEOUT - (now - self.trial_started))
+            self.trial_started = now
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self.open_for = OPEN_SECONDS
+                self._move(CLOSED, 'trial request succeeded')
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.state == HALF_OPEN:
+                self.open_for = min(self.open_for * 2, OPEN_MAX)
+                self._open(f"trial request failed: {error}")
+            elif self.state == CLOSED and self.failures >= FAILURE_THRESHOLD:
+                self._open(f"{self.failures} failures in a row, last: {error}")
+
+    def _open(self, reason):
+        self.opened_at = time.monotonic()
+        self._move(OPEN, reason)
+
+    def record_status(self, status):
+        if is_failure_status(status):
+            self.failure(f"HTTP {status}")
+        else:
+            self.success()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.open_for = OPEN_SECONDS
+            if self.state != CLOSED:
+                self._move(CLOSED, 'reset by admin')
+
+    def snapshot(self):
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.opened_at + self.open_for - time.monotonic()), 1)
+            return {
+                'host': self.host, 'channel': self.channel_id, 'state': self.state,
+                'failures': self.failures, 'retry_in': retry_in, 'rejected': self.rejected,
+                'last_error': self.last_error, 'transitions': list(self.transitions),
+            }
+
+
+class BreakerRegistry:
+    """Breaker per (host of an upstream URL, channel), created on first use"""
+
+    def __init__(self, on_transition=None):
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._on_transition = on_transition
+
+    def get(self, url, channel_id):
+        host = urlsplit(url).netloc
+        key = (host, channel_id)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(key)
+                if breaker is None:
+                    breaker = self._breakers[key] = Breaker(host, channel_id, self._on_transition)
+        return breaker
+
+    def reset(self):
+        for breaker in list(self._breakers.values()):
+            breaker.reset()
+
+    def snapshot(self):
+        return [breaker.snapshot() for breaker in list(self._breakers.values())]
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Shared caches for the SNRT proxy
+Every cache here works from both server modes: get() for the threaded
+handlers, aget() for the asyncio ones.
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+
+TARGETDURATION_RE = re.compile(rb'#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)')
+MIN_PLAYLIST_TTL = 0.5       # seconds
+MAX_PLAYLIST_TTL = 10.0
+MASTER_PLAYLIST_TTL = 10.0   # playlists without TARGETDURATION (master / variant lists)
+STALE_KEEP = 60              # seconds an expired entry is kept before being purged
+
+
+def playlist_ttl(body):
+    """Cache lifetime for a playlist body: half its target duration"""
+    m = TARGETDURATION_RE.search(body)
+    if not m:
+        return MASTER_PLAYLIST_TTL
+    # A live playlist gains one segment per target duration; refreshing at half
+    # of it keeps us at most ~TD/2 behind the origin, like a well-behaved player.
+    return max(MIN_PLAYLIST_TTL, min(float(m.group(1)) / 2, MAX_PLAYLIST_TTL))
+
+
+class _Flight:
+    """One in-progress load that concurrent callers wait on (threaded mode)"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class PlaylistCache:
+    """Short-lived cache of rewritten playlists with single-flight loading
+
+    Concurrent misses for the same key share one loader call; every waiter
+    receives the same value (or the same exception). None results are not cached.
+    """
+
+    def __init__(self, ttl_for=playlist_ttl):
+        self._ttl_for = ttl_for
+        self._entries = {}   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._flights = {}   # key -> _Flight (threaded mode)
+        self._futures = {}   # key -> asyncio.Task (async mode)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _fresh(self, key, now):
+        entry = self._entries.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        return None
+
+    def _store(self, key, value):
+        if value is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + self._ttl_for(value), value)
+            if len(self._entries) > 256:
+                cutoff = now - STALE_KEEP
+                for k in [k for k, (exp, _) in self._entries.items() if exp < cutoff]:
+                    del self._entries[k]
+
+    def get(self, key, loader, timeout=30):
+        """Return the cached value for key, calling loader() once on a miss"""
+        with self._lock:
+            value = self._fresh(key, time.monotonic())
+            if value is not None:
+                self.hits += 1
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise TimeoutError("timed out waiting for shared playlist load")
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self._store(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    async def aget(self, key, loader):
+        """Event-loop version of get(); loader is a coroutine function"""
+        value = self._fresh(key, time.monotonic())
+        if value is not None:
+            self.hits += 1
+            return value
+        task = self._futures.get(key)
+        if task is None:
+            self.misses += 1
+            # The load runs as its own task so a cancelled first caller
+            # doesn't cancel it for everyone else waiting on it
+            task = self._futures[key] = asyncio.ensure_future(self._aload(key, loader))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _aload(self, key, loader):
+        try:
+            value = await loader()
+            self._store(key, value)
+            return value
+        finally:
+            self._futures.pop(key, None)
+
+    def last_good(self, key):
+        """key's last loaded value even if expired (kept up to STALE_KEEP), or None"""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic() - STALE_KEEP:
+            return entry[1]
+        return None
+
+    def expires_in(self, key):
+        """Seconds until key's entry goes stale (0 if missing or already stale)"""
+        entry = self._entries.get(key)
+        if not entry:
+            return 0
+        return max(0.0, entry[0] - time.monotonic())
+
+    def clear(self, renamed=None):
+        """Expire every entry; values stay available to last_good() for STALE_KEEP.
+        renamed maps old keys to the keys they are known by from now on"""
+        now = time.monotonic()
+        with self._lock:
+            for key, (_, value) in list(self._entries.items()):
+                self._entries[key] = (now, value)
+        self.rename(renamed or {})
+
+    def rename(self, renamed):
+        """Move entries to new keys (old -> new), expired: the new key was never loaded"""
+        now = time.monotonic()
+        with self._lock:
+            for old, new in renamed.items():
+                entry = self._entries.pop(old, None)
+                if entry is not None and new not in self._entries:
+                    self._entries[new] = (min(entry[0], now), entry[1])
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {'entries': len(self._entries), 'hits': self.hits,
+                'misses': self.misses, 'coalesced': self.coalesced,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+# ---------------------------------------------------------------------------
+# Segment cache
+# ---------------------------------------------------------------------------
+
+SEGMENT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class CachedSegment:
+    __slots__ = ('body', 'content_type', 'extra_headers')
+
+    def __init__(self, body, content_type, extra_headers):
+        self.body = body
+        self.content_type = content_type
+        self.extra_headers = extra_headers
+
+
+class SegmentFill:
+    """A segment download in progress that any number of clients stream from
+
+    The downloader calls start() / append() / finish() or fail(); readers
+    follow along with iter_chunks() (threaded) or aiter_chunks() (asyncio).
+    """
+
+    def __init__(self, asynchronous):
+        self.content_type = None
+        self.length = None
+        self.extra_headers = {}
+        self.chunks = []
+        self.size = 0
+        self.started = False
+        self.done = False
+        self.error = None
+        self._asynchronous = asynchronous
+        if asynchronous:
+            self._event = asyncio.Event()
+        else:
+            self._cond = threading.Condition()
+
+    def _update(self, change):
+        if self._asynchronous:
+            change()
+            # Wake everyone waiting on the old event; later waits use the new one
+            event, self._event = self._event, asyncio.Event()
+            event.set()
+        else:
+            with self._cond:
+                change()
+                self._cond.notify_all()
+
+    def start(self, content_type, length, extra_headers):
+        def change():
+            self.content_type = content_type
+            self.length = length
+            self.extra_headers = extra_headers
+            self.started = True
+        self._update(change)
+
+    def append(self, data):
+        def change():
+            self.chunks.append(data)
+            self.size += len(data)
+        self._update(change)
+
+    def finish(self):
+        def change():
+            self.done = True
+        self._update(change)
+
+    def fail(self, error):
+        def change():
+            self.error = error
+            self.done = True
+        self._update(change)
+
+    def wait_head(self, timeout):
+        """Block until the response head is known; raises the download error if it failed first"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.started or self.done, timeout):
+                raise TimeoutError("timed out waiting for upstream segment")
+        if not self.started:
+            raise self.error
+
+    def iter_chunks(self, timeout):
+        index = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: index < len(self.chunks) or self.done, timeout):
+                    raise TimeoutError("upstream segment stalled")
+                new = self.chunks[index:]
+                done, error = self.done, self.error
+            for data in new:
+                yield data
+            index += len(new)
+            if done and index == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    async def await_head(self, timeout):
+        while not (self.started or self.done):
+            await asyncio.wait_for(self._event.wait(), timeout)
+        if not self.started:
+            raise self.error
+
+    async def aiter_chunks(self, timeout):
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await asyncio.wait_for(self._event.wait(), timeout)
+
+
+class SegmentCache:
+    """Byte-budgeted LRU of media segments keyed by upstream URL
+
+    - join() deduplicates in-flight downloads: the first caller downloads,
+      everyone else streams from the same SegmentFill
+    - retain_window() drops segments once they leave their live playlist
+    """
+
+    def __init__(self, max_bytes=SEGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 4
+        self._entries = OrderedDict()   # url -> CachedSegment, oldest first
+        self._bytes = 0
+        self._fills = {}                # url -> SegmentFill
+        self._windows = {}              # playlist url -> set of segment urls
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.window_evictions = 0
+        self.prefetched = 0
+
+    def lookup(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+                self.hits += 1
+            return entry
+
+    def join(self, url, asynchronous):
+        """Return (fill, is_leader) for a segment not in the cache"""
+        with self._lock:
+            fill = self._fills.get(url)
+            if fill is not None:
+                self.coalesced += 1
+                return fill, False
+            self.misses += 1
+            fill = self._fills[url] = SegmentFill(asynchronous)
+            return fill, True
+
+    def claim(self, url, asynchronous):
+        """Start a prefetch fill for url unless it is cached or already downloading"""
+        with self._lock:
+            if url in self._entries or url in self._fills:
+                return None
+            self.prefetched += 1
+            fill = self._fills[url] = SegmentFill(asynchronous)
+            return fill
+
+    def complete(self, url, fill):
+        """Called by the downloader when a fill ends, successfully or not"""
+        with self._lock:
+            self._fills.pop(url, None)
+            if fill.error is not None or fill.size > self.max_entry_bytes:
+                return
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[url] = CachedSegment(b''.join(fill.chunks), fill.content_type,
+                                               fill.extra_headers)
+            self._bytes += fill.size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self.evictions += 1
+
+    def has_window(self, playlist_url):
+        return playlist_url in self._windows
+
+    def retain_window(self, playlist_url, segment_urls):
+        """Record a playlist's current segments and evict the ones that left it"""
+        current = set(segment_urls)
+        with self._lock:
+            previous = self._windows.get(playlist_url, set())
+            for url in previous - current:
+                entry = self._entries.pop(url, None)
+                if entry is not None:
+                    self._bytes -= len(entry.body)
+                    self.window_evictions += 1
+            self._windows[playlist_url] = current
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {'entries': len(self._entries), 'bytes': self._bytes,
+                'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses,
+                'coalesced': self.coalesced, 'evictions': self.evictions,
+                'window_evictions': self.window_evictions, 'prefetched': self.prefetched,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+HTTP/1.1 client-side framing for the SNRT proxy
+Request parsing, keep-alive with pipelining, HEAD and single byte-ranges,
+shared by the threaded (raw socket) and asyncio server modes
+"""
+import asyncio
+import re
+import socket
+
+MAX_REQUEST_HEAD = 16384   # bytes
+MAX_REQUEST_BODY = 16384   # bytes; GET/HEAD carry none, anything larger is refused
+FIRST_REQUEST_TIMEOUT = 30 # seconds to wait for the first request on a new connection
+KEEPALIVE_TIMEOUT = 15     # seconds an idle keep-alive connection is held open
+SEND_TIMEOUT = 30          # seconds a blocked send may stall (threaded mode)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class BadRequest(Exception):
+    """Client sent something that isn't a usable HTTP request"""
+
+    def __init__(self, message, status="400 Bad Request"):
+        super().__init__(message)
+        self.status = status
+
+
+def request_body_length(request):
+    """Content-Length of a request body we are willing to read and discard"""
+    length = request.headers.get('content-length', '0')
+    length = int(length) if length.isdigit() else 0
+    if length > MAX_REQUEST_BODY:
+        raise BadRequest("request body too large", "413 Payload Too Large")
+    return length
+
+
+class RangeNotSatisfiable(Exception):
+    """Range header lies entirely outside the resource"""
+
+
+class Request:
+    __slots__ = ('method', 'path', 'version', 'headers')
+
+    def __init__(self, method, path, version, headers):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers  # lower-cased names
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.1':
+            return 'close' not in connection
+        return 'keep-alive' in connection
+
+
+def parse_request_head(head):
+    """Parse the bytes before the blank line into a Request"""
+    lines = head.decode('iso-8859-1').split('\r\n')
+    parts = lines[0].split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise BadRequest(f"bad request line: {lines[0][:80]!r}")
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return Request(parts[0], parts[1], parts[2], headers)
+
+
+def parse_range(value, total):
+    """Resolve a single 'bytes=' range to inclusive (start, end), or None to serve it all"""
+    m = RANGE_RE.match(value.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        # Multiple ranges or garbage — ignoring Range and sending 200 is allowed
+        return None
+    if not m.group(1):
+        suffix = int(m.group(2))
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        return max(0, total - suffix), total - 1
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else total - 1
+    if start >= total or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, total - 1)
+
+
+def plan_ranged_response(range_header, total, extra_headers):
+    """(status, content_length, headers, start, end) for a byte-addressable body
+
+    end is inclusive, or None for "to the end"; total may be None when the
+    length isn't known yet (Range is then ignored).
+    """
+    headers = dict(extra_headers)
+    headers['Accept-Ranges'] = 'bytes'
+    if not range_header or total is None:
+        return "200 OK", total, headers, 0, None
+    try:
+        byte_range = parse_range(range_header, total)
+    except RangeNotSatisfiable:
+        headers['Content-Range'] = f"bytes */{total}"
+        return "416 Range Not Satisfiable", 0, headers, 0, -1
+    if byte_range is None:
+        return "200 OK", total, headers, 0, None
+    start, end = byte_range
+    headers['Content-Range'] = f"bytes {start}-{end}/{total}"
+    return "206 Partial Content", end - start + 1, headers, start, end
+
+
+def slice_chunk(data, offset, start, end):
+    """The part of data (which begins at byte offset) that falls inside [start, end]"""
+    lo = max(start - offset, 0)
+    hi = len(data) if end is None else min(end + 1 - offset, len(data))
+    return data[lo:hi] if hi > lo else b''
+
+
+def build_response_head(status, content_type, content_length=None, extra_headers=None, chunked=True):
+    """Serialize a response head; no content_length means a chunked (or close-delimited) body"""
+    lines = [f"HTTP/1.1 {status}", f"Content-Type: {content_type}"]
+    if content_length is not None:
+        lines.append(f"Content-Length: {content_length}")
+    elif chunked:
+        lines.append("Transfer-Encoding: chunked")
+    for name, value in (extra_headers or {}).items():
+        lines.append(f"{name}: {value}")
+    lines.append("Access-Control-Allow-Origin: *")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+
+def encode_chunk(data):
+    """Frame bytes for Transfer-Encoding: chunked (empty data ends the body)"""
+    return b'%x\r\n' % len(data) + data + b'\r\n'
+
+
+class _ResponseState:
+    """Per-connection framing decisions shared by both connection types"""
+
+    def __init__(self):
+        self.request = None
+        self.keep_alive = False
+        self.requests_served = 0
+        self.status = None      # status code of the current response, once its head is built
+        self.bytes_sent = 0     # bytes written for the current response, head included
+        self._chunked = False
+
+    @property
+    def head_only(self):
+        return self.request is not None and self.request.method == 'HEAD'
+
+    def _accept(self, request):
+        self.request = request
+        self.keep_alive = request.keep_alive
+        self.requests_served += 1
+        self.status = None
+        self.bytes_sent = 0
+
+    def _head(self, status, content_type, content_length, extra_headers):
+        self.status = status.split(' ', 1)[0]
+        http11 = self.request is None or self.request.version == 'HTTP/1.1'
+        self._chunked = content_length is None and http11
+        if content_length is None and not http11:
+            # HTTP/1.0 can't frame an unknown length — end it by closing
+            self.keep_alive = False
+        headers = dict(extra_headers or {})
+        if self.keep_alive:
+            headers['Connection'] = 'keep-alive'
+            headers['Keep-Alive'] = f"timeout={KEEPALIVE_TIMEOUT}"
+        else:
+            headers['Connection'] = 'close'
+        return build_response_head(status, content_type, content_length, headers, chunked=self._chunked)
+
+    def _frame(self, data):
+        if self.head_only:
+            return b''
+        return encode_chunk(data) if self._chunked else data
+
+    def _end(self):
+        if self.head_only or not self._chunked:
+            return b''
+        return encode_chunk(b'')
+
+
+class ClientConnection(_ResponseState):
+    """Blocking client socket speaking HTTP/1.1 (threaded mode)"""
+
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+        self._buffer = b''
+
+    def _recv(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("client closed")
+        self._buffer += data
+
+    def read_request(self):
+        """Next (possibly pipelined) request, or None on idle timeout / close"""
+        timeout = KEEPALIVE_TIMEOUT if self.requests_served else FIRST_REQUEST_TIMEOUT
+        self.sock.settimeout(timeout)
+        try:
+            while True:
+                self._buffer = self._buffer.lstrip(b'\r\n')
+                end = self._buffer.find(b'\r\n\r\n')
+                if end >= 0:
+                    break
+                if len(self._buffer) > MAX_REQUEST_HEAD:
+                    raise BadRequest("request head too large")
+                self._recv()
+            request = parse_request_head(self._buffer[:end])
+            self._buffer = self._buffer[end + 4:]
+            # We only serve GET/HEAD, but a body must still be consumed to keep framing
+            length = request_body_length(request)
+            while len(self._buffer) < length:
+                self._recv()
+            self._buffer = self._buffer[length:]
+        except (socket.timeout, ConnectionError):
+            return None
+        self.sock.settimeout(SEND_TIMEOUT)
+        self._accept(request)
+        return request
+
+    def _sendall(self, data):
+        self.sock.sendall(data)
+        self.bytes_sent += len(data)
+
+    def send_head(self, status, content_type, content_length=None, extra_headers=None):
+        self._sendall(self._head(status, content_type, content_length, extra_headers))
+
+    def send_body(self, data):
+        framed = self._frame(data)
+        if framed:
+            self._sendall(framed)
+
+    def end_body(self):
+        tail = self._end()
+        if tail:
+            self._sendall(tail)
+
+    def send(self, status, content_type, body, extra_headers=None):
+        """Send a complete response in one write"""
+        head = self._head(status, content_type, len(body), extra_headers)
+        self._sendall(head if self.head_only else head + body)
+
+    def close(self):
+        self.sock.close()
+
+
+class AsyncClientConnection(_ResponseState):
+    """asyncio stream pair speaking HTTP/1.1 (event-loop mode)"""
+
+    def __init__(self, reader, writer):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+
+    async def read_request(self):
+        """Next (possibly pipelined) request, or None on idle timeout / close"""
+        timeout = KEEPALIVE_TIMEOUT if self.requests_served else FIRST_REQUEST_TIMEOUT
+        try:
+            while True:
+                head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+                head = head.lstrip(b'\r\n')
+                if head:
+                    break
+            request = parse_request_head(head[:-4])
+            length = request_body_length(request)
+            if length:
+                await asyncio.wait_for(self.reader.readexactly(length), timeout)
+        except asyncio.LimitOverrunError:
+            raise BadRequest("request head too large")
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        self._accept(request)
+        return request
+
+    async def _write(self, data):
+        self.writer.write(data)
+        self.bytes_sent += len(data)
+        await self.writer.drain()
+
+    async def send_head(self, status, content_type, content_length=None, extra_headers=None):
+        await self._write(self._head(status, content_type, content_length, extra_headers))
+
+    async def send_body(self, data):
+        framed = self._frame(data)
+        if framed:
+            await self._write(framed)
+
+    async def end_body(self):
+        tail = self._end()
+        if tail:
+            await self._write(tail)
+
+    async def send(self, status, content_type, body, extra_headers=None):
+        head = self._head(status, content_type, len(body), extra_headers)
+        await self._write(head if self.head_only else head + body)
+
+    def close(self):
+        self.writer.close()
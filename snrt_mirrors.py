@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Mirror selection for channels served from several CDNs
+Each mirror keeps a rolling latency window and an error rate. Channel start
+races the best few; later requests go to the best one and send a hedged
+duplicate to the runner-up once the primary is slower than its own p95.
+Fetches whose time depends on their size (segments) only fail over.
+Attempts that run beside the caller use the channel's own few workers, so
+stalled channels can't hold up fetches for the others.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+LATENCY_WINDOW = 50      # latest successful fetch times kept per mirror
+ERROR_DECAY = 0.2        # weight of the newest outcome in the error rate
+ERROR_PENALTY = 5.0      # seconds added to a mirror's score at a 100% error rate
+UNMEASURED_SCORE = 1.0   # seconds assumed for a mirror never fetched from
+MIN_SAMPLES = 5          # below this, hedge after HEDGE_DEFAULT instead of p95
+HEDGE_DEFAULT = 1.0      # seconds
+HEDGE_MIN = 0.05         # never hedge sooner than this
+RACE_WIDTH = 2           # mirrors raced when a channel starts
+WORKERS_PER_CHANNEL = 8  # attempts of one channel running off the request thread
+
+
+class MirrorStats:
+    """Rolling latency/error record of one mirror URL"""
+
+    def __init__(self, url, rank):
+        self.url = url
+        self.rank = rank   # position in the configured list, breaks ties
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.error_rate = 0.0
+        self.requests = 0
+        self.hedges_won = 0   # answers that beat the mirror ranked first at the time
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        """seconds=None: an outcome whose duration says nothing about the mirror"""
+        with self._lock:
+            self.requests += 1
+            if ok and seconds is not None:
+                self.latencies.append(seconds)
+            self.error_rate += ERROR_DECAY * ((0.0 if ok else 1.0) - self.error_rate)
+
+    def p95(self):
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def score(self):
+        """Expected seconds per fetch, errors priced in; lower is better"""
+        with self._lock:
+            if self.latencies:
+                ordered = sorted(self.latencies)
+                latency = ordered[len(ordered) // 2]
+            else:
+                latency = UNMEASURED_SCORE
+            return latency + self.error_rate * ERROR_PENALTY
+
+    def hedge_delay(self):
+        p95 = self.p95()
+        return HEDGE_DEFAULT if p95 is None else max(HEDGE_MIN, p95)
+
+    def snapshot(self):
+        p95 = self.p95()
+        return {
+            'url': self.url, 'score': round(self.score(), 4), 'p95': round(p95, 4) if p95 is not None else None,
+            'error_rate': round(self.error_rate, 3), 'requests': self.requests, 'hedges_won': self.hedges_won,
+        }
+
+
+class MirrorSet:
+    """Ranked mirrors of one channel"""
+
+    def __init__(self, urls):
+        self.mirrors = [MirrorStats(url, rank) for rank, url in enumerate(urls)]
+        self.workers = threading.BoundedSemaphore(WORKERS_PER_CHANNEL)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """Run fn on the channel's pool; the caller holds one of self.workers for it"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=WORKERS_PER_CHANNEL,
+                                                    thread_name_prefix='mirror')
+        return self._executor.submit(fn, *args)
+
+    def __getitem__(self, index):
+        return self.mirrors[index]
+
+    def __len__(self):
+        return len(self.mirrors)
+
+    def ranked(self, among=None):
+        """Mirrors best first; among limits it to those positions in the configured list"""
+        mirrors = self.mirrors if among is None else [self.mirrors[i] for i in among]
+        return sorted(mirrors, key=lambda m: (m.score(), m.rank))
+
+    def snapshot(self):
+        return [m.snapshot() for m in self.ranked()]
+
+
+def _attempt(mirror, fetch, neutral=(), release=None, timed=True):
+    """fetch(mirror) timed and recorded; exceptions are recorded and re-raised"""
+    started = time.monotonic()
+    try:
+        result = fetch(mirror)
+    except neutral:
+        raise   # not the mirror's fault (e.g. no local capacity)
+    except Exception:
+        mirror.record(time.monotonic() - started, False)
+        raise
+    finally:
+        if release is not None:
+            release()
+    mirror.record(time.monotonic() - started if timed else None, True)
+    return result
+
+
+def _pooled(mirrors, mirror, fetch, neutral, release, timed):
+    try:
+        return _attempt(mirror, fetch, neutral, release, timed)
+    finally:
+        mirrors.workers.release()
+
+
+def _no_reservation(mirror, wait):
+    return None
+
+
+def _inline(order, fetch, neutral, reserve, release=None, timed=True):
+    """Try mirrors one after another on the calling thread"""
+    last_error = None
+    for mirror in order:
+        try:
+            if release is None:
+                release = reserve(mirror, True)
+            return mirror, _attempt(mirror, fetch, neutral, release, timed)
+        except Exception as e:
+            last_error = e
+        finally:
+            release = None
+    raise last_error
+
+
+def fetch_best(mirrors, fetch, race=False, neutral=(), reserve=None, among=None, timed=True):
+    """(mirror, result) from the first mirror whose fetch(mirror) succeeds
+
+    fetch raises on failure. With race=True the top RACE_WIDTH mirrors start
+    together; otherwise the best starts alone and the next one joins when it
+    errors or runs past its p95. The rest are tried in rank order. Losing
+    attempts finish in the background and still count towards their stats.
+    Exceptions of the types in neutral don't count against a mirror.
+    Raises the last error when every mirror failed.
+
+    reserve(mirror, wait) claims upstream capacity before an attempt starts
+    and returns a release callable (or None); it raises a neutral exception
+    when there is none (wait=False: don't block). The first attempt waits for
+    it on the calling thread. When the channel has no free worker, nothing
+    can run beside the caller: mirrors are then tried inline, one by one.
+
+    among restricts the attempt to those mirror positions. timed=False is for
+    fetches whose duration depends on their size: no hedging (the next mirror
+    only joins on an error) and only the outcome is recorded, not the time.
+    """
+    reserve = reserve or _no_reservation
+    ranked = mirrors.ranked(among)
+    release = reserve(ranked[0], True)
+    if len(ranked) == 1 or not mirrors.workers.acquire(blocking=False):
+        return _inline(ranked, fetch, neutral, reserve, release, timed)
+
+    pending = {}
+    position = 1
+    last_error = None
+
+    def launch():
+        """Start the next mirror beside the running ones, if a worker and capacity are free"""
+        nonlocal position
+        if position >= len(ranked) or not mirrors.workers.acquire(blocking=False):
+            return None
+        mirror = ranked[position]
+        try:
+            held = reserve(mirror, False)
+        except neutral:
+            mirrors.workers.release()
+            return None
+        position += 1
+        pending[mirrors.submit(_pooled, mirrors, mirror, fetch, neutral, held, timed)] = mirror
+        return mirror
+
+    primary = ranked[0]
+    pending[mirrors.submit(_pooled, mirrors, primary, fetch, neutral, release, timed)] = primary
+    for _ in range(RACE_WIDTH - 1 if race else 0):
+        launch()
+    hedge = timed and not race
+    hedge_at = time.monotonic() + primary.hedge_delay() if hedge else None
+
+    while True:
+        timeout = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            # Primary is in its slow tail: duplicate the request to the next mirror
+            hedge_at = None
+            launch()
+            continue
+        for future in done:
+            mirror = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if mirror is not primary:
+                mirror.hedges_won += 1
+            return mirror, result
+        # Everything that finished failed: fail over to the next mirror at once
+        mirror = launch()
+        if mirror is not None and hedge:
+            hedge_at = time.monotonic() + mirror.hedge_delay()
+        if not pending:
+            if position < len(ranked):
+                # No worker or capacity to run it beside us: carry on here
+                return _inline(ranked[position:], fetch, neutral, reserve, timed=timed)
+            raise last_error
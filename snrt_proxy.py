@@ -2,38 +2,67 @@
 """
 SNRT HLS Proxy Server
 Proxies Easybroadcast streams with authentication, serves clean M3U8 to local network
+Playlists and segments both go through the proxy, so players never need the
+Referer/Origin headers SNRT checks. Requests are served on threads; upstream
+requests are capped per channel (CHANNEL_CONCURRENCY).
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import json
 import requests
-import re
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urljoin, urlsplit
 import threading
 import time
 
+import snrt_mirrors
+import snrt_rewrite
+import snrt_upstream
+
 PORT = 8080
 HOST = "0.0.0.0"  # Listen on all interfaces
+CHANNEL_CONCURRENCY = 8   # upstream requests in flight per channel
+SLOT_WAIT = 5             # seconds a request waits for a channel slot before 503
+FETCH_TIMEOUT = 20        # seconds for a whole upstream download (10s is per read)
+RELAY_CHUNK = 64 * 1024
+CHANNEL_IDLE = 30         # seconds without a viewer after which the next request races the mirrors
 
-# SNRT channel configurations
+# SNRT channel configurations; mirrors are fallbacks, best first (see snrt_mirrors)
 CHANNELS = {
     "al-aoula": {
         "name": "Al Aoula",
         "url": "https://cdn.live.easybroadcast.io/abr_corp/73_aloula_w1dqfwm/playlist_dvr.m3u8",
+        "mirrors": [
+            "https://cdnamd-hls-globecast.akamaized.net/live/ramdisk/al_aoula_inter/hls_snrt/al_aoula_inter.m3u8",
+            "http://cdnamd-hls-globecast.akamaized.net/live/ramdisk/al_aoula_inter/hls_snrt/index.m3u8",
+        ],
         "referer": "https://snrt.player.easybroadcast.io/"
     },
     "arriadia": {
         "name": "Arriadia",
         "url": "https://cdn.live.easybroadcast.io/abr_corp/73_arriadia_kxb1xd5/playlist_dvr.m3u8",
+        "mirrors": [
+            "https://cdnamd-hls-globecast.akamaized.net/live/ramdisk/arriadia/hls_snrt/index.m3u8",
+            "http://cdnamd-hls-globecast.akamaized.net/live/ramdisk/arriadia/hls_snrt/index.m3u8",
+        ],
         "referer": "https://snrt.player.easybroadcast.io/"
     },
     "assadissa": {
         "name": "Assadissa",
         "url": "https://cdn.live.easybroadcast.io/abr_corp/73_assadissa_w6qjy65/playlist_dvr.m3u8",
+        "mirrors": [
+            "https://cdnamd-hls-globecast.akamaized.net/live/ramdisk/assadissa/hls_snrt/index.m3u8",
+            "http://cdnamd-hls-globecast.akamaized.net/live/ramdisk/assadissa/hls_snrt/index.m3u8",
+        ],
         "referer": "https://snrt.player.easybroadcast.io/"
     },
     "al-maghribia": {
         "name": "Al Maghribia",
         "url": "https://cdn.live.easybroadcast.io/abr_corp/73_almaghribia_uynlwoe/playlist_dvr.m3u8",
+        "mirrors": [
+            "https://cdnamd-hls-globecast.akamaized.net/live/ramdisk/al_maghribia_snrt/hls_snrt/index.m3u8",
+            "http://cdnamd-hls-globecast.akamaized.net/live/ramdisk/al_maghribia_snrt/hls_snrt/index.m3u8",
+        ],
         "referer": "https://snrt.player.easybroadcast.io/"
     },
     "tamazight": {
@@ -44,11 +73,143 @@ CHANNELS = {
     "laayoune": {
         "name": "Al Aoula Laayoune",
         "url": "https://cdn.live.easybroadcast.io/abr_corp/73_laayoune_pgagr52/playlist_dvr.m3u8",
+        "mirrors": [
+            "https://cdnamd-hls-globecast.akamaized.net/live/ramdisk/al_aoula_laayoune/hls_snrt/index.m3u8",
+        ],
         "referer": "https://snrt.player.easybroadcast.io/"
     }
 }
 
 
+class ChannelBusy(Exception):
+    """No upstream slot for the channel freed up within SLOT_WAIT"""
+
+
+class ChannelSlots:
+    """Bounded upstream concurrency per channel, so one stalled channel can't starve the rest"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, channel_id, wait=True):
+        """Take a slot (waiting up to SLOT_WAIT, or not at all); returns its release function"""
+        with self._lock:
+            slots = self._slots.get(channel_id)
+            if slots is None:
+                slots = self._slots[channel_id] = threading.BoundedSemaphore(self.limit)
+        if not slots.acquire(timeout=SLOT_WAIT if wait else 0):
+            raise ChannelBusy(channel_id)
+        return slots.release
+
+
+SLOTS = ChannelSlots(CHANNEL_CONCURRENCY)
+REWRITERS = snrt_rewrite.RewriterCache()
+
+
+def channel_base(url):
+    """(directory URL proxied paths are resolved under, token query to carry)"""
+    url, _, query = url.partition('?')
+    return url.rsplit('/', 1)[0] + '/', query
+
+
+def resource_url(mirror_url, rest, query):
+    """URL of rest under a mirror's directory; relative URIs in the channel playlist don't repeat its token"""
+    base_dir, token_query = channel_base(mirror_url)
+    url = urljoin(base_dir, rest)
+    query = query or token_query
+    return f"{url}?{query}" if query else url
+
+
+def channel_mirrors(config):
+    """Ranked upstream URLs of a channel: url first, then its mirrors"""
+    urls = [config['url']]
+    urls += [url for url in config.get('mirrors', []) if url not in urls]
+    return urls
+
+
+MIRRORS = {}                # channel_id -> snrt_mirrors.MirrorSet
+LAST_VIEWED = {}            # channel_id -> monotonic time of the last channel playlist request
+_mirrors_lock = threading.Lock()
+
+
+def mirrors_for(channel_id):
+    with _mirrors_lock:
+        mirrors = MIRRORS.get(channel_id)
+        if mirrors is None:
+            mirrors = MIRRORS[channel_id] = snrt_mirrors.MirrorSet(channel_mirrors(CHANNELS[channel_id]))
+        return mirrors
+
+
+def same_layout(mirrors, index):
+    """Positions of the mirrors whose directory path matches mirror index's (e.g. one CDN
+    over http and https): only there does the same relative path name the same file"""
+    path = urlsplit(channel_base(mirrors[index].url)[0]).path
+    return [i for i, mirror in enumerate(mirrors.mirrors)
+            if urlsplit(channel_base(mirror.url)[0]).path == path]
+
+
+def channel_starting(channel_id):
+    """True when nobody has asked for the channel within CHANNEL_IDLE (a zap, not a reload)"""
+    now = time.monotonic()
+    with _mirrors_lock:
+        last = LAST_VIEWED.get(channel_id)
+        LAST_VIEWED[channel_id] = now
+    return last is None or now - last > CHANNEL_IDLE
+
+
+def upstream_headers(config):
+    return {
+        'Referer': config['referer'],
+        'Origin': config.get('origin', 'https://snrtlive.ma'),
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+    }
+
+
+def proxy_uri_mapper(channel_id, mirror_index, playlist_url):
+    """URI -> /<channel_id>/<mirror>/<path under that mirror's directory>; other hosts are left alone"""
+    base_dir = channel_base(mirrors_for(channel_id)[mirror_index].url)[0].encode('utf-8')
+    prefix = f"/{channel_id}/{mirror_index}/".encode('utf-8')
+
+    def map_uri(uri):
+        if snrt_rewrite.SCHEME_RE.match(uri) and not uri.startswith(b'http'):
+            return uri   # data:, skd:// and friends
+        absolute = urljoin(playlist_url, uri.decode('utf-8')).encode('utf-8')
+        if absolute.startswith(base_dir):
+            return prefix + absolute[len(base_dir):]
+        return absolute
+
+    return map_uri
+
+
+def is_playlist(url):
+    return url.split('?')[0].endswith(('.m3u8', '.m3u'))
+
+
+class UpstreamStatus(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def download(channel_id, url):
+    """(content type, body) of one upstream request; the caller holds a channel slot"""
+    config = CHANNELS[channel_id]
+    deadline = time.monotonic() + FETCH_TIMEOUT
+    with snrt_upstream.session_for(url).get(url, headers=upstream_headers(config),
+                                            timeout=10, stream=True) as response:
+        if response.status_code != 200:
+            raise UpstreamStatus(response.status_code)
+        # Read it all under the slot: a slow viewer must not hold upstream capacity
+        chunks = []
+        for chunk in response.iter_content(RELAY_CHUNK):
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                raise requests.Timeout(f"{url} still downloading after {FETCH_TIMEOUT}s")
+        return response.headers.get('Content-Type'), b''.join(chunks)
+
+
 class SNRTProxyHandler(BaseHTTPRequestHandler):
     
     def log_message(self, format, *args):
@@ -57,20 +218,24 @@ class SNRTProxyHandler(BaseHTTPRequestHandler):
     
     def do_GET(self):
         """Handle GET requests"""
-        path = self.path.split('?')[0]
+        path, _, query = self.path.partition('?')
         
         # Root - show available channels
         if path == "/" or path == "/playlist.m3u":
             self.serve_master_playlist()
             return
         
-        # Channel request
-        channel_id = path.strip('/').split('.')[0]
+        # Channel request (/al-aoula.m3u8) or something under it (/al-aoula/<mirror>/<variant or segment>)
+        channel_id, slash, rest = path.strip('/').partition('/')
+        if not slash:
+            channel_id = channel_id.split('.')[0]
         
-        if channel_id in CHANNELS:
+        if channel_id not in CHANNELS:
+            self.send_error(404, f"Channel not found: {channel_id}")
+        elif not slash:
             self.proxy_channel(channel_id)
         else:
-            self.send_error(404, f"Channel not found: {channel_id}")
+            self.proxy_resource(channel_id, rest, query)
     
     def serve_master_playlist(self):
         """Generate M3U8 playlist with all available channels"""
@@ -91,63 +256,108 @@ class SNRTProxyHandler(BaseHTTPRequestHandler):
         self.wfile.write(m3u_content.encode('utf-8'))
     
     def proxy_channel(self, channel_id):
-        """Proxy a specific channel's stream"""
-        config = CHANNELS[channel_id]
+        """Proxy a specific channel's stream from whichever mirror answers first"""
+        mirrors = mirrors_for(channel_id)
         
-        headers = {
-            'Referer': config['referer'],
-            'Origin': 'https://snrtlive.ma',
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-        }
+        def attempt(mirror):
+            return download(channel_id, mirror.url)
         
-        try:
-            # Fetch the M3U8 playlist
-            response = requests.get(config['url'], headers=headers, timeout=10)
-            
-            if response.status_code == 200:
-                content = response.text
-                
-                # Rewrite URLs in playlist to proxy through us
-                content = self.rewrite_playlist(content, config['url'])
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Cache-Control', 'no-cache')
-                self.end_headers()
-                self.wfile.write(content.encode('utf-8'))
-            else:
-                self.send_error(response.status_code, f"Upstream error: {response.reason}")
+        def reserve(mirror, wait):
+            # Taken before an attempt is handed to a mirror worker, so workers never wait for slots
+            return SLOTS.reserve(channel_id, wait)
         
+        try:
+            mirror, (content_type, body) = snrt_mirrors.fetch_best(
+                mirrors, attempt, race=channel_starting(channel_id), neutral=(ChannelBusy,), reserve=reserve)
         except Exception as e:
-            print(f"Error proxying {channel_id}: {e}")
-            self.send_error(500, str(e))
+            self.send_upstream_error(channel_id, e)
+            return
+        self.send_body(channel_id, mirrors.mirrors.index(mirror), mirror.url, content_type, body)
     
-    def rewrite_playlist(self, content, base_url):
-        """Rewrite relative URLs in M3U8 to absolute with auth headers"""
-        lines = content.split('\n')
-        rewritten = []
+    def proxy_resource(self, channel_id, rest, query):
+        """Proxy a variant playlist or segment under one mirror's directory
+
+        Mirrors laid out like that one (same_layout) back it up: variant
+        playlists are hedged like the channel playlist, segments fail over.
+        """
+        index, _, rest = rest.partition('/')
+        mirrors = mirrors_for(channel_id)
+        if not index.isdigit() or int(index) >= len(mirrors):
+            self.send_error(404, f"No mirror {index} for {channel_id}")
+            return
+        base_dir = channel_base(mirrors[int(index)].url)[0]
+        if not urljoin(base_dir, rest).startswith(base_dir):
+            self.send_error(404, f"Not under {channel_id}: {rest}")
+            return
+        
+        def attempt(mirror):
+            url = resource_url(mirror.url, rest, query)
+            return (url,) + download(channel_id, url)
         
-        for line in lines:
-            if line and not line.startswith('#'):
-                # This is a URL line
-                if line.startswith('http'):
-                    # Already absolute - leave as-is (will be fetched by player with our headers)
-                    rewritten.append(line)
-                else:
-                    # Relative URL - make absolute
-                    base = '/'.join(base_url.split('/')[:-1])
-                    absolute = f"{base}/{line}"
-                    rewritten.append(absolute)
-            else:
-                rewritten.append(line)
+        def reserve(mirror, wait):
+            return SLOTS.reserve(channel_id, wait)
+        
+        try:
+            # Segment times depend on their size; only playlist fetches score a mirror
+            mirror, (url, content_type, body) = snrt_mirrors.fetch_best(
+                mirrors, attempt, neutral=(ChannelBusy,), reserve=reserve,
+                among=same_layout(mirrors, int(index)), timed=is_playlist(rest))
+        except Exception as e:
+            self.send_upstream_error(channel_id, e)
+            return
+        self.send_body(channel_id, mirrors.mirrors.index(mirror), url, content_type, body)
+    
+    def send_upstream_error(self, channel_id, error):
+        if isinstance(error, ChannelBusy):
+            self.send_response(503)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif isinstance(error, UpstreamStatus):
+            self.send_error(error.status, "Upstream error")
+        else:
+            print(f"Error proxying {channel_id}: {error}")
+            self.send_error(502, f"Upstream error: {error}")
+    
+    def send_body(self, channel_id, mirror_index, url, content_type, body):
+        playlist = is_playlist(url) or body[:7] == b'#EXTM3U'
+        if playlist:
+            # Rewrite URLs in playlist to proxy through us
+            body = self.rewrite_playlist(body, url, channel_id, mirror_index)
+            content_type = 'application/vnd.apple.mpegurl'
         
-        return '\n'.join(rewritten)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type or 'video/mp2t')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if playlist:
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass   # player zapped away mid-segment
+    
+    def rewrite_playlist(self, content, base_url, channel_id, mirror_index):
+        """Rewrite variant/segment/key URIs to /<channel_id>/<mirror>/... so they come through us too"""
+        rewriter = REWRITERS.get((channel_id, base_url),
+                                 lambda: proxy_uri_mapper(channel_id, mirror_index, base_url))
+        return rewriter.rewrite(content)
+
+
+class ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
 
 
 def run_server():
     """Start the proxy server"""
-    server = HTTPServer((HOST, PORT), SNRTProxyHandler)
+    snrt_upstream.install_dns_cache()
+    # Every channel sits on the same CDN host: pool enough connections for all their slots
+    snrt_upstream.configure(pool_size=CHANNEL_CONCURRENCY * len(CHANNELS))
+    server = ProxyServer((HOST, PORT), SNRTProxyHandler)
+    warmed = snrt_upstream.prewarm_sessions(url for config in CHANNELS.values() for url in channel_mirrors(config))
+    print(f"Pre-warmed upstream connections: {', '.join(warmed) or 'none'}")
     print(f"""
 ╔══════════════════════════════════════════════════════════════╗
 ║          SNRT HLS Proxy Server - Running                    ║
@@ -177,5 +387,46 @@ Press Ctrl+C to stop
         server.shutdown()
 
 
-if __name__ == "__main__":
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SNRT HLS Proxy Server")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--channels', metavar='FILE',
+                        help='JSON file replacing CHANNELS: {"al-aoula": {"name": ..., "url": ..., "mirrors": [...], '
+                             '"referer": ...}}; a list of URLs is url + mirrors (a {"channels": {id: url}} '
+                             'file as used by snrt_simple_proxy also works)')
+    return parser.parse_args(argv)
+
+
+def load_channel_overrides(path):
+    """CHANNELS from a JSON file (test origins, benchmarks)"""
+    with open(path) as f:
+        overrides = json.load(f)
+    if isinstance(overrides.get('channels'), dict):
+        overrides = overrides['channels']
+    channels = {}
+    for channel_id, config in overrides.items():
+        if isinstance(config, str):
+            config = {"url": config}
+        elif isinstance(config, list):
+            config = {"url": config[0], "mirrors": config[1:]}
+        channels[channel_id] = {
+            "name": config.get("name", channel_id.replace('-', ' ').title()),
+            "url": config["url"],
+            "mirrors": config.get("mirrors", []),
+            "referer": config.get("referer", "https://snrt.player.easybroadcast.io/"),
+        }
+    return channels
+
+
+def main():
+    global PORT, HOST, CHANNELS
+    args = parse_args()
+    PORT, HOST = args.port, args.host
+    if args.channels:
+        CHANNELS = load_channel_overrides(args.channels)
     run_server()
+
+
+if __name__ == "__main__":
+    main()
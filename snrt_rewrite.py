@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Incremental M3U8 rewriting for live playlists
+Works on bytes in one pass. URIs are rewritten through a per-rewriter memo,
+and between consecutive versions of the same live playlist only the lines
+that weren't in the previous version are looked at — the unchanged window
+is reused from the last output as-is.
+"""
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+# URI="..." attribute of #EXT-X-KEY, #EXT-X-MAP, #EXT-X-MEDIA, #EXT-X-I-FRAME-STREAM-INF, ...
+URI_ATTR_RE = re.compile(rb'URI="([^"]*)"')
+SCHEME_RE = re.compile(rb'^[A-Za-z][A-Za-z0-9+.-]*:')
+
+MEMO_LIMIT = 16384      # rewritten lines remembered per rewriter
+REWRITER_LIMIT = 64     # rewriters (one per base URL + token) kept by RewriterCache
+
+
+def token_uri_mapper(base_url):
+    """URI -> absolute CDN URL carrying base_url's token query (SNRT channels)"""
+    parsed = urlparse(base_url)
+    token_params = parsed.query.encode('utf-8')  # b"token=X&expires=Y&token_path=Z"
+    base_dir = base_url.split('?')[0].rsplit('/', 1)[0] + '/'
+
+    def map_uri(uri):
+        if uri.startswith(b'http'):
+            # Already absolute — append token if missing
+            if b'?' not in uri and token_params:
+                return uri + b'?' + token_params
+            return uri
+        if SCHEME_RE.match(uri):
+            return uri   # data:, skd:// and friends aren't fetched through the CDN
+        # Relative URL — resolve against base directory and add token
+        abs_url = urljoin(base_dir, uri.decode('utf-8')).encode('utf-8')
+        if token_params:
+            return abs_url + (b'&' if b'?' in abs_url else b'?') + token_params
+        return abs_url
+
+    return map_uri
+
+
+def static_uri_mapper(channel_id, base_url, proxy_dir):
+    """URI -> path back through the proxy for a fully-proxied static channel"""
+    base = base_url.encode('utf-8')
+    prefix = f"/{channel_id}/".encode('utf-8')
+    directory = proxy_dir.encode('utf-8')
+
+    def map_uri(uri):
+        if uri.startswith(b'http'):
+            # Absolute CDN URL — map to proxy path by stripping base_url prefix
+            if uri.startswith(base):
+                return prefix + uri[len(base):]
+            return prefix + uri.rsplit(b'/', 1)[-1]
+        if uri.startswith(b'/') or SCHEME_RE.match(uri):
+            # Root-relative or non-HTTP — keep as-is
+            return uri
+        # Relative to current directory
+        return directory + uri
+
+    return map_uri
+
+
+class PlaylistRewriter:
+    """Rewrites successive versions of one playlist with a fixed URI mapping
+
+    A live playlist's next version is the previous one minus a few segments
+    at the head plus a few at the tail, under a header whose MEDIA-SEQUENCE
+    moved. The overlap is found with one list search and one list compare
+    (both in C) and its rewritten lines are reused; only the header and the
+    appended tail go through the per-line memo.
+    """
+
+    def __init__(self, map_uri):
+        self._map_uri = map_uri
+        self._memo = {}
+        self._prev_lines = None
+        self._prev_out = None
+        self._lock = threading.Lock()
+        self.lines_rewritten = 0   # lines that went through _rewrite_line (not reused)
+
+    def _rewrite_line(self, line):
+        out = self._memo.get(line)
+        if out is not None:
+            return out
+        if not line.strip():
+            return line
+        if line[:1] == b'#':
+            if b'URI="' not in line:
+                return line
+            out = URI_ATTR_RE.sub(lambda m: b'URI="' + self._map_uri(m.group(1)) + b'"', line)
+        else:
+            out = self._map_uri(line)
+        if len(self._memo) >= MEMO_LIMIT:
+            self._memo.clear()
+        self._memo[line] = out
+        return out
+
+    def _rewrite_lines(self, lines):
+        self.lines_rewritten += len(lines)
+        rewrite = self._rewrite_line
+        return [rewrite(line) for line in lines]
+
+    def _first_uri_index(self, lines):
+        for i, line in enumerate(lines):
+            if line and line[:1] != b'#' and line.strip():
+                return i
+        return None
+
+    def rewrite(self, body):
+        """Rewrite a playlist body (bytes) and remember it for the next version"""
+        if b'\r' in body:
+            body = body.replace(b'\r\n', b'\n')
+        lines = body.split(b'\n')
+        # A trailing newline leaves an empty last element that is not a real line
+        trailing = len(lines) > 1 and lines[-1] == b''
+        if trailing:
+            lines.pop()
+
+        with self._lock:
+            out = self._incremental(lines)
+            if out is None:
+                out = self._rewrite_lines(lines)
+            self._prev_lines, self._prev_out = lines, out
+
+        result = b'\n'.join(out)
+        return result + b'\n' if trailing else result
+
+    def _incremental(self, lines):
+        prev_lines = self._prev_lines
+        if not prev_lines:
+            return None
+        first = self._first_uri_index(lines)
+        if first is None:
+            return None
+        try:
+            start = prev_lines.index(lines[first])
+        except ValueError:
+            return None   # no overlap at all (first poll after a long pause)
+        # Back up over the tags of the first overlapping segment (#EXTINF, keys, ...)
+        while first > 0 and start > 0 and lines[first - 1] == prev_lines[start - 1]:
+            first -= 1
+            start -= 1
+        overlap = len(prev_lines) - start
+        if lines[first:first + overlap] != prev_lines[start:]:
+            return None
+        return (self._rewrite_lines(lines[:first]) + self._prev_out[start:]
+                + self._rewrite_lines(lines[first + overlap:]))
+
+
+class RewriterCache:
+    """PlaylistRewriter per key, e.g. (playlist URL, token query), bounded LRU"""
+
+    def __init__(self, limit=REWRITER_LIMIT):
+        self._limit = limit
+        self._rewriters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, map_uri_factory):
+        with self._lock:
+            rewriter = self._rewriters.get(key)
+            if rewriter is None:
+                rewriter = self._rewriters[key] = PlaylistRewriter(map_uri_factory())
+                while len(self._rewriters) > self._limit:
+                    self._rewriters.popitem(last=False)
+            else:
+                self._rewriters.move_to_end(key)
+            return rewriter
+
+    def clear(self):
+        with self._lock:
+            self._rewriters.clear()
@@ -2,18 +2,39 @@
 """
 Minimal SNRT + Header Proxy - Raw socket implementation
 """
+import argparse
+import asyncio
 import socket
 import threading
-import requests
-import re
 import sys
 import json
 import os
+import signal
+import time
 from datetime import datetime
-from urllib.parse import urljoin, urlparse
+from types import MappingProxyType
+
+import snrt_breaker
+import snrt_cache
+import snrt_http
+import snrt_metrics
+import snrt_rewrite
+import snrt_token_store
+import snrt_tokens
+import snrt_upstream
+from snrt_tokens import token_expiry
+from snrt_http import AsyncClientConnection, ClientConnection, plan_ranged_response, slice_chunk
 
 PORT = 9000
 TOKEN_FILE = "snrt_streams.json"
+LISTEN_BACKLOG = 1024      # accept queue — channel zapping bursts from several boxes
+RELAY_CHUNK = 64 * 1024    # segment relay read size
+RELAY_BUFFER = 256 * 1024  # max bytes queued per client before the relay pauses
+PREFETCH_SEGMENTS = 0      # newest segments fetched ahead per variant playlist (0 = off)
+PREFETCH_IDLE_TIMEOUT = 30 # seconds without a viewer request before prefetch stops
+TOKEN_MARGIN = snrt_tokens.REFRESH_MARGIN                  # refresh a token this long before expires=
+TOKEN_REFRESH_CONCURRENCY = snrt_tokens.REFRESH_CONCURRENCY
+WORKER_RESTART_DELAY = 1   # seconds before restarting a worker that died right after starting
 
 # Default fallback URLs (without tokens)
 DEFAULT_CHANNELS = {
@@ -35,287 +56,1054 @@ STATIC_CHANNELS = {
     }
 }
 
-def load_channels():
-    """Load channels from token file or use defaults"""
+# Token snapshot CHANNELS was built from (see snrt_token_store)
+TOKENS = snrt_token_store.EMPTY
+
+
+def channels_from_snapshot(snapshot):
+    """Immutable channel map: defaults overlaid with the snapshot's tokenized URLs"""
     channels = DEFAULT_CHANNELS.copy()
-    
+    for channel_id, url in snapshot.urls.items():
+        if url.strip():
+            channels[channel_id] = url
+    return MappingProxyType(channels)
+
+
+def load_channels(previous=None):
+    """Load channels from token file or use defaults (or keep previous on a bad file)"""
+    global TOKENS
     if os.path.exists(TOKEN_FILE):
         try:
-            with open(TOKEN_FILE, 'r') as f:
-                token_data = json.load(f)
-            
-            # Update channels with tokenized URLs
-            for channel_id, url in token_data.items():
-                if url and url.strip():
-                    channels[channel_id] = url
-            
-            # Get file modification time
-            mtime = os.path.getmtime(TOKEN_FILE)
-            age = datetime.now().timestamp() - mtime
-            age_hours = age / 3600
-            
-            print(f"📥 Loaded tokens from {TOKEN_FILE} (age: {age_hours:.1f}h)", flush=True)
+            snapshot = snrt_token_store.read_snapshot(TOKEN_FILE)
+            age_hours = (datetime.now().timestamp() - snapshot.mtime) / 3600
+            print(f"📥 Loaded tokens from {TOKEN_FILE} (version {snapshot.version}, "
+                  f"age: {age_hours:.1f}h)", flush=True)
+            TOKENS = snapshot
+            return channels_from_snapshot(snapshot)
         except Exception as e:
+            if previous is not None:
+                print(f"⚠️  Error loading tokens: {e}, keeping current tokens", flush=True)
+                return previous
             print(f"⚠️  Error loading tokens: {e}, using defaults", flush=True)
     else:
         print(f"⚠️  No token file found, using default URLs (will likely be blocked)", flush=True)
     
-    return channels
+    return MappingProxyType(DEFAULT_CHANNELS.copy())
 
+# Swapped whole (never mutated) so a handler always sees one consistent token set
 CHANNELS = load_channels()
 
-def fetch_m3u8(url):
-    """Fetch M3U8 playlist with SNRT headers"""
-    headers = {
-        'Referer': 'https://snrt.player.easybroadcast.io/',
-        'Origin': 'https://snrtlive.ma',
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-    }
+SNRT_HEADERS = {
+    'Referer': 'https://snrt.player.easybroadcast.io/',
+    'Origin': 'https://snrtlive.ma',
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+}
+
+def fetch_m3u8(url, channel_id='-'):
+    """Fetch M3U8 playlist with SNRT headers (raises CircuitOpen while the upstream is down)"""
+    breaker = BREAKERS.get(url, channel_id)
+    breaker.allow()
     try:
-        r = requests.get(url, headers=headers, timeout=10)
+        r = snrt_upstream.timed_get(url, headers=SNRT_HEADERS, timeout=10)
+        observe_upstream(channel_id, r, r.status_code, len(r.content))
+        breaker.record_status(r.status_code)
         if r.status_code == 200:
-            return r.text
+            return r.content
+        return None
+    except Exception as e:
+        observe_upstream(channel_id, None, 'error')
+        breaker.failure(e)
+        return None
+
+
+async def fetch_m3u8_async(url, channel_id='-'):
+    """Event-loop version of fetch_m3u8"""
+    breaker = BREAKERS.get(url, channel_id)
+    breaker.allow()
+    try:
+        response = await snrt_upstream.fetch(url, SNRT_HEADERS, timeout=10)
+        body = await response.read()
+        observe_upstream(channel_id, response, response.status, len(body))
+        breaker.record_status(response.status)
+        if response.status == 200:
+            return body
         return None
-    except:
+    except Exception as e:
+        observe_upstream(channel_id, None, 'error')
+        breaker.failure(e)
+        return None
+
+def load_channel_playlist(cdn_url, channel_id='-'):
+    """Fetch + rewrite an SNRT channel playlist; None when upstream refuses"""
+    m3u8_data = fetch_m3u8(cdn_url, channel_id)
+    if not m3u8_data:
+        return None
+    # Rewrite relative URLs to absolute CDN URLs with token
+    return rewrite_m3u8(m3u8_data, cdn_url)
+
+
+async def load_channel_playlist_async(cdn_url, channel_id='-'):
+    m3u8_data = await fetch_m3u8_async(cdn_url, channel_id)
+    if not m3u8_data:
         return None
+    return rewrite_m3u8(m3u8_data, cdn_url)
+
+
+# One incremental rewriter per playlist and URI mapping (the SNRT token is part
+# of cdn_url, so a token refresh starts a fresh memo)
+REWRITERS = snrt_rewrite.RewriterCache()
+
 
 def rewrite_m3u8(content, base_url):
-    """Rewrite relative URLs in m3u8 to absolute CDN URLs with token params"""
-    # Extract token query string from base URL
-    parsed = urlparse(base_url)
-    token_params = parsed.query  # "token=X&expires=Y&token_path=Z"
-
-    # Base directory (strip filename)
-    base_dir = base_url.split('?')[0].rsplit('/', 1)[0] + '/'
-
-    lines = content.split('\n')
-    rewritten = []
-    for line in lines:
-        line = line.rstrip('\r')
-        if line.startswith('#') or not line.strip():
-            rewritten.append(line)
-        else:
-            if line.startswith('http'):
-                # Already absolute — append token if missing
-                if '?' not in line and token_params:
-                    rewritten.append(f"{line}?{token_params}")
-                else:
-                    rewritten.append(line)
-            else:
-                # Relative URL — resolve against base directory and add token
-                abs_url = urljoin(base_dir, line)
-                if token_params:
-                    rewritten.append(f"{abs_url}?{token_params}")
-                else:
-                    rewritten.append(abs_url)
-    return '\n'.join(rewritten)
+    """Rewrite relative URLs in m3u8 bytes to absolute CDN URLs with token params"""
+    rewriter = REWRITERS.get(('token', base_url), lambda: snrt_rewrite.token_uri_mapper(base_url))
+    return rewriter.rewrite(content)
+
+
+def rewrite_static_m3u8(content, channel_id, base_url, proxy_dir):
+    """Rewrite a static channel's playlist bytes so every URL goes back through this proxy"""
+    rewriter = REWRITERS.get(('static', channel_id, base_url, proxy_dir),
+                             lambda: snrt_rewrite.static_uri_mapper(channel_id, base_url, proxy_dir))
+    return rewriter.rewrite(content)
+
+
+# Rewritten playlists, shared by every client polling the same channel
+PLAYLIST_CACHE = snrt_cache.PlaylistCache()
+
+# TS segments of fully-proxied static channels, shared by every viewer
+SEGMENT_CACHE = snrt_cache.SegmentCache()
+
+
+# --- Metrics ---------------------------------------------------------------
+# Upstream timings: connect is only observed for fresh connections (a reused
+# keep-alive connection has none), TTFB runs from request sent to response
+# headers, total until the body has been read.
+
+METRICS = snrt_metrics.Registry()
+CLIENT_REQUESTS = METRICS.counter(
+    'snrt_client_requests_total', "Client requests by channel and response status", ('channel', 'status'))
+CLIENT_DURATION = METRICS.histogram(
+    'snrt_client_request_duration_seconds', "Time to serve a client request", ('channel',))
+CLIENT_BYTES_SENT = METRICS.counter(
+    'snrt_client_bytes_sent_total', "Bytes written to clients, headers included", ('channel',))
+ACTIVE_CONNECTIONS = METRICS.gauge(
+    'snrt_active_client_connections', "Open client connections")
+UPSTREAM_RESPONSES = METRICS.counter(
+    'snrt_upstream_responses_total', "Upstream responses by channel and status ('error' = no response)",
+    ('channel', 'status'))
+UPSTREAM_CONNECT = METRICS.histogram(
+    'snrt_upstream_connect_seconds', "TCP/TLS connect time of new upstream connections", ('channel',))
+UPSTREAM_TTFB = METRICS.histogram(
+    'snrt_upstream_ttfb_seconds', "Upstream time to first byte (response headers)", ('channel',))
+UPSTREAM_TOTAL = METRICS.histogram(
+    'snrt_upstream_total_seconds', "Upstream request time until the body is read", ('channel',))
+UPSTREAM_BYTES = METRICS.counter(
+    'snrt_upstream_bytes_received_total', "Body bytes received from upstream", ('channel',))
+
+
+def observe_upstream(channel_id, response, status, nbytes=0):
+    """Record one finished upstream exchange; response is None when nothing came back"""
+    UPSTREAM_RESPONSES.inc(channel=channel_id, status=status)
+    if response is None:
+        return
+    if response.connect_time is not None:
+        UPSTREAM_CONNECT.observe(response.connect_time, channel=channel_id)
+    UPSTREAM_TTFB.observe(response.ttfb, channel=channel_id)
+    UPSTREAM_TOTAL.observe(time.monotonic() - response.started_at, channel=channel_id)
+    if nbytes:
+        UPSTREAM_BYTES.inc(nbytes, channel=channel_id)
+
+
+def observe_upstream_failure(channel_id, response, error):
+    if isinstance(error, UpstreamStatusError):
+        observe_upstream(channel_id, response, error.status)
+    else:
+        observe_upstream(channel_id, None, 'error')
+
+
+# --- Circuit breakers ------------------------------------------------------
+
+BREAKER_OPEN = METRICS.gauge(
+    'snrt_breaker_open', "1 while a channel's upstream breaker is open or half-open", ('channel', 'host'))
+BREAKER_TRANSITIONS = METRICS.counter(
+    'snrt_breaker_transitions_total', "Breaker state changes by new state", ('channel', 'host', 'state'))
+
+
+def on_breaker_transition(breaker, previous, state):
+    BREAKER_TRANSITIONS.inc(channel=breaker.channel_id, host=breaker.host, state=state)
+    BREAKER_OPEN.set(0 if state == snrt_breaker.CLOSED else 1, channel=breaker.channel_id, host=breaker.host)
+    print(f"  🔌 Breaker {breaker.channel_id}@{breaker.host}: {previous} → {state}", flush=True)
+
+
+BREAKERS = snrt_breaker.BreakerRegistry(on_breaker_transition)
+
+
+def breaker_failure(breaker, error):
+    """Count a failed upstream exchange against its breaker (4xx answers don't count)"""
+    if isinstance(error, UpstreamStatusError):
+        breaker.record_status(error.status)
+    else:
+        breaker.failure(error)
+
+
+def retry_after(error):
+    """Retry-After header for a request an open breaker refused, else None"""
+    if isinstance(error, snrt_breaker.CircuitOpen):
+        return {'Retry-After': str(max(1, round(error.retry_after)))}
+    return None
+
+
+def unavailable_response(cache_key, error):
+    """conn.send() arguments when a playlist load failed: the last good playlist
+    while the breaker is open, else a 503"""
+    if isinstance(error, snrt_breaker.CircuitOpen):
+        stale = PLAYLIST_CACHE.last_good(cache_key)
+        if stale is not None:
+            return "200 OK", "application/vnd.apple.mpegurl", stale
+    return "503 Service Unavailable", "text/plain", str(error).encode(), retry_after(error)
+
+
+def breakers_body():
+    return json.dumps({'breakers': BREAKERS.snapshot()}, indent=2).encode('utf-8')
+
+
+def request_channel(path):
+    """Metrics label for a request path: the channel id, or '-' for anything else"""
+    channel_id = static_channel_for(path) or path.strip('/').replace('.m3u8', '')
+    if channel_id in CHANNELS or channel_id in STATIC_CHANNELS:
+        return channel_id
+    return '-'
+
+
+def observe_request(conn, request, started):
+    channel_id = request_channel(request.path)
+    CLIENT_REQUESTS.inc(channel=channel_id, status=conn.status or '-')
+    CLIENT_DURATION.observe(time.monotonic() - started, channel=channel_id)
+    CLIENT_BYTES_SENT.inc(conn.bytes_sent, channel=channel_id)
+
+
+def _cache_lookups():
+    for name, cache in (('playlist', PLAYLIST_CACHE), ('segment', SEGMENT_CACHE)):
+        stats = cache.stats()
+        for result in ('hits', 'misses', 'coalesced'):
+            yield {'cache': name, 'result': result}, stats[result]
+
+
+def _cache_hit_ratios():
+    return [({'cache': 'playlist'}, PLAYLIST_CACHE.stats()['hit_ratio']),
+            ({'cache': 'segment'}, SEGMENT_CACHE.stats()['hit_ratio'])]
+
+
+def _token_file_age():
+    if not os.path.exists(TOKEN_FILE):
+        return []
+    return [({}, round(time.time() - os.path.getmtime(TOKEN_FILE), 1))]
+
+
+def _token_expires_in():
+    now = time.time()
+    samples = []
+    for channel_id, url in CHANNELS.items():
+        expires = token_expiry(url)
+        if expires is not None:
+            samples.append(({'channel': channel_id}, round(expires - now, 1)))
+    return samples
+
+
+METRICS.callback('snrt_cache_lookups_total', "Cache lookups by result", _cache_lookups,
+                 kind='counter', labelnames=('cache', 'result'))
+METRICS.callback('snrt_cache_hit_ratio', "Share of cache lookups answered from memory",
+                 _cache_hit_ratios, labelnames=('cache',))
+METRICS.callback('snrt_segment_cache_bytes', "Bytes held by the segment cache",
+                 lambda: [({}, SEGMENT_CACHE.stats()['bytes'])])
+METRICS.callback('snrt_token_file_age_seconds', f"Seconds since {TOKEN_FILE} was last written",
+                 _token_file_age)
+METRICS.callback('snrt_token_store_version', "Version of the token snapshot being served",
+                 lambda: [({}, TOKENS.version)])
+METRICS.callback('snrt_token_expires_in_seconds', "Seconds until a channel's token expires (expires= in its URL)",
+                 _token_expires_in, labelnames=('channel',))
+
+
+def renamed_urls(previous, current):
+    """Old URL -> new URL of each channel whose token changed"""
+    return {url: current[channel_id] for channel_id, url in previous.items()
+            if channel_id in current and current[channel_id] != url}
 
 
 def reload_channels():
     """Reload channels from token file"""
     global CHANNELS
-    CHANNELS = load_channels()
+    previous, CHANNELS = CHANNELS, load_channels(CHANNELS)
+    # A refreshed token changes a channel's URL: keep its last playlist findable
+    PLAYLIST_CACHE.clear(renamed=renamed_urls(previous, CHANNELS))
+    if TOKEN_SCHEDULER is not None:
+        TOKEN_SCHEDULER.notify()
 
 
-def send_response(sock, status, content_type, body_bytes):
-    response = (
-        f"HTTP/1.1 {status}\r\n"
-        f"Content-Type: {content_type}\r\n"
-        f"Content-Length: {len(body_bytes)}\r\n"
-        f"Access-Control-Allow-Origin: *\r\n"
-        f"\r\n"
-    )
-    sock.sendall(response.encode('utf-8') + body_bytes)
+def install_snapshot(snapshot):
+    """Switch to a newer token snapshot in one step (watcher and scheduler updates)"""
+    global TOKENS, CHANNELS
+    if snapshot.version <= TOKENS.version and (snapshot.mtime or 0) <= (TOKENS.mtime or 0):
+        return   # already live (e.g. our own write coming back through the watcher)
+    # A lower version with a newer file is a store that was recreated (or a
+    # legacy writer) — take it, the file is what the extractors last wrote
+    changed = sorted(cid for cid, url in snapshot.urls.items() if CHANNELS.get(cid) != url)
+    TOKENS = snapshot
+    previous, CHANNELS = CHANNELS, channels_from_snapshot(snapshot)
+    # Cache keys carry the tokenized URL: move each changed channel's last
+    # playlist to its new URL so an open breaker can still serve it
+    PLAYLIST_CACHE.rename(renamed_urls(previous, CHANNELS))
+    print(f"🔄 Tokens v{snapshot.version} live: {', '.join(changed) or 'no URL changes'}", flush=True)
+    if TOKEN_SCHEDULER is not None:
+        TOKEN_SCHEDULER.notify()
 
 
-def handle_static_channel(client_socket, path, channel_id):
-    """Handle a fully-proxied static channel (e.g. 2M) — adds required headers"""
+def start_token_watcher(loop=None):
+    """Follow token file changes; in async mode the swap happens on the event loop"""
+    if loop is None:
+        on_change = install_snapshot
+    else:
+        on_change = lambda snapshot: loop.call_soon_threadsafe(install_snapshot, snapshot)
+    watcher = snrt_token_store.TokenWatcher(TOKEN_FILE, on_change, loaded=TOKENS)
+    print(f"👀 Watching {TOKEN_FILE} ({watcher.start()})", flush=True)
+
+
+# Set in worker processes (--workers N): pid of the supervising parent
+SUPERVISOR_PID = None
+
+
+# Expiry-driven token refresh (None when disabled with --token-margin 0)
+TOKEN_SCHEDULER = None
+
+
+def apply_refreshed_token(channel_id, url):
+    """Persist a freshly extracted URL and put it live here at once"""
+    # Other processes (--workers) pick the new version up through their watchers
+    install_snapshot(snrt_token_store.update_tokens(TOKEN_FILE, {channel_id: url}))
+
+
+def start_token_scheduler(margin, concurrency):
+    global TOKEN_SCHEDULER
+    if margin <= 0:
+        return
+    TOKEN_SCHEDULER = snrt_tokens.RefreshScheduler(
+        lambda: CHANNELS, snrt_tokens.extract_channel_token, apply_refreshed_token,
+        margin=margin, concurrency=concurrency)
+    TOKEN_SCHEDULER.start()
+    print(f"🔑 Token scheduler started (refresh {margin}s before expiry, "
+          f"{concurrency} at a time)", flush=True)
+
+
+def request_reload():
+    """Reload here and, in worker mode, have the supervisor reload every worker"""
+    reload_channels()
+    if SUPERVISOR_PID:
+        # The parent re-signals all workers (us included) so none keeps stale tokens
+        os.kill(SUPERVISOR_PID, signal.SIGHUP)
+
+
+class UpstreamStatusError(Exception):
+    """Upstream answered with a non-200 status"""
+
+    def __init__(self, status):
+        super().__init__(f"Upstream {status}")
+        self.status = status
+
+
+class RelayAborted(Exception):
+    """Upstream or client failed after the response head was sent"""
+
+
+def relay_headers(upstream_headers):
+    """Pick the upstream headers a segment relay must pass on: (length, extras)"""
+    length = upstream_headers.get('content-length')
+    extras = {}
+    if upstream_headers.get('content-encoding'):
+        extras['Content-Encoding'] = upstream_headers['content-encoding']
+    return (int(length) if length and length.isdigit() else None), extras
+
+
+def cache_stats_body():
+    """JSON hit/miss counters for sizing the caches"""
+    stats = {'playlists': PLAYLIST_CACHE.stats(), 'segments': SEGMENT_CACHE.stats()}
+    return json.dumps(stats, indent=2).encode('utf-8')
+
+
+def build_channel_playlist():
+    """M3U listing every SNRT channel served by this proxy"""
+    content = "#EXTM3U\n"
+    for channel_id, _ in CHANNELS.items():
+        content += f'#EXTINF:-1 group-title="SNRT Morocco",{channel_id.title()}\n'
+        content += f'http://192.168.8.131:{PORT}/{channel_id}.m3u8\n'
+    return content
+
+
+def static_channel_for(path):
+    """Return the STATIC_CHANNELS id a path belongs to, or None"""
+    # Determine channel prefix: /2m.m3u8 → "2m", /2m/foo.ts → "2m"
+    path_clean = path.strip('/')
+    static_channel_id = path_clean.split('/')[0].replace('.m3u8', '')
+    if static_channel_id in STATIC_CHANNELS:
+        return static_channel_id
+    return None
+
+
+def resolve_static_path(path, channel_id):
+    """Map a proxy path to (upstream_url, filename, proxy_dir) for a static channel"""
     config = STATIC_CHANNELS[channel_id]
-    headers = config['headers']
-    base_url = config['base_url']
 
     # /2m.m3u8         → master playlist
     # /2m/<subpath>    → variant playlist or TS segment (subpath may include subdirs)
     parts = path.strip('/').split('/', 1)
     if len(parts) == 1:
-        upstream_url = config['master_url']
-        filename = None
         # Effective proxy directory for relative URL resolution in master
-        proxy_dir = f"/{channel_id}/"
+        return config['master_url'], None, f"/{channel_id}/"
+    filename = parts[1]
+    # Preserve subdirectory context (e.g. /2m/stream_2/ for variant playlists)
+    return config['base_url'] + filename, filename, path.rsplit('/', 1)[0] + '/'
+
+
+# Upstream URLs without .m3u8 in their name that answered with a playlist Content-Type
+_playlist_urls = set()
+
+
+def is_playlist_path(filename, upstream_url=None):
+    return '.m3u8' in (filename or 'master.m3u8') or upstream_url in _playlist_urls
+
+
+def found_playlist(upstream_url, content_type):
+    """True (and remembered) when a response taken for a segment is really a playlist"""
+    if 'mpegurl' in (content_type or '').lower():
+        _playlist_urls.add(upstream_url)
+        return True
+    return False
+
+
+def playlist_segment_urls(channel_id, rewritten):
+    """Upstream URLs of the media segments listed in a rewritten static playlist"""
+    # Same mapping as resolve_static_path() for /<channel>/<subpath>, done on bytes
+    prefix = f"/{channel_id}/".encode('utf-8')
+    base_url = STATIC_CHANNELS[channel_id]['base_url']
+    return [base_url + line[len(prefix):].decode('utf-8')
+            for line in rewritten.split(b'\n')
+            if line.startswith(prefix) and b'.m3u8' not in line]
+
+
+def rewrite_static_playlist(channel_id, upstream_url, proxy_dir, body):
+    """Rewrite a static playlist and let the segment cache follow its live window"""
+    config = STATIC_CHANNELS[channel_id]
+    rewritten = rewrite_static_m3u8(body, channel_id, config['base_url'], proxy_dir)
+    segments = playlist_segment_urls(channel_id, rewritten)
+    if segments:
+        SEGMENT_CACHE.retain_window(upstream_url, segments)
+        prefetch_segments(channel_id, segments)
+    return rewritten
+
+
+# --- Predictive prefetch ---------------------------------------------------
+# While someone watches a static channel, the newest segments of each variant
+# playlist are pulled into SEGMENT_CACHE as soon as the playlist is rewritten,
+# and a watcher keeps re-polling the playlist so new segments are fetched
+# before the player asks for them.
+
+CHANNEL_ACTIVITY = {}       # channel_id -> monotonic time of the last viewer request
+_prefetch_watchers = set()  # (channel_id, playlist upstream url)
+
+
+def note_viewer(channel_id):
+    CHANNEL_ACTIVITY[channel_id] = time.monotonic()
+
+
+def channel_active(channel_id):
+    last = CHANNEL_ACTIVITY.get(channel_id)
+    return last is not None and time.monotonic() - last < PREFETCH_IDLE_TIMEOUT
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def prefetch_segments(channel_id, segment_urls):
+    """Start downloads for the newest segments that aren't cached or in flight"""
+    if not PREFETCH_SEGMENTS or not channel_active(channel_id):
+        return
+    loop = _running_loop()
+    for url in segment_urls[-PREFETCH_SEGMENTS:]:
+        fill = SEGMENT_CACHE.claim(url, asynchronous=loop is not None)
+        if fill is None:
+            continue
+        if loop is not None:
+            loop.create_task(download_segment_async(channel_id, url, fill))
+        else:
+            threading.Thread(target=download_segment, args=(channel_id, url, fill), daemon=True).start()
+
+
+def start_prefetch_watcher(channel_id, upstream_url, proxy_dir):
+    """Keep a variant playlist fresh while its channel has viewers"""
+    key = (channel_id, upstream_url)
+    if not PREFETCH_SEGMENTS or key in _prefetch_watchers or not SEGMENT_CACHE.has_window(upstream_url):
+        return
+    _prefetch_watchers.add(key)
+    loop = _running_loop()
+    if loop is not None:
+        loop.create_task(prefetch_watch_async(channel_id, upstream_url, proxy_dir))
     else:
-        filename = parts[1]
-        upstream_url = base_url + filename
-        # Preserve subdirectory context (e.g. /2m/stream_2/ for variant playlists)
-        proxy_dir = path.rsplit('/', 1)[0] + '/'
+        threading.Thread(target=prefetch_watch, args=(channel_id, upstream_url, proxy_dir),
+                         daemon=True).start()
+
+
+def prefetch_watch(channel_id, upstream_url, proxy_dir):
+    key = (channel_id, upstream_url)
+    print(f"  🔮 Prefetch on: {channel_id} {upstream_url.rsplit('/', 2)[-2]}", flush=True)
+    try:
+        while channel_active(channel_id):
+            time.sleep(max(PLAYLIST_CACHE.expires_in(key), snrt_cache.MIN_PLAYLIST_TTL))
+            try:
+                PLAYLIST_CACHE.get(key, lambda: load_static_playlist(channel_id, upstream_url, proxy_dir))
+            except Exception as e:
+                print(f"  ⚠️  Prefetch {channel_id}: {e}", flush=True)
+    finally:
+        _prefetch_watchers.discard(key)
+        print(f"  💤 Prefetch off: {channel_id} (idle)", flush=True)
 
+
+async def prefetch_watch_async(channel_id, upstream_url, proxy_dir):
+    key = (channel_id, upstream_url)
+    print(f"  🔮 Prefetch on: {channel_id} {upstream_url.rsplit('/', 2)[-2]}", flush=True)
     try:
-        r = requests.get(upstream_url, headers=headers, timeout=15)
+        while channel_active(channel_id):
+            await asyncio.sleep(max(PLAYLIST_CACHE.expires_in(key), snrt_cache.MIN_PLAYLIST_TTL))
+            try:
+                await PLAYLIST_CACHE.aget(key, lambda: load_static_playlist_async(channel_id, upstream_url, proxy_dir))
+            except Exception as e:
+                print(f"  ⚠️  Prefetch {channel_id}: {e}", flush=True)
+    finally:
+        _prefetch_watchers.discard(key)
+        print(f"  💤 Prefetch off: {channel_id} (idle)", flush=True)
+
+
+def load_static_playlist(channel_id, upstream_url, proxy_dir):
+    """Fetch + rewrite a static channel playlist (master or variant)"""
+    config = STATIC_CHANNELS[channel_id]
+    breaker = BREAKERS.get(upstream_url, channel_id)
+    breaker.allow()
+    r = None
+    try:
+        r = snrt_upstream.timed_get(upstream_url, headers=config['headers'], timeout=15)
         if r.status_code != 200:
-            body = f"Upstream {r.status_code}".encode()
-            send_response(client_socket, "503 Service Unavailable", "text/plain", body)
-            print(f"  ❌ {channel_id}/{filename}: upstream {r.status_code}", flush=True)
-            return
+            raise UpstreamStatusError(r.status_code)
+    except Exception as e:
+        observe_upstream_failure(channel_id, r, e)
+        breaker_failure(breaker, e)
+        raise
+    observe_upstream(channel_id, r, r.status_code, len(r.content))
+    breaker.success()
+    return rewrite_static_playlist(channel_id, upstream_url, proxy_dir, r.content)
+
+
+async def load_static_playlist_async(channel_id, upstream_url, proxy_dir):
+    config = STATIC_CHANNELS[channel_id]
+    breaker = BREAKERS.get(upstream_url, channel_id)
+    breaker.allow()
+    response = None
+    try:
+        response = await snrt_upstream.fetch(upstream_url, config['headers'], timeout=15)
+        data = await response.read()
+        if response.status != 200:
+            raise UpstreamStatusError(response.status)
+    except Exception as e:
+        observe_upstream_failure(channel_id, response, e)
+        breaker_failure(breaker, e)
+        raise
+    observe_upstream(channel_id, response, response.status, len(data))
+    breaker.success()
+    return rewrite_static_playlist(channel_id, upstream_url, proxy_dir, data)
+
+
+def download_segment(channel_id, upstream_url, fill):
+    """Download a segment into a SegmentFill (runs in its own thread)"""
+    r = None
+    breaker = BREAKERS.get(upstream_url, channel_id)
+    try:
+        breaker.allow()
+        headers = STATIC_CHANNELS[channel_id]['headers']
+        r = snrt_upstream.timed_get(upstream_url, headers=headers, timeout=15, stream=True)
+        if r.status_code != 200:
+            raise UpstreamStatusError(r.status_code)
+        length, extras = relay_headers(r.headers)
+        fill.start(r.headers.get('content-type', 'application/octet-stream'), length, extras)
+        # decode_content=False keeps Content-Length/Content-Encoding truthful
+        for data in r.raw.stream(RELAY_CHUNK, decode_content=False):
+            if data:
+                fill.append(data)
+        fill.finish()
+        observe_upstream(channel_id, r, r.status_code, fill.size)
+        breaker.success()
+    except snrt_breaker.CircuitOpen as e:
+        fill.fail(e)
+    except Exception as e:
+        fill.fail(e)
+        observe_upstream_failure(channel_id, r, e)
+        breaker_failure(breaker, e)
+    finally:
+        SEGMENT_CACHE.complete(upstream_url, fill)
+        if r is not None:
+            r.close()
+
+
+def relay_fill_threaded(conn, fill):
+    """Stream a (possibly still downloading) segment to the client; returns bytes sent"""
+    fill.wait_head(timeout=15)
+    range_header = conn.request.headers.get('range')
+    total = fill.length
+    if range_header and total is None:
+        # Unknown length: the range can only be resolved once the download ends
+        for _ in fill.iter_chunks(timeout=15):
+            pass
+        total = fill.size
+    status, length, headers, start, end = plan_ranged_response(range_header, total, fill.extra_headers)
+    conn.send_head(status, fill.content_type, length, headers)
+    if conn.head_only or length == 0:
+        return 0
+    sent = offset = 0
+    try:
+        # sendall() blocks on a slow client, so only one chunk is in flight per connection
+        for data in fill.iter_chunks(timeout=15):
+            part = slice_chunk(data, offset, start, end)
+            offset += len(data)
+            if part:
+                conn.send_body(part)
+                sent += len(part)
+            if end is not None and offset > end:
+                break
+        conn.end_body()
+    except Exception as e:
+        raise RelayAborted(e) from e
+    return sent
+
 
-        content_type = r.headers.get('content-type', 'application/octet-stream')
-        is_m3u8 = '.m3u8' in (filename or 'master.m3u8') or 'mpegurl' in content_type
-
-        if is_m3u8:
-            # Rewrite all relative URLs in the playlist to go back through this proxy.
-            # proxy_dir is already set above based on whether this is master or sub-resource.
-            lines = r.text.split('\n')
-            rewritten = []
-            for line in lines:
-                line = line.rstrip('\r')
-                if line.startswith('#') or not line.strip():
-                    rewritten.append(line)
-                else:
-                    if line.startswith('http'):
-                        # Absolute CDN URL — map to proxy path by stripping base_url prefix
-                        if line.startswith(base_url):
-                            sub = line[len(base_url):]
-                            rewritten.append(f"/{channel_id}/{sub}")
-                        else:
-                            leaf = line.split('/')[-1]
-                            rewritten.append(f"/{channel_id}/{leaf}")
-                    elif line.startswith('/'):
-                        # Root-relative — keep as-is (shouldn't happen but just in case)
-                        rewritten.append(line)
-                    else:
-                        # Relative to current directory — resolve properly
-                        rewritten.append(proxy_dir + line)
-            body = '\n'.join(rewritten).encode('utf-8')
-            send_response(client_socket, "200 OK", "application/vnd.apple.mpegurl", body)
+def send_cached_segment(conn, cached):
+    """Serve a cached segment, honouring Range; returns bytes sent"""
+    total = len(cached.body)
+    status, length, headers, start, end = plan_ranged_response(
+        conn.request.headers.get('range'), total, cached.extra_headers)
+    body = cached.body[start:] if end is None else cached.body[start:end + 1]
+    conn.send(status, cached.content_type, body, headers)
+    return 0 if conn.head_only else len(body)
+
+
+def handle_static_channel(conn, path, channel_id):
+    """Handle a fully-proxied static channel (e.g. 2M) — adds required headers"""
+    upstream_url, filename, proxy_dir = resolve_static_path(path, channel_id)
+    note_viewer(channel_id)
+
+    if is_playlist_path(filename, upstream_url):
+        # Playlists are shared: one upstream fetch per TTL whatever the viewer count
+        try:
+            body = PLAYLIST_CACHE.get(
+                (channel_id, upstream_url),
+                lambda: load_static_playlist(channel_id, upstream_url, proxy_dir))
+            conn.send("200 OK", "application/vnd.apple.mpegurl", body)
             print(f"  ✅ {channel_id}/{filename or 'master'} ({len(body)}b, rewritten)", flush=True)
-        else:
-            # Binary (TS segment) — pass straight through
-            body = r.content
-            send_response(client_socket, "200 OK", content_type, body)
-            print(f"  ✅ {channel_id}/{filename} ({len(body)}b, passthrough)", flush=True)
+            start_prefetch_watcher(channel_id, upstream_url, proxy_dir)
+        except Exception as e:
+            conn.send(*unavailable_response((channel_id, upstream_url), e))
+            print(f"  ❌ {channel_id}/{filename}: {e}", flush=True)
+        return
+
+    try:
+        cached = SEGMENT_CACHE.lookup(upstream_url)
+        if cached is not None and found_playlist(upstream_url, cached.content_type):
+            return handle_static_channel(conn, path, channel_id)
+        if cached is not None:
+            sent = send_cached_segment(conn, cached)
+            print(f"  ✅ {channel_id}/{filename} ({sent}b, cached)", flush=True)
+            return
 
+        # Binary (TS segment) — one upstream download per segment, every viewer
+        # streams from it as bytes arrive
+        fill, leader = SEGMENT_CACHE.join(upstream_url, asynchronous=False)
+        if leader:
+            threading.Thread(target=download_segment, args=(channel_id, upstream_url, fill),
+                             daemon=True).start()
+        fill.wait_head(timeout=15)
+        if found_playlist(upstream_url, fill.content_type):
+            # Served as a playlist (rewritten, through the playlist cache) from now on
+            return handle_static_channel(conn, path, channel_id)
+        sent = relay_fill_threaded(conn, fill)
+        print(f"  ✅ {channel_id}/{filename} ({sent}b, {'streamed' if leader else 'shared'})", flush=True)
+
+    except RelayAborted as e:
+        # Head already sent — nothing left to do but drop the connection
+        conn.keep_alive = False
+        print(f"  ❌ {channel_id}/{filename}: relay aborted: {e}", flush=True)
     except Exception as e:
         body = str(e).encode()
-        send_response(client_socket, "503 Service Unavailable", "text/plain", body)
+        conn.send("503 Service Unavailable", "text/plain", body, retry_after(e))
         print(f"  ❌ {channel_id}/{filename}: {e}", flush=True)
 
 
+def dispatch_request(conn, request):
+    """Route one request and write its response"""
+    if request.method not in ('GET', 'HEAD'):
+        conn.send("405 Method Not Allowed", "text/plain", b"Method not allowed",
+                  {'Allow': 'GET, HEAD'})
+        return
+
+    path = request.path
+
+    # --- Static / header-proxied channels (e.g. /2m.m3u8, /2m/<file>) ---
+    static_channel_id = static_channel_for(path)
+    if static_channel_id:
+        handle_static_channel(conn, path, static_channel_id)
+        return
+
+    # Reload tokens endpoint
+    if path == "/reload":
+        request_reload()
+        conn.send("200 OK", "text/plain", b"Tokens reloaded")
+
+    # Cache counters
+    elif path == "/stats":
+        conn.send("200 OK", "application/json", cache_stats_body())
+
+    # Prometheus scrape
+    elif path == "/metrics":
+        conn.send("200 OK", snrt_metrics.CONTENT_TYPE, METRICS.render())
+
+    # Upstream circuit breakers: state and recent transitions; /breakers/reset closes them all
+    elif path == "/breakers":
+        conn.send("200 OK", "application/json", breakers_body())
+
+    elif path == "/breakers/reset":
+        BREAKERS.reset()
+        conn.send("200 OK", "application/json", breakers_body())
+
+    # Root - show playlist
+    elif path == "/" or path == "/playlist.m3u":
+        conn.send("200 OK", "application/vnd.apple.mpegurl", build_channel_playlist().encode('utf-8'))
+
+    # SNRT channel request
+    else:
+        channel_id = path.strip('/').replace('.m3u8', '')
+        cdn_url = CHANNELS.get(channel_id)
+        if cdn_url:
+            # Concurrent polls of one channel share a single upstream fetch
+            try:
+                encoded = PLAYLIST_CACHE.get(cdn_url, lambda: load_channel_playlist(cdn_url, channel_id))
+            except snrt_breaker.CircuitOpen as e:
+                conn.send(*unavailable_response(cdn_url, e))
+                print(f"  ❌ {channel_id}: {e}", flush=True)
+                return
+            if encoded:
+                conn.send("200 OK", "application/vnd.apple.mpegurl", encoded)
+                print(f"  ✅ Served {channel_id} ({len(encoded)}b, rewritten)", flush=True)
+            else:
+                conn.send("503 Service Unavailable", "text/plain", b"Stream unavailable")
+                print(f"  ❌ {channel_id}: upstream 403/timeout", flush=True)
+        else:
+            conn.send("404 Not Found", "text/plain", b"Not found")
+
+
 def handle_client(client_socket, addr):
-    """Handle incoming client connection"""
+    """Serve HTTP/1.1 requests on one client connection until it closes or idles out"""
+    conn = ClientConnection(client_socket)
+    ACTIVE_CONNECTIONS.inc()
     try:
-        request = client_socket.recv(4096).decode('utf-8')
-        lines = request.split('\r\n')
-        if not lines:
-            client_socket.close()
-            return
-        
-        # Parse GET request
-        request_line = lines[0]
-        if not request_line.startswith('GET'):
-            client_socket.close()
-            return
-        
-        path = request_line.split()[1]
-
-        # --- Static / header-proxied channels (e.g. /2m.m3u8, /2m/<file>) ---
-        # Determine channel prefix: /2m.m3u8 → "2m", /2m/foo.ts → "2m"
-        path_clean = path.strip('/')
-        static_channel_id = path_clean.split('/')[0].replace('.m3u8', '')
-        if static_channel_id in STATIC_CHANNELS:
-            handle_static_channel(client_socket, path, static_channel_id)
+        while True:
+            request = conn.read_request()
+            if request is None:
+                break
+            started = time.monotonic()
+            dispatch_request(conn, request)
+            observe_request(conn, request, started)
+            if not conn.keep_alive:
+                break
+    except snrt_http.BadRequest as e:
+        try:
+            conn.keep_alive = False
+            conn.send(e.status, "text/plain", str(e).encode())
+        except OSError:
+            pass
+    except OSError:
+        pass
+    except Exception as e:
+        print(f"Error handling {addr}: {e}", file=sys.stderr)
+    finally:
+        ACTIVE_CONNECTIONS.dec()
+        conn.close()
+
+
+async def download_segment_async(channel_id, upstream_url, fill):
+    """Event-loop version of download_segment (runs as its own task)"""
+    response = None
+    breaker = BREAKERS.get(upstream_url, channel_id)
+    try:
+        breaker.allow()
+        headers = STATIC_CHANNELS[channel_id]['headers']
+        response = await snrt_upstream.fetch(upstream_url, headers, timeout=15)
+        if response.status != 200:
+            raise UpstreamStatusError(response.status)
+        length, extras = relay_headers(response.headers)
+        fill.start(response.headers.get('content-type', 'application/octet-stream'), length, extras)
+        async for data in response.iter_chunks(RELAY_CHUNK):
+            fill.append(data)
+        fill.finish()
+        observe_upstream(channel_id, response, response.status, fill.size)
+        breaker.success()
+    except snrt_breaker.CircuitOpen as e:
+        fill.fail(e)
+    except Exception as e:
+        fill.fail(e)
+        observe_upstream_failure(channel_id, response, e)
+        breaker_failure(breaker, e)
+    finally:
+        SEGMENT_CACHE.complete(upstream_url, fill)
+        if response is not None:
+            response.close()
+
+
+async def relay_fill_async(conn, fill):
+    """Event-loop version of relay_fill_threaded"""
+    await fill.await_head(timeout=15)
+    range_header = conn.request.headers.get('range')
+    total = fill.length
+    if range_header and total is None:
+        async for _ in fill.aiter_chunks(timeout=15):
+            pass
+        total = fill.size
+    status, length, headers, start, end = plan_ranged_response(range_header, total, fill.extra_headers)
+    # drain() suspends us once RELAY_BUFFER bytes are queued for a slow client
+    conn.writer.transport.set_write_buffer_limits(high=RELAY_BUFFER)
+    await conn.send_head(status, fill.content_type, length, headers)
+    if conn.head_only or length == 0:
+        return 0
+    sent = offset = 0
+    try:
+        async for data in fill.aiter_chunks(timeout=15):
+            part = slice_chunk(data, offset, start, end)
+            offset += len(data)
+            if part:
+                await conn.send_body(part)
+                sent += len(part)
+            if end is not None and offset > end:
+                break
+        await conn.end_body()
+    except Exception as e:
+        raise RelayAborted(e) from e
+    return sent
+
+
+async def send_cached_segment_async(conn, cached):
+    total = len(cached.body)
+    status, length, headers, start, end = plan_ranged_response(
+        conn.request.headers.get('range'), total, cached.extra_headers)
+    body = cached.body[start:] if end is None else cached.body[start:end + 1]
+    await conn.send(status, cached.content_type, body, headers)
+    return 0 if conn.head_only else len(body)
+
+
+async def handle_static_channel_async(conn, path, channel_id):
+    """Event-loop version of handle_static_channel"""
+    upstream_url, filename, proxy_dir = resolve_static_path(path, channel_id)
+    note_viewer(channel_id)
+
+    if is_playlist_path(filename, upstream_url):
+        try:
+            body = await PLAYLIST_CACHE.aget(
+                (channel_id, upstream_url),
+                lambda: load_static_playlist_async(channel_id, upstream_url, proxy_dir))
+            await conn.send("200 OK", "application/vnd.apple.mpegurl", body)
+            print(f"  ✅ {channel_id}/{filename or 'master'} ({len(body)}b, rewritten)", flush=True)
+            start_prefetch_watcher(channel_id, upstream_url, proxy_dir)
+        except Exception as e:
+            await conn.send(*unavailable_response((channel_id, upstream_url), e))
+            print(f"  ❌ {channel_id}/{filename}: {e}", flush=True)
+        return
+
+    try:
+        cached = SEGMENT_CACHE.lookup(upstream_url)
+        if cached is not None and found_playlist(upstream_url, cached.content_type):
+            return await handle_static_channel_async(conn, path, channel_id)
+        if cached is not None:
+            sent = await send_cached_segment_async(conn, cached)
+            print(f"  ✅ {channel_id}/{filename} ({sent}b, cached)", flush=True)
             return
-        
-        # Reload tokens endpoint
-        if path == "/reload":
-            reload_channels()
-            content = "Tokens reloaded"
-            response = f"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: {len(content)}\r\n\r\n{content}"
-            client_socket.sendall(response.encode('utf-8'))
-        
-        # Root - show playlist
-        elif path == "/" or path == "/playlist.m3u":
-            content = "#EXTM3U\n"
-            for channel_id, _ in CHANNELS.items():
-                content += f'#EXTINF:-1 group-title="SNRT Morocco",{channel_id.title()}\n'
-                content += f'http://192.168.8.131:{PORT}/{channel_id}.m3u8\n'
-            
-            response = f"HTTP/1.1 200 OK\r\nContent-Type: application/vnd.apple.mpegurl\r\nContent-Length: {len(content)}\r\n\r\n{content}"
-            client_socket.sendall(response.encode('utf-8'))
-        
-        # SNRT channel request
-        else:
-            channel_id = path.strip('/').replace('.m3u8', '')
-            if channel_id in CHANNELS:
-                cdn_url = CHANNELS[channel_id]
-                m3u8_data = fetch_m3u8(cdn_url)
-                if m3u8_data:
-                    # Rewrite relative URLs to absolute CDN URLs with token
-                    m3u8_data = rewrite_m3u8(m3u8_data, cdn_url)
-                    encoded = m3u8_data.encode('utf-8')
-                    response = f"HTTP/1.1 200 OK\r\nContent-Type: application/vnd.apple.mpegurl\r\nContent-Length: {len(encoded)}\r\n\r\n"
-                    client_socket.sendall(response.encode('utf-8') + encoded)
-                    print(f"  ✅ Served {channel_id} ({len(encoded)}b, rewritten)", flush=True)
-                else:
-                    error = "Stream unavailable"
-                    response = f"HTTP/1.1 503 Service Unavailable\r\nContent-Length: {len(error)}\r\n\r\n{error}"
-                    client_socket.sendall(response.encode('utf-8'))
-                    print(f"  ❌ {channel_id}: upstream 403/timeout", flush=True)
+
+        fill, leader = SEGMENT_CACHE.join(upstream_url, asynchronous=True)
+        if leader:
+            asyncio.create_task(download_segment_async(channel_id, upstream_url, fill))
+        await fill.await_head(timeout=15)
+        if found_playlist(upstream_url, fill.content_type):
+            return await handle_static_channel_async(conn, path, channel_id)
+        sent = await relay_fill_async(conn, fill)
+        print(f"  ✅ {channel_id}/{filename} ({sent}b, {'streamed' if leader else 'shared'})", flush=True)
+
+    except RelayAborted as e:
+        conn.keep_alive = False
+        print(f"  ❌ {channel_id}/{filename}: relay aborted: {e}", flush=True)
+    except Exception as e:
+        body = str(e).encode()
+        await conn.send("503 Service Unavailable", "text/plain", body, retry_after(e))
+        print(f"  ❌ {channel_id}/{filename}: {e}", flush=True)
+
+
+async def dispatch_request_async(conn, request):
+    """Event-loop version of dispatch_request"""
+    if request.method not in ('GET', 'HEAD'):
+        await conn.send("405 Method Not Allowed", "text/plain", b"Method not allowed",
+                        {'Allow': 'GET, HEAD'})
+        return
+
+    path = request.path
+
+    static_channel_id = static_channel_for(path)
+    if static_channel_id:
+        await handle_static_channel_async(conn, path, static_channel_id)
+        return
+
+    if path == "/reload":
+        request_reload()
+        await conn.send("200 OK", "text/plain", b"Tokens reloaded")
+
+    elif path == "/stats":
+        await conn.send("200 OK", "application/json", cache_stats_body())
+
+    elif path == "/metrics":
+        await conn.send("200 OK", snrt_metrics.CONTENT_TYPE, METRICS.render())
+
+    elif path == "/breakers":
+        await conn.send("200 OK", "application/json", breakers_body())
+
+    elif path == "/breakers/reset":
+        BREAKERS.reset()
+        await conn.send("200 OK", "application/json", breakers_body())
+
+    elif path == "/" or path == "/playlist.m3u":
+        await conn.send("200 OK", "application/vnd.apple.mpegurl", build_channel_playlist().encode('utf-8'))
+
+    else:
+        channel_id = path.strip('/').replace('.m3u8', '')
+        cdn_url = CHANNELS.get(channel_id)
+        if cdn_url:
+            try:
+                encoded = await PLAYLIST_CACHE.aget(cdn_url, lambda: load_channel_playlist_async(cdn_url, channel_id))
+            except snrt_breaker.CircuitOpen as e:
+                await conn.send(*unavailable_response(cdn_url, e))
+                print(f"  ❌ {channel_id}: {e}", flush=True)
+                return
+            if encoded:
+                await conn.send("200 OK", "application/vnd.apple.mpegurl", encoded)
+                print(f"  ✅ Served {channel_id} ({len(encoded)}b, rewritten)", flush=True)
             else:
-                error = "Not found"
-                response = f"HTTP/1.1 404 Not Found\r\nContent-Length: {len(error)}\r\n\r\n{error}"
-                client_socket.sendall(response.encode('utf-8'))
-    
+                await conn.send("503 Service Unavailable", "text/plain", b"Stream unavailable")
+                print(f"  ❌ {channel_id}: upstream 403/timeout", flush=True)
+        else:
+            await conn.send("404 Not Found", "text/plain", b"Not found")
+
+
+async def handle_client_async(reader, writer):
+    """Serve HTTP/1.1 requests on one connection on the event loop"""
+    addr = writer.get_extra_info('peername')
+    print(f"📥 Connection from {addr}", flush=True)
+    conn = AsyncClientConnection(reader, writer)
+    ACTIVE_CONNECTIONS.inc()
+    try:
+        while True:
+            request = await conn.read_request()
+            if request is None:
+                break
+            started = time.monotonic()
+            await dispatch_request_async(conn, request)
+            observe_request(conn, request, started)
+            if not conn.keep_alive:
+                break
+    except snrt_http.BadRequest as e:
+        try:
+            conn.keep_alive = False
+            await conn.send(e.status, "text/plain", str(e).encode())
+        except OSError:
+            pass
+    except (OSError, asyncio.TimeoutError):
+        pass
     except Exception as e:
         print(f"Error handling {addr}: {e}", file=sys.stderr)
     finally:
-        client_socket.close()
-
-def auto_reload_tokens():
-    """Background thread to periodically check and reload tokens"""
-    import time
-    while True:
-        time.sleep(300)  # Check every 5 minutes
-        if os.path.exists(TOKEN_FILE):
-            try:
-                # Check if file was modified
-                mtime = os.path.getmtime(TOKEN_FILE)
-                if not hasattr(auto_reload_tokens, 'last_mtime'):
-                    auto_reload_tokens.last_mtime = mtime
-                
-                if mtime > auto_reload_tokens.last_mtime:
-                    print(f"\n🔄 Token file updated, reloading...", flush=True)
-                    reload_channels()
-                    auto_reload_tokens.last_mtime = mtime
-            except Exception as e:
-                print(f"⚠️  Auto-reload error: {e}", flush=True)
+        ACTIVE_CONNECTIONS.dec()
+        conn.close()
 
-def main():
-    print("🚀 Starting SNRT + Header Proxy...", flush=True)
-    
-    # Create socket
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
-    print(f"🔧 Binding to 0.0.0.0:{PORT}...", flush=True)
-    server.bind(('0.0.0.0', PORT))
-    
-    print("📡 Listening for connections...", flush=True)
-    server.listen(5)
-    
-    # Start auto-reload thread
-    reload_thread = threading.Thread(target=auto_reload_tokens, daemon=True)
-    reload_thread.start()
-    print("🔄 Auto-reload thread started", flush=True)
-    
+
+def upstream_urls():
+    """Every CDN URL the proxy may fetch from — used to pre-warm connections"""
+    urls = list(CHANNELS.values())
+    urls += [config['master_url'] for config in STATIC_CHANNELS.values()]
+    return urls
+
+
+def raise_fd_limit():
+    """Lift the soft open-files limit so thousands of sockets fit"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else 65536
+    if soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def print_banner(mode):
     print(f"""
 ╔══════════════════════════════════════════════════════════════╗
 ║          SNRT + Header Proxy - Running                      ║
 ╠══════════════════════════════════════════════════════════════╣
 ║  Port:      {PORT}                                           ║
+║  Mode:      {mode:<8}                                         ║
 ║  Playlist:  http://192.168.8.131:{PORT}/playlist.m3u         ║
 ║  Reload:    http://192.168.8.131:{PORT}/reload              ║
+║  Stats:     http://192.168.8.131:{PORT}/stats               ║
+║  Metrics:   http://192.168.8.131:{PORT}/metrics             ║
+║  Breakers:  http://192.168.8.131:{PORT}/breakers            ║
 ╚══════════════════════════════════════════════════════════════╝
 
 Press Ctrl+C to stop
 """, flush=True)
+
+
+def serve_threaded(worker=None):
+    """Accept loop with one thread per connection; worker is the slot number under --workers"""
+    # Create socket
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if worker is not None:
+        # Every worker binds its own listener; the kernel spreads connections across them
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    
+    print(f"🔧 Binding to 0.0.0.0:{PORT}...", flush=True)
+    server.bind(('0.0.0.0', PORT))
+    
+    print("📡 Listening for connections...", flush=True)
+    server.listen(LISTEN_BACKLOG)
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_channels())
+    start_token_watcher()
+    if worker in (None, 0):
+        # Under --workers only the first worker schedules token refreshes
+        start_token_scheduler(TOKEN_MARGIN, TOKEN_REFRESH_CONCURRENCY)
+
+    warmed = snrt_upstream.prewarm_sessions(upstream_urls())
+    print(f"🔥 Pre-warmed upstream connections: {', '.join(warmed) or 'none'}", flush=True)
+    
+    if worker is None:
+        print_banner("threaded")
+    else:
+        print(f"👷 Worker {worker} ready (pid {os.getpid()})", flush=True)
     
     try:
         while True:
@@ -328,5 +1116,197 @@ Press Ctrl+C to stop
     finally:
         server.close()
 
+
+async def serve_async(worker=None):
+    raise_fd_limit()
+    print(f"🔧 Binding to 0.0.0.0:{PORT}...", flush=True)
+    server = await asyncio.start_server(
+        handle_client_async, '0.0.0.0', PORT,
+        backlog=LISTEN_BACKLOG, reuse_address=True, reuse_port=worker is not None,
+        limit=snrt_http.MAX_REQUEST_HEAD)
+    print("📡 Listening for connections...", flush=True)
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGHUP, reload_channels)
+    start_token_watcher(loop)
+    if worker in (None, 0):
+        # Extractions are subprocesses waited on by plain threads, off the event loop
+        start_token_scheduler(TOKEN_MARGIN, TOKEN_REFRESH_CONCURRENCY)
+
+    warmed = await snrt_upstream.POOL.prewarm(upstream_urls())
+    print(f"🔥 Pre-warmed upstream connections: {', '.join(warmed) or 'none'}", flush=True)
+
+    if worker is None:
+        print_banner("async")
+    else:
+        print(f"👷 Worker {worker} ready (pid {os.getpid()})", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def run_server(mode, worker=None):
+    if mode == 'async':
+        try:
+            asyncio.run(serve_async(worker))
+        except KeyboardInterrupt:
+            print("\n\n🛑 Shutting down...", flush=True)
+    else:
+        serve_threaded(worker)
+
+
+def spawn_worker(mode, slot):
+    """Fork one worker process serving on the shared port; returns its pid"""
+    pid = os.fork()
+    if pid:
+        return pid
+    global SUPERVISOR_PID
+    SUPERVISOR_PID = os.getppid()
+    code = 1
+    try:
+        # Ctrl+C reaches the whole process group — let the supervisor shut us down
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)  # until the server installs its handler
+        # A restarted worker must not serve the token set the parent had at startup
+        reload_channels()
+        run_server(mode, slot)
+        code = 0
+    except Exception as e:
+        print(f"❌ Worker {slot} crashed: {e}", file=sys.stderr, flush=True)
+    finally:
+        os._exit(code)
+
+
+def supervise_workers(mode, count):
+    """Run count forked workers, restart the ones that die, fan out /reload"""
+    workers = {}      # pid -> (slot, started_at)
+    stopping = False
+    broadcast = False
+
+    def on_hup(signum, frame):
+        nonlocal broadcast
+        broadcast = True
+
+    def on_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGHUP, on_hup)
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+
+    for slot in range(count):
+        workers[spawn_worker(mode, slot)] = (slot, time.monotonic())
+    print_banner(f"{mode} x{count}")
+
+    while not stopping:
+        time.sleep(0.5)
+
+        if broadcast:
+            # /reload on any worker: every worker re-reads the file
+            # (plain token file changes reach each worker through its own watcher)
+            broadcast = False
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGHUP)
+                except ProcessLookupError:
+                    pass
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            slot, started_at = workers.pop(pid, (None, 0))
+            if slot is None or stopping:
+                continue
+            print(f"⚠️  Worker {slot} (pid {pid}) exited with status {status}, restarting", flush=True)
+            if time.monotonic() - started_at < WORKER_RESTART_DELAY:
+                # Crashing on startup — don't spin
+                time.sleep(WORKER_RESTART_DELAY)
+            workers[spawn_worker(mode, slot)] = (slot, time.monotonic())
+
+    print("\n\n🛑 Shutting down workers...", flush=True)
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in workers:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+
+def apply_channel_overrides(path):
+    """Replace the built-in channel URLs from a JSON file (test origins, benchmarks)
+
+    {"channels": {"al-aoula": "http://.../playlist_dvr.m3u8?token=..."},
+     "static_channels": {"2m": {"master_url": ..., "base_url": ..., "headers": {}}}}
+    Either key may be left out. Tokens from TOKEN_FILE still overlay "channels".
+    """
+    global DEFAULT_CHANNELS, STATIC_CHANNELS, CHANNELS
+    with open(path) as f:
+        overrides = json.load(f)
+    if 'channels' in overrides:
+        DEFAULT_CHANNELS = dict(overrides['channels'])
+    if 'static_channels' in overrides:
+        STATIC_CHANNELS = dict(overrides['static_channels'])
+    CHANNELS = load_channels()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SNRT + Header Proxy")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--channels', metavar='FILE',
+                        help="JSON file replacing the built-in channel URLs (see apply_channel_overrides)")
+    parser.add_argument('--mode', choices=['threaded', 'async'],
+                        default=os.environ.get('SNRT_PROXY_MODE', 'threaded'),
+                        help="threaded: one OS thread per connection (default); "
+                             "async: single asyncio event loop for the whole request path")
+    parser.add_argument('--pool-size', type=int, default=snrt_upstream.POOL_SIZE_PER_HOST,
+                        help="upstream connections per CDN host: kept alive, and in async mode also the most in use at once")
+    parser.add_argument('--segment-cache-mb', type=int,
+                        default=snrt_cache.SEGMENT_CACHE_BYTES // (1024 * 1024),
+                        help="memory budget for cached TS segments of static channels (0 disables)")
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_SEGMENTS, metavar='N',
+                        help="prefetch the newest N segments of watched static channels (0 = off)")
+    parser.add_argument('--prefetch-idle', type=int, default=PREFETCH_IDLE_TIMEOUT, metavar='SECONDS',
+                        help="stop prefetching a channel after this long without viewer requests")
+    parser.add_argument('--token-margin', type=int, default=TOKEN_MARGIN, metavar='SECONDS',
+                        help="re-extract a channel's token this long before its expires= time (0 = off)")
+    parser.add_argument('--token-concurrency', type=int, default=TOKEN_REFRESH_CONCURRENCY, metavar='N',
+                        help="token extractions allowed to run at once")
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help="fork N worker processes sharing the port via SO_REUSEPORT (default 1)")
+    args = parser.parse_args(argv)
+    if args.workers > 1 and not (hasattr(os, 'fork') and hasattr(socket, 'SO_REUSEPORT')):
+        parser.error("--workers needs fork() and SO_REUSEPORT")
+    return args
+
+
+def main():
+    args = parse_args()
+    print("🚀 Starting SNRT + Header Proxy...", flush=True)
+    snrt_upstream.configure(pool_size=args.pool_size)
+    snrt_upstream.install_dns_cache()
+    global PORT, SEGMENT_CACHE, PREFETCH_SEGMENTS, PREFETCH_IDLE_TIMEOUT, TOKEN_MARGIN, TOKEN_REFRESH_CONCURRENCY
+    PORT = args.port
+    if args.channels:
+        apply_channel_overrides(args.channels)
+    SEGMENT_CACHE = snrt_cache.SegmentCache(args.segment_cache_mb * 1024 * 1024)
+    PREFETCH_SEGMENTS = args.prefetch
+    PREFETCH_IDLE_TIMEOUT = args.prefetch_idle
+    TOKEN_MARGIN = args.token_margin
+    TOKEN_REFRESH_CONCURRENCY = max(1, args.token_concurrency)
+
+    if args.workers > 1:
+        supervise_workers(args.mode, args.workers)
+    else:
+        run_server(args.mode)
+
 if __name__ == "__main__":
     main()
@@ -7,7 +7,8 @@ Uses browser automation to extract valid m3u8 URLs with tokens from snrtlive.ma
 import asyncio
 import re
 from playwright.async_api import async_playwright
-import json
+
+import snrt_token_store
 
 CHANNELS = {
     "al-aoula": "https://snrtlive.ma/fr/al-aoula",
@@ -108,10 +109,9 @@ async def main():
                 print(f"\n{channel_id}:")
                 print(f"  {url}")
         
-        # Save to file
+        # Save to file (atomic merge — see snrt_token_store)
         output_file = "snrt_streams.json"
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
+        snrt_token_store.update_tokens(output_file, results)
         
         print(f"\n💾 Saved to {output_file}")
         
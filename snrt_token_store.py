@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Versioned token store for snrt_streams.json
+- Writes are atomic (temp file + rename) and serialized across processes
+- Every write bumps a version counter and records per-channel expiry
+- Readers get an immutable TokenSnapshot; TokenWatcher reports changes via
+  inotify (Linux), kqueue (BSD/macOS) or, failing both, stat polling
+The loader still accepts the old flat {"channel": "url"} layout.
+"""
+import ctypes
+import ctypes.util
+import json
+import os
+import re
+import select
+import struct
+import tempfile
+import threading
+import time
+from types import MappingProxyType
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process lock only
+    fcntl = None
+
+FORMAT_VERSION = 1
+POLL_INTERVAL = 2.0     # seconds, when neither inotify nor kqueue is available
+SETTLE_DELAY = 0.05     # seconds to let a burst of directory events finish
+
+EXPIRES_RE = re.compile(r'[?&]expires=(\d+)')
+
+
+def url_expiry(url):
+    m = EXPIRES_RE.search(url or '')
+    return int(m.group(1)) if m else None
+
+
+class TokenEntry:
+    __slots__ = ('url', 'expires', 'updated')
+
+    def __init__(self, url, expires=None, updated=None):
+        self.url = url
+        self.expires = expires if expires is not None else url_expiry(url)
+        self.updated = updated
+
+    def to_json(self):
+        return {'url': self.url, 'expires': self.expires, 'updated': self.updated}
+
+
+class TokenSnapshot:
+    """One consistent version of the token file; never modified after creation"""
+
+    __slots__ = ('version', 'entries', 'urls', 'mtime')
+
+    def __init__(self, version, entries, mtime=None):
+        self.version = version
+        self.entries = MappingProxyType(dict(entries))
+        self.urls = MappingProxyType({cid: e.url for cid, e in entries.items() if e.url})
+        self.mtime = mtime
+
+    def expires(self, channel_id):
+        entry = self.entries.get(channel_id)
+        return entry.expires if entry else None
+
+
+EMPTY = TokenSnapshot(0, {})
+
+
+def parse_snapshot(data, mtime=None):
+    """Build a snapshot from decoded JSON in either the versioned or the flat layout"""
+    if isinstance(data, dict) and isinstance(data.get('channels'), dict):
+        entries = {}
+        for channel_id, item in data['channels'].items():
+            if isinstance(item, dict):
+                entries[channel_id] = TokenEntry(item.get('url'), item.get('expires'), item.get('updated'))
+            else:
+                entries[channel_id] = TokenEntry(item)
+        return TokenSnapshot(int(data.get('version', 0)), entries, mtime)
+    if isinstance(data, dict):
+        # Legacy flat file written by older extractors
+        entries = {cid: TokenEntry(url) for cid, url in data.items() if isinstance(url, str) or url is None}
+        return TokenSnapshot(0, entries, mtime)
+    raise ValueError("token file is neither an object of channels nor a versioned store")
+
+
+def read_snapshot(path):
+    """Load the current snapshot; raises OSError/ValueError if unreadable"""
+    with open(path, 'rb') as f:
+        mtime = os.fstat(f.fileno()).st_mtime
+        data = json.loads(f.read().decode('utf-8'))
+    return parse_snapshot(data, mtime)
+
+
+_local_lock = threading.Lock()
+
+
+class _FileLock:
+    """Cross-process lock on <path>.lock (flock), plus a lock for threads in this process"""
+
+    def __init__(self, path):
+        self._path = path + '.lock'
+        self._fd = None
+
+    def __enter__(self):
+        _local_lock.acquire()
+        if fcntl is not None:
+            self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        _local_lock.release()
+
+
+def _write_atomic(path, payload):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def update_tokens(path, urls):
+    """Merge {channel_id: url} into the store (None values are skipped); returns the new snapshot"""
+    with _FileLock(path):
+        try:
+            current = read_snapshot(path)
+        except (OSError, ValueError):
+            current = EMPTY
+        now = int(time.time())
+        entries = dict(current.entries)
+        for channel_id, url in urls.items():
+            if url:
+                entries[channel_id] = TokenEntry(url, updated=now)
+        version = current.version + 1
+        data = {'format': FORMAT_VERSION, 'version': version, 'updated': now,
+                'channels': {cid: e.to_json() for cid, e in sorted(entries.items())}}
+        _write_atomic(path, json.dumps(data, indent=2).encode('utf-8'))
+        return TokenSnapshot(version, entries, os.path.getmtime(path))
+
+
+# ---------------------------------------------------------------------------
+# Change notification
+# ---------------------------------------------------------------------------
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _inotify_fd(directory):
+    """inotify descriptor watching directory, or None where inotify isn't available"""
+    if not hasattr(os, 'uname') or os.uname().sysname != 'Linux':
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(_IN_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_MODIFY
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+class TokenWatcher:
+    """Calls on_change(snapshot) from a daemon thread whenever the token file changes
+
+    Directory events only wake the thread; a change is reported when the
+    file's (inode, mtime, size) differs and it parses, so a half-written
+    file from a legacy writer is skipped until the writer finishes.
+    """
+
+    def __init__(self, path, on_change, loaded=None):
+        self.path = os.path.abspath(path)
+        self._on_change = on_change
+        self._signature = self._stat()
+        if loaded is not None and self._signature and os.stat(self.path).st_mtime != loaded.mtime:
+            # Changed between the caller's load and now — report it on start()
+            self._signature = None
+        self.mechanism = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _check(self):
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return
+        try:
+            snapshot = read_snapshot(self.path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Token file unreadable, keeping current tokens: {e}", flush=True)
+            return
+        self._signature = signature
+        self._on_change(snapshot)
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        fd = _inotify_fd(directory)
+        if fd is not None:
+            self.mechanism = 'inotify'
+            target = self._run_inotify
+            args = (fd,)
+        elif hasattr(select, 'kqueue'):
+            self.mechanism = 'kqueue'
+            target = self._run_kqueue
+            args = (directory,)
+        else:
+            self.mechanism = 'polling'
+            target = self._run_polling
+            args = ()
+        threading.Thread(target=target, args=args, name="token-watcher", daemon=True).start()
+        self._check()
+        return self.mechanism
+
+    def _run_inotify(self, fd):
+        name = os.fsencode(os.path.basename(self.path))
+        while True:
+            data = os.read(fd, 4096)
+            offset, relevant = 0, False
+            while offset < len(data):
+                _, _, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                if data[offset:offset + length].rstrip(b'\0') == name:
+                    relevant = True
+                offset += length
+            if relevant:
+                time.sleep(SETTLE_DELAY)
+                self._check()
+
+    def _run_kqueue(self, directory):
+        kq = select.kqueue()
+        dir_fd = os.open(directory, os.O_RDONLY)
+        event = select.kevent(dir_fd, filter=select.KQ_FILTER_VNODE,
+                              flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                              fflags=select.KQ_NOTE_WRITE)
+        kq.control([event], 0)
+        while True:
+            # Directory writes cover renames into place; the timeout catches in-place edits
+            kq.control(None, 1, POLL_INTERVAL)
+            time.sleep(SETTLE_DELAY)
+            self._check()
+
+    def _run_polling(self):
+        while True:
+            time.sleep(POLL_INTERVAL)
+            self._check()
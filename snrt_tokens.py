@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Token expiry scheduling for the SNRT proxy
+Reads expires= from each channel URL and re-extracts that one channel a
+margin before it runs out, a bounded number at a time.
+"""
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+import token_replay
+from snrt_token_store import read_snapshot, url_expiry as token_expiry
+
+REFRESH_MARGIN = 120        # seconds before expiry to fetch a new token
+REFRESH_CONCURRENCY = 2     # extractions (one headless browser each) at once
+EXTRACT_TIMEOUT = 120       # seconds one extraction may take
+RETRY_MIN = 30              # seconds before retrying a failed refresh, doubling
+RETRY_MAX = 300
+
+EXTRACTOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract_all_snrt_channels.py')
+# Warm extractor (extract_all_snrt_channels.py --serve); empty to always spawn one
+EXTRACT_SERVICE = os.environ.get('SNRT_EXTRACT_SERVICE', 'http://127.0.0.1:9010')
+
+
+def extract_channel_token(channel_id, timeout=EXTRACT_TIMEOUT):
+    """New URL for one channel: HTTP token replay, else the warm extraction service, else a one-off run"""
+    url = token_replay.replay_channel(channel_id)
+    if url:
+        return url
+    if EXTRACT_SERVICE:
+        try:
+            r = requests.get(f"{EXTRACT_SERVICE}/extract/{channel_id}", timeout=timeout)
+            return r.json().get('url')
+        except requests.ConnectionError:
+            pass   # service not running — launch a browser ourselves
+        except (requests.RequestException, ValueError):
+            return None
+    return run_extractor(channel_id, timeout)
+
+
+def run_extractor(channel_id, timeout=EXTRACT_TIMEOUT):
+    """Run the browser extractor for one channel; returns its new URL or None"""
+    fd, output = tempfile.mkstemp(prefix=f"snrt_{channel_id}_", suffix='.json')
+    os.close(fd)
+    os.unlink(output)   # the extractor merges into an existing file — start from none
+    try:
+        subprocess.run([sys.executable, EXTRACTOR, '--channel', channel_id, '--output', output],
+                       cwd=os.path.dirname(EXTRACTOR), timeout=timeout,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return read_snapshot(output).urls.get(channel_id)
+    except (subprocess.TimeoutExpired, OSError, ValueError):
+        return None
+    finally:
+        if os.path.exists(output):
+            os.unlink(output)
+
+
+class RefreshScheduler:
+    """Refreshes each channel's token shortly before its expires= time
+
+    channels() returns the current {channel_id: url}; refresh(channel_id)
+    returns a new URL or None; apply(channel_id, url) puts it live. Only
+    URLs that expire later than the current one are applied.
+    """
+
+    def __init__(self, channels, refresh, apply, margin=REFRESH_MARGIN,
+                 concurrency=REFRESH_CONCURRENCY):
+        self._channels = channels
+        self._refresh = refresh
+        self._apply = apply
+        self.margin = margin
+        self.concurrency = concurrency
+        self._queue = queue.Queue()
+        self._in_flight = set()
+        self._retry_at = {}    # channel_id -> (monotonic time, current delay)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def start(self):
+        for i in range(self.concurrency):
+            threading.Thread(target=self._worker, name=f"token-refresh-{i}", daemon=True).start()
+        threading.Thread(target=self._run, name="token-scheduler", daemon=True).start()
+
+    def notify(self):
+        """Re-plan now (e.g. after the channel set was reloaded)"""
+        self._wake.set()
+
+    def due(self, now=None):
+        """(channel_id, seconds until refresh) for every channel with an expiry, soonest first"""
+        now = time.time() if now is None else now
+        plan = []
+        for channel_id, url in list(self._channels().items()):
+            expires = token_expiry(url)
+            if expires is not None:
+                plan.append((channel_id, expires - self.margin - now))
+        return sorted(plan, key=lambda item: item[1])
+
+    def _run(self):
+        while True:
+            next_wake = 60.0
+            monotonic = time.monotonic()
+            for channel_id, wait in self.due():
+                with self._lock:
+                    if channel_id in self._in_flight:
+                        continue
+                    retry = self._retry_at.get(channel_id)
+                    if retry and retry[0] > monotonic:
+                        next_wake = min(next_wake, retry[0] - monotonic)
+                        continue
+                    if wait > 0:
+                        next_wake = min(next_wake, wait)
+                        continue
+                    self._in_flight.add(channel_id)
+                self._queue.put(channel_id)
+            self._wake.wait(max(next_wake, 1.0))
+            self._wake.clear()
+
+    def _worker(self):
+        while True:
+            channel_id = self._queue.get()
+            started = time.monotonic()
+            print(f"🔑 Refreshing token: {channel_id}", flush=True)
+            try:
+                current = self._channels().get(channel_id)
+                url = self._refresh(channel_id)
+                expires = token_expiry(url)
+                if url and (expires is None or expires > (token_expiry(current) or 0)):
+                    self._apply(channel_id, url)
+                    with self._lock:
+                        self._retry_at.pop(channel_id, None)
+                    left = f"{(expires - time.time()) / 60:.0f}min left" if expires else "no expiry"
+                    print(f"  ✅ Token live: {channel_id} ({left}, "
+                          f"{time.monotonic() - started:.0f}s)", flush=True)
+                else:
+                    self._backoff(channel_id, "no fresher token")
+            except Exception as e:
+                self._backoff(channel_id, e)
+            finally:
+                with self._lock:
+                    self._in_flight.discard(channel_id)
+                self._wake.set()
+
+    def _backoff(self, channel_id, reason):
+        with self._lock:
+            delay = min(self._retry_at.get(channel_id, (0, RETRY_MIN / 2))[1] * 2, RETRY_MAX)
+            self._retry_at[channel_id] = (time.monotonic() + delay, delay)
+        print(f"  ⚠️  Token refresh {channel_id}: {reason} (retry in {delay:.0f}s)", flush=True)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Upstream connection handling shared by the SNRT proxies
+- Pooled keep-alive requests.Session per CDN host (threaded code paths)
+- Minimal asyncio HTTP/1.1 client with its own keep-alive pool (event-loop mode),
+  at most POOL_SIZE_PER_HOST connections in use per host
+- Process-wide DNS result cache and connection pre-warming
+- Connect / time-to-first-byte timings on both paths for the metrics endpoint
+"""
+import asyncio
+import os
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+READ_CHUNK = 64 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+
+POOL_SIZE_PER_HOST = int(os.environ.get('SNRT_UPSTREAM_POOL_SIZE', '8'))
+IDLE_TIMEOUT = 50   # seconds — drop parked connections before typical CDN keep-alive (60s)
+DNS_TTL = 300       # seconds
+
+_SSL_CONTEXT = ssl.create_default_context()
+
+
+def configure(pool_size=None, dns_ttl=None):
+    """Override pool size / DNS TTL before the first upstream request"""
+    global POOL_SIZE_PER_HOST, DNS_TTL
+    if pool_size is not None:
+        POOL_SIZE_PER_HOST = pool_size
+    if dns_ttl is not None:
+        DNS_TTL = dns_ttl
+
+
+def host_key(url):
+    """(scheme, host, port) — the unit connections are pooled by"""
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    return parts.scheme, parts.hostname, parts.port or (443 if secure else 80)
+
+
+# ---------------------------------------------------------------------------
+# DNS cache
+# ---------------------------------------------------------------------------
+
+_dns_cache = {}
+_dns_lock = threading.Lock()
+_real_getaddrinfo = socket.getaddrinfo
+
+
+def _cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    key = (host, port, family, type, proto, flags)
+    now = time.monotonic()
+    with _dns_lock:
+        hit = _dns_cache.get(key)
+    if hit and hit[0] > now:
+        return hit[1]
+    infos = _real_getaddrinfo(host, port, family, type, proto, flags)
+    with _dns_lock:
+        _dns_cache[key] = (now + DNS_TTL, infos)
+    return infos
+
+
+def install_dns_cache():
+    """Route every getaddrinfo in this process (requests and asyncio) through the cache"""
+    socket.getaddrinfo = _cached_getaddrinfo
+
+
+# ---------------------------------------------------------------------------
+# Threaded side: one keep-alive requests.Session per upstream host
+# ---------------------------------------------------------------------------
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# requests runs the connect in the calling thread, so a thread-local is
+# enough to hand the handshake time back to timed_get()
+_connect_timing = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        _connect_timing.seconds = time.monotonic() - started
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        _connect_timing.seconds = time.monotonic() - started
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool, 'https': _TimedHTTPSConnectionPool}
+
+
+def session_for(url):
+    """Shared keep-alive Session for the URL's host"""
+    key = host_key(url)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = _TimedAdapter(pool_connections=1, pool_maxsize=POOL_SIZE_PER_HOST)
+                session.mount(f"{key[0]}://", adapter)
+                _sessions[key] = session
+    return session
+
+
+def timed_get(url, headers=None, timeout=10, stream=False):
+    """session_for(url).get() that also records upstream timings on the response
+
+    Sets r.started_at (monotonic), r.connect_time (seconds, None when a pooled
+    connection was reused) and r.ttfb (request sent to headers parsed).
+    """
+    _connect_timing.seconds = None
+    started = time.monotonic()
+    r = session_for(url).get(url, headers=headers, timeout=timeout, stream=stream)
+    r.started_at = started
+    r.connect_time = _connect_timing.seconds
+    r.ttfb = time.monotonic() - started
+    return r
+
+
+def prewarm_sessions(urls):
+    """Open connections to each distinct host so the first real request skips the handshake"""
+    warmed = []
+    for key in {host_key(url) for url in urls}:
+        scheme, host, port = key
+        origin = f"{scheme}://{host}:{port}/"
+        try:
+            # Any response will do — we only want the TCP/TLS connection in the pool
+            session_for(origin).head(origin, timeout=5, allow_redirects=False)
+            warmed.append(host)
+        except requests.RequestException:
+            pass
+    return warmed
+
+
+# ---------------------------------------------------------------------------
+# Event-loop side
+# ---------------------------------------------------------------------------
+
+class UpstreamError(Exception):
+    """Raised when the upstream sends something we can't parse"""
+
+
+class ConnectionPool:
+    """Keep-alive connections per host for the asyncio client
+
+    Up to POOL_SIZE_PER_HOST connections per host are handed out at once;
+    further requests to that host wait their turn. As many again may sit
+    idle between requests.
+    """
+
+    def __init__(self):
+        self._idle = {}     # host_key -> deque of (reader, writer, parked_at)
+        self._active = {}   # host_key -> connections handed out by acquire()
+        self._waiters = {}  # host_key -> deque of futures waiting for one
+
+    async def _take_slot(self, key):
+        if self._active.get(key, 0) < POOL_SIZE_PER_HOST and not self._waiters.get(key):
+            self._active[key] = self._active.get(key, 0) + 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(waiter)
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._free_slot(key)   # handed a slot just as we gave up
+            raise
+
+    def _free_slot(self, key):
+        waiters = self._waiters.get(key)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)   # the slot passes straight to the next in line
+                return
+        self._active[key] -= 1
+
+    async def _open(self, key, timeout):
+        scheme, host, port = key
+        secure = scheme == 'https'
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        family, _, _, _, sockaddr = infos[0]
+        return await asyncio.wait_for(
+            asyncio.open_connection(sockaddr[0], port, family=family,
+                                    ssl=_SSL_CONTEXT if secure else None,
+                                    server_hostname=host if secure else None,
+                                    limit=MAX_HEADER_BYTES),
+            timeout)
+
+    async def acquire(self, key, timeout):
+        """Return (reader, writer, reused); give it back with release() or discard()"""
+        await self._take_slot(key)
+        idle = self._idle.get(key)
+        now = time.monotonic()
+        while idle:
+            reader, writer, parked_at = idle.pop()
+            if writer.is_closing() or reader.at_eof() or now - parked_at > IDLE_TIMEOUT:
+                writer.close()
+                continue
+            return reader, writer, True
+        try:
+            reader, writer = await self._open(key, timeout)
+        except BaseException:
+            self._free_slot(key)
+            raise
+        return reader, writer, False
+
+    def release(self, key, reader, writer):
+        """Park a connection whose response was fully read"""
+        self._park(key, reader, writer)
+        self._free_slot(key)
+
+    def discard(self, key, writer):
+        """Close a connection that can't be reused"""
+        writer.close()
+        self._free_slot(key)
+
+    def _park(self, key, reader, writer):
+        idle = self._idle.setdefault(key, deque())
+        if len(idle) >= POOL_SIZE_PER_HOST or writer.is_closing():
+            writer.close()
+            return
+        idle.append((reader, writer, time.monotonic()))
+
+    async def prewarm(self, urls, per_host=2, timeout=10):
+        """Park ready TCP/TLS connections to each host"""
+        keys = {host_key(url) for url in urls}
+
+        async def warm(key):
+            for _ in range(min(per_host, POOL_SIZE_PER_HOST)):
+                reader, writer = await self._open(key, timeout)
+                self._park(key, reader, writer)
+            return key[1]
+
+        results = await asyncio.gather(*(warm(k) for k in keys), return_exceptions=True)
+        return [r for r in results if isinstance(r, str)]
+
+    def close_idle(self):
+        """Close every parked connection (they belong to the running event loop)"""
+        for idle in self._idle.values():
+            while idle:
+                idle.pop()[1].close()
+
+    def active_count(self, key):
+        return self._active.get(key, 0)
+
+    def idle_count(self, key=None):
+        if key is not None:
+            return len(self._idle.get(key, ()))
+        return sum(len(q) for q in self._idle.values())
+
+
+POOL = ConnectionPool()
+
+
+class UpstreamResponse:
+    """Status + headers of an upstream response, body read on demand"""
+
+    def __init__(self, status, reason, headers, reader, writer, method, timeout, key):
+        self.started_at = None    # set by fetch(), like the timed_get() attributes
+        self.connect_time = None
+        self.ttfb = None
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # lower-cased names
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+        self._key = key
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        length = headers.get('content-length')
+        self.content_length = int(length) if length and length.isdigit() else None
+        # HEAD and bodiless statuses carry no payload regardless of headers
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self._chunked = False
+            self.content_length = 0
+        self._reusable = (headers.get('connection', '').lower() != 'close'
+                          and (self._chunked or self.content_length is not None))
+        self._complete = False
+
+    async def _read(self, coro):
+        return await asyncio.wait_for(coro, self._timeout)
+
+    async def iter_chunks(self, size=READ_CHUNK):
+        """Yield body bytes as they arrive (de-chunked)"""
+        try:
+            if self._chunked:
+                while True:
+                    line = await self._read(self._reader.readline())
+                    if not line:
+                        raise UpstreamError("connection closed mid-body")
+                    chunk_len = int(line.split(b';', 1)[0].strip() or b'0', 16)
+                    if chunk_len == 0:
+                        # Drain trailers up to the terminating blank line
+                        while (await self._read(self._reader.readline())) not in (b'\r\n', b'\n', b''):
+                            pass
+                        break
+                    remaining = chunk_len
+                    while remaining:
+                        data = await self._read(self._reader.read(min(size, remaining)))
+                        if not data:
+                            raise UpstreamError("connection closed mid-chunk")
+                        remaining -= len(data)
+                        yield data
+                    await self._read(self._reader.readline())
+            elif self.content_length is not None:
+                remaining = self.content_length
+                while remaining:
+                    data = await self._read(self._reader.read(min(size, remaining)))
+                    if not data:
+                        raise UpstreamError("connection closed mid-body")
+                    remaining -= len(data)
+                    yield data
+            else:
+                # Close-delimited body
+                while True:
+                    data = await self._read(self._reader.read(size))
+                    if not data:
+                        break
+                    yield data
+            self._complete = True
+        finally:
+            self.close()
+
+    async def read(self):
+        """Read the whole body into memory"""
+        parts = []
+        async for data in self.iter_chunks():
+            parts.append(data)
+        return b''.join(parts)
+
+    def close(self):
+        """Return the connection to the pool if the body was fully read, else drop it"""
+        if self._writer is None:
+            return
+        if self._complete and self._reusable:
+            POOL.release(self._key, self._reader, self._writer)
+        else:
+            POOL.discard(self._key, self._writer)
+        self._reader = self._writer = None
+
+
+async def _read_head(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    if len(head) > MAX_HEADER_BYTES:
+        raise UpstreamError("response header too large")
+    lines = head.decode('iso-8859-1').split('\r\n')
+    parts = lines[0].split(' ', 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/'):
+        raise UpstreamError(f"bad status line: {lines[0][:80]!r}")
+    status = int(parts[1])
+    reason = parts[2] if len(parts) > 2 else ''
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return status, reason, headers
+
+
+async def fetch(url, headers=None, method='GET', timeout=10):
+    """Send a request and return an UpstreamResponse once headers arrive"""
+    parts = urlsplit(url)
+    key = host_key(url)
+    target = parts.path or '/'
+    if parts.query:
+        target += '?' + parts.query
+    host_header = parts.netloc.rsplit('@', 1)[-1]
+    request = [f"{method} {target} HTTP/1.1", f"Host: {host_header}",
+               "Accept-Encoding: identity", "Connection: keep-alive"]
+    for name, value in (headers or {}).items():
+        request.append(f"{name}: {value}")
+    payload = ('\r\n'.join(request) + '\r\n\r\n').encode('iso-8859-1')
+
+    started = time.monotonic()
+    while True:
+        acquire_started = time.monotonic()
+        reader, writer, reused = await POOL.acquire(key, timeout)
+        connect_time = None if reused else time.monotonic() - acquire_started
+        try:
+            writer.write(payload)
+            await writer.drain()
+            status, reason, resp_headers = await asyncio.wait_for(_read_head(reader), timeout)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            POOL.discard(key, writer)
+            # The server may have closed a parked connection just as we reused it
+            if reused:
+                continue
+            raise UpstreamError(f"connection failed: {e}") from e
+        except BaseException:
+            POOL.discard(key, writer)
+            raise
+        response = UpstreamResponse(status, reason, resp_headers, reader, writer, method, timeout, key)
+        response.started_at = started
+        response.connect_time = connect_time
+        response.ttfb = time.monotonic() - started
+        return response
+
+
+async def get(url, headers=None, timeout=10):
+    """Fetch a whole resource: returns (status, headers, body)"""
+    response = await fetch(url, headers, timeout=timeout)
+    body = await response.read()
+    return response.status, response.headers, body
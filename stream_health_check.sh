@@ -7,6 +7,7 @@ STATE_FILE="/tmp/stream-health-state.txt"
 MATRIX_TARGET="@zdaraoui:matrix.org"
 TIMEOUT=10
 TMPDIR_CHECKS=$(mktemp -d)
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
 log() { echo "[$(date '+%Y-%m-%d %H:%M:%S')] $*"; }
 
@@ -15,26 +16,17 @@ prev_down=""
 [ -f "$STATE_FILE" ] && prev_down=$(cat "$STATE_FILE")
 
 # --- Parse playlist: extract name→url pairs ---
+# m3u_parser.py emits one "name<TAB>url" line per channel (handles CRLF,
+# #EXTVLCOPT lines and commas inside quoted attributes)
 names=()
 urls=()
-current_name=""
 
-while IFS= read -r line; do
-    line="${line%$'\r'}"  # strip Windows CR
-    if [[ "$line" == "#EXTINF"* ]]; then
-        # Extract display name: last comma-separated field
-        current_name="${line##*,}"
-        current_name="${current_name#"${current_name%%[![:space:]]*}"}"  # ltrim
-    elif [[ "$line" == http* ]] && [ -n "$current_name" ]; then
-        names+=("$current_name")
-        urls+=("$line")
-        current_name=""
-    elif [[ "$line" == "#EXTVLCOPT"* ]]; then
-        : # skip VLC options lines
-    elif [[ -z "$line" ]] || [[ "$line" == "#"* ]]; then
-        : # skip other comments/blanks
+while IFS=$'\t' read -r name url; do
+    if [[ "$url" == http* ]]; then
+        names+=("$name")
+        urls+=("$url")
     fi
-done < "$PLAYLIST"
+done < <(python3 "$SCRIPT_DIR/m3u_parser.py" --tsv "$PLAYLIST")
 
 log "Checking ${#names[@]} streams in parallel..."
 
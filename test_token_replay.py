@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Offline tests for token_replay against a local stub of the SNRT player
+
+The stub mimics the sequence the real player goes through: the event page
+embeds a player key, the token API trades that key (plus a cache-busting
+timestamp) for a short-lived token, and the CDN only serves the playlist
+for a token it issued that hasn't expired.
+
+Run: python -m pytest test_token_replay.py   (or python test_token_replay.py)
+"""
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+import token_replay
+
+
+class StubPlayer:
+    """State of the stub token server; tests flip its knobs"""
+
+    def __init__(self):
+        self.key = 'k3y-73aloula-w1dqfwm'
+        self.counter = itertools.count(1)
+        self.issued = {}            # token -> expires
+        self.token_format = 'json'  # 'json' | 'text'
+        self.token_status = 200
+        self.lifetime = 600
+
+    def issue(self):
+        token = f"tok{next(self.counter):04d}abcdef"
+        expires = int(time.time()) + self.lifetime
+        self.issued[token] = expires
+        return token, expires
+
+
+def make_handler(player):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type='text/plain'):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            if parts.path == '/events/73_aloula':
+                self._send(200, f'<html><div id="player" data-key="{player.key}"></div></html>',
+                           'text/html')
+            elif parts.path == '/token':
+                if player.token_status != 200:
+                    self._send(player.token_status, 'nope')
+                elif query.get('key') != player.key or not query.get('_', '').isdigit():
+                    self._send(403, 'bad key')
+                else:
+                    token, expires = player.issue()
+                    path = '/abr/aloula/'
+                    if player.token_format == 'json':
+                        self._send(200, json.dumps({'data': {'token': token, 'expires': expires,
+                                                             'path': path}}), 'application/json')
+                    else:
+                        self._send(200, f'var cfg = {{token: "{token}", expires: "{expires}"}};',
+                                   'application/javascript')
+            elif parts.path == '/abr/aloula/playlist_dvr.m3u8':
+                expires = player.issued.get(query.get('token'))
+                if expires is None or expires < time.time() or str(expires) != query.get('expires'):
+                    self._send(403, 'forbidden')
+                else:
+                    self._send(200, '#EXTM3U\n#EXT-X-VERSION:3\n', 'application/vnd.apple.mpegurl')
+            else:
+                self._send(404, 'not found')
+
+    return Handler
+
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.player = StubPlayer()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self.player))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.recipe_file = os.path.join(self.tmp.name, 'recipes.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def browse(self, session=None):
+        """Do what the browser does, feeding a Recorder; returns (recorder, playlist URL)"""
+        session = session or requests.Session()
+        recorder = token_replay.Recorder()
+        headers = {'Referer': f"{self.base}/events/73_aloula", 'User-Agent': 'Mozilla/5.0',
+                   'Cookie': 'session=stale'}
+
+        page_url = f"{self.base}/events/73_aloula"
+        page = session.get(page_url)
+        recorder.add_step('GET', page_url, {'User-Agent': 'Mozilla/5.0'}, None, page.text)
+
+        token_url = f"{self.base}/token?key={self.player.key}&_={int(time.time() * 1000)}"
+        r = session.get(token_url, headers=headers)
+        recorder.add_step('GET', token_url, headers, None, r.text)
+        if self.player.token_format == 'json':
+            data = r.json()['data']
+            token, expires = data['token'], data['expires']
+        else:
+            token = r.text.split('token: "')[1].split('"')[0]
+            expires = r.text.split('expires: "')[1].split('"')[0]
+
+        playlist_url = (f"{self.base}/abr/aloula/playlist_dvr.m3u8?token={token}"
+                        f"&expires={expires}&token_path=%2Fabr%2Faloula%2F")
+        recorder.note_playlist(playlist_url, headers)
+        return recorder, playlist_url
+
+    def test_replay_mints_a_fresh_working_url(self):
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+        self.assertIsNotNone(recipe)
+
+        url = token_replay.replay(recipe)
+
+        self.assertNotEqual(url, recorded_url)
+        self.assertEqual(requests.get(url).status_code, 200)
+        self.assertIn('token_path=%2Fabr%2Faloula%2F', url)
+
+    def test_recipe_bindings(self):
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+
+        token_step = recipe['steps'][1]
+        self.assertEqual(token_step['bindings']['_'], {'clock': 1000})
+        self.assertEqual(token_step['bindings']['key']['step'], 0)
+        playlist = recipe['playlist']['bindings']
+        self.assertEqual(playlist['token'], {'step': 1, 'json': ['data', 'token'], 'encoded': False})
+        self.assertEqual(playlist['expires']['json'], ['data', 'expires'])
+        self.assertEqual(playlist['token_path'], {'step': 1, 'json': ['data', 'path'], 'encoded': True})
+        self.assertNotIn('cookie', {k.lower() for k in token_step['headers']})
+
+    def test_text_response_binding(self):
+        self.player.token_format = 'text'
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+        bindings = recipe['playlist']['bindings']
+        self.assertEqual(bindings['token']['prefix'], 'token: "')
+        self.assertEqual(bindings['expires']['prefix'], 'expires: "')
+        self.assertNotIn('token_path', bindings)   # constant, not in the text response
+
+        url = token_replay.replay(recipe)
+
+        self.assertEqual(requests.get(url).status_code, 200)
+
+    def test_page_key_rotation_is_followed(self):
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+        self.player.key = 'k3y-rotated-000000'
+
+        url = token_replay.replay(recipe)
+
+        self.assertEqual(requests.get(url).status_code, 200)
+
+    def test_token_api_error_raises(self):
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+        self.player.token_status = 500
+
+        with self.assertRaises(token_replay.ReplayError):
+            token_replay.replay(recipe)
+
+    def test_short_lived_token_rejected(self):
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+        self.player.lifetime = 30
+
+        with self.assertRaises(token_replay.ReplayError):
+            token_replay.replay(recipe)
+
+    def test_format_change_raises(self):
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+        self.player.token_format = 'text'
+
+        with self.assertRaises(token_replay.ReplayError):
+            token_replay.replay(recipe)
+
+    def test_rejected_playlist_raises(self):
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+        self.player.issue = lambda: ('tokXXXXunknown', int(time.time()) + 600)  # CDN won't know it
+
+        with self.assertRaises(token_replay.ReplayError):
+            token_replay.replay(recipe)
+
+    def test_no_recipe_for_unrelated_token(self):
+        recorder, _ = self.browse()
+        unrelated = f"{self.base}/abr/aloula/playlist_dvr.m3u8?token=zzzzzzzzzz&expires=1"
+        self.assertIsNone(recorder.recipe(unrelated))
+
+    def test_trailing_requests_are_not_replayed(self):
+        recorder, recorded_url = self.browse()
+        recorder.add_step('GET', f"{self.base}/stats?x=1", {}, None, '{}')
+        recipe = recorder.recipe(recorded_url)
+        self.assertEqual(len(recipe['steps']), 2)
+
+    def test_replay_channel_uses_recipe_file(self):
+        recorder, recorded_url = self.browse()
+        token_replay.save_recipe('al-aoula', recorder.recipe(recorded_url), self.recipe_file)
+        before = len(self.player.issued)
+
+        url = token_replay.replay_channel('al-aoula', self.recipe_file)
+
+        self.assertIsNotNone(url)
+        self.assertEqual(len(self.player.issued), before + 1)
+        self.assertIsNone(token_replay.replay_channel('arriadia', self.recipe_file))
+
+    def test_replay_channel_failure_returns_none(self):
+        recorder, recorded_url = self.browse()
+        token_replay.save_recipe('al-aoula', recorder.recipe(recorded_url), self.recipe_file)
+        self.player.token_status = 403
+
+        self.assertIsNone(token_replay.replay_channel('al-aoula', self.recipe_file))
+
+    def test_save_recipe_none_drops_entry(self):
+        recorder, recorded_url = self.browse()
+        token_replay.save_recipe('al-aoula', recorder.recipe(recorded_url), self.recipe_file)
+        token_replay.save_recipe('al-aoula', None, self.recipe_file)
+        self.assertEqual(token_replay.load_recipes(self.recipe_file), {})
+
+    def test_unreachable_server_raises(self):
+        recorder, recorded_url = self.browse()
+        recipe = recorder.recipe(recorded_url)
+        self.server.shutdown()
+        self.server.server_close()
+
+        with self.assertRaises(token_replay.ReplayError):
+            token_replay.replay(recipe, timeout=1)
+
+
+class QueryTestCase(unittest.TestCase):
+    def test_replace_query_keeps_raw_form(self):
+        url = 'http://h/p.m3u8?token=a&token_path=%2Fabr%2F&expires=1'
+        self.assertEqual(token_replay.replace_query(url, {'token': 'b'}),
+                         'http://h/p.m3u8?token=b&token_path=%2Fabr%2F&expires=1')
+
+    def test_encoded_binding_is_re_encoded(self):
+        responses = [json.dumps({'path': '/abr/aloula/'})]
+        binding = token_replay.find_binding('%2Fabr%2Faloula%2F', responses, time.time())
+        self.assertTrue(binding['encoded'])
+        self.assertEqual(token_replay.resolve_binding(binding, responses), '%2Fabr%2Faloula%2F')
+
+
+if __name__ == '__main__':
+    unittest.main()
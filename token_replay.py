@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+HTTP-only SNRT token minting
+The browser extractor records, per channel, the requests the player makes
+to get its token (the event page and token.easybroadcast.io calls) and
+which response each query value of the final playlist URL came from.
+Replaying that recipe with plain HTTP mints a fresh playlist URL in
+milliseconds; when it stops working the caller falls back to the browser,
+which records a new recipe.
+
+No Playwright here — the proxy imports this directly.
+"""
+import json
+import os
+import re
+import tempfile
+import time
+from urllib.parse import quote, unquote, urlsplit, urlunsplit
+
+import requests
+
+RECIPE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snrt_token_recipes.json')
+REPLAY_TIMEOUT = 5          # seconds per HTTP request during replay
+MIN_REMAINING = 120         # replayed token must have this many seconds left
+TIMESTAMP_WINDOW = 86400    # a numeric value this close to the recording time is a clock value
+TEXT_CONTEXT = 24           # chars of response text kept before a value to find it again
+
+# `name: "`, `name="`, `"name":"` right before a value — a prefix that doesn't change
+KEY_PREFIX_RE = re.compile(r'["\']?[\w.-]+["\']?\s*[:=]\s*["\']?$')
+MIN_BIND_LENGTH = 6         # shorter values (v=2, lang=fr) are treated as constants
+
+# Request headers worth sending again; cookies come from the replay session itself
+REPLAY_HEADERS = {'referer', 'origin', 'user-agent', 'accept', 'accept-language', 'content-type'}
+
+
+class ReplayError(Exception):
+    """A recipe could not produce a working playlist URL"""
+
+
+# ---------------------------------------------------------------------------
+# Query strings, kept in their raw form so replayed URLs match the original
+# ---------------------------------------------------------------------------
+
+def split_query(url):
+    """[(name, raw value)] in order"""
+    query = urlsplit(url).query
+    pairs = []
+    for part in query.split('&') if query else ():
+        name, _, value = part.partition('=')
+        pairs.append((name, value))
+    return pairs
+
+
+def replace_query(url, values):
+    """url with the raw values of the named query parameters replaced"""
+    parts = urlsplit(url)
+    pairs = [(name, values.get(name, value)) for name, value in split_query(url)]
+    query = '&'.join(f"{name}={value}" for name, value in pairs)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, query, parts.fragment))
+
+
+def query_value(url, name):
+    for key, value in split_query(url):
+        if key == name:
+            return value
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Bindings: where a value came from, and how to get it again
+# ---------------------------------------------------------------------------
+
+def _json_path(data, value):
+    """Key/index path to a leaf equal to value, or None"""
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        items = enumerate(data)
+    else:
+        return [] if not isinstance(data, bool) and str(data) == value else None
+    for key, child in items:
+        path = _json_path(child, value)
+        if path is not None:
+            return [key] + path
+    return None
+
+
+def _follow(data, path):
+    for key in path:
+        data = data[key]
+    return data
+
+
+def find_binding(raw, responses, recorded_at):
+    """Binding for one raw query value given the response texts seen before it, or None"""
+    value = unquote(raw)
+    encoded = value != raw
+    if value.isdigit() and len(value) in (10, 13):
+        scale = 1000 if len(value) == 13 else 1
+        if abs(int(value) / scale - recorded_at) < TIMESTAMP_WINDOW:
+            if not any(value in text for text in responses):
+                return {'clock': scale}
+    if len(value) < MIN_BIND_LENGTH:
+        return None
+    for step in range(len(responses) - 1, -1, -1):
+        text = responses[step]
+        if value not in text:
+            continue
+        try:
+            path = _json_path(json.loads(text), value)
+        except ValueError:
+            path = None
+        if path is not None:
+            return {'step': step, 'json': path, 'encoded': encoded}
+        start = text.index(value)
+        end = start + len(value)
+        before = text[max(0, start - TEXT_CONTEXT):start]
+        key = KEY_PREFIX_RE.search(before)
+        return {'step': step, 'prefix': key.group(0) if key else before,
+                'suffix': text[end:end + 1], 'encoded': encoded}
+    return None
+
+
+def resolve_binding(binding, responses, now=None):
+    """Raw query value for binding from this replay's responses"""
+    if 'clock' in binding:
+        return str(int((time.time() if now is None else now) * binding['clock']))
+    text = responses[binding['step']]
+    if 'json' in binding:
+        try:
+            value = _follow(json.loads(text), binding['json'])
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise ReplayError(f"step {binding['step']}: no value at {binding['json']}")
+        value = str(value)
+    else:
+        tail = re.escape(binding['suffix']) if binding['suffix'] else r'(?=[\s"\'&<]|$)'
+        m = re.search(re.escape(binding['prefix']) + r'(.+?)' + tail, text)
+        if not m:
+            raise ReplayError(f"step {binding['step']}: value not found in response")
+        value = m.group(1)
+    return quote(value, safe='') if binding.get('encoded') else value
+
+
+def bind_url(url, responses, recorded_at):
+    """{query name: binding} for every query value of url found in earlier responses"""
+    bindings = {}
+    for name, raw in split_query(url):
+        if raw:
+            binding = find_binding(raw, responses, recorded_at)
+            if binding is not None:
+                bindings[name] = binding
+    return bindings
+
+
+def apply_bindings(url, bindings, responses, now=None):
+    values = {name: resolve_binding(b, responses, now) for name, b in bindings.items()}
+    return replace_query(url, values)
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+def _replay_headers(headers):
+    return {k: v for k, v in (headers or {}).items() if k.lower() in REPLAY_HEADERS}
+
+
+class Recorder:
+    """Collects the token-issuing requests of one browser extraction"""
+
+    def __init__(self):
+        self.recorded_at = time.time()
+        self._steps = []            # (method, url, headers, body, response text)
+        self._playlist_headers = {}
+
+    def add_step(self, method, url, headers, body, response_text):
+        self._steps.append((method, url, _replay_headers(headers), body, response_text))
+
+    def note_playlist(self, url, headers):
+        self._playlist_headers[url] = _replay_headers(headers)
+
+    def recipe(self, playlist_url):
+        """Replayable recipe for playlist_url, or None if its token didn't come from a recorded step"""
+        responses = [step[4] for step in self._steps]
+        playlist_bindings = bind_url(playlist_url, responses, self.recorded_at)
+        if not any('step' in b for b in playlist_bindings.values()):
+            return None
+        # Requests after the last one the playlist URL draws from aren't replayed
+        last = max(b['step'] for b in playlist_bindings.values() if 'step' in b)
+        steps = []
+        for i, (method, url, headers, body, _) in enumerate(self._steps[:last + 1]):
+            steps.append({'method': method, 'url': url, 'headers': headers, 'body': body,
+                          'bindings': bind_url(url, responses[:i], self.recorded_at)})
+        return {
+            'recorded': int(self.recorded_at),
+            'steps': steps,
+            'playlist': {'url': playlist_url, 'headers': self._playlist_headers.get(playlist_url, {}),
+                         'bindings': playlist_bindings},
+        }
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+def replay(recipe, session=None, timeout=REPLAY_TIMEOUT, verify=True):
+    """Run a recipe with plain HTTP; returns a fresh playlist URL or raises ReplayError"""
+    session = session or requests.Session()
+    responses = []
+    now = time.time()
+    try:
+        for i, step in enumerate(recipe['steps']):
+            url = apply_bindings(step['url'], step['bindings'], responses, now)
+            r = session.request(step['method'], url, headers=step['headers'],
+                                data=step.get('body'), timeout=timeout)
+            if r.status_code >= 400:
+                raise ReplayError(f"step {i}: HTTP {r.status_code} from {urlsplit(url).netloc}")
+            responses.append(r.text)
+
+        playlist = recipe['playlist']
+        url = apply_bindings(playlist['url'], playlist['bindings'], responses, now)
+        expires = query_value(url, 'expires')
+        if expires and expires.isdigit() and int(expires) - now <= MIN_REMAINING:
+            raise ReplayError(f"replayed token expires in {int(expires) - now:.0f}s")
+        if verify:
+            r = session.get(url, headers=playlist['headers'], timeout=timeout)
+            if r.status_code != 200 or not r.content.lstrip().startswith(b'#EXTM3U'):
+                raise ReplayError(f"replayed playlist answered HTTP {r.status_code}")
+        return url
+    except (KeyError, IndexError, TypeError) as e:
+        raise ReplayError(f"malformed recipe: {e!r}")
+    except requests.RequestException as e:
+        raise ReplayError(str(e))
+
+
+def load_recipes(path=RECIPE_FILE):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_recipe(channel_id, recipe, path=RECIPE_FILE):
+    """Store (or with recipe=None, drop) a channel's recipe; atomic like the token store"""
+    recipes = load_recipes(path)
+    if recipe is None:
+        recipes.pop(channel_id, None)
+    else:
+        recipes[channel_id] = recipe
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(recipes, f, indent=2)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def replay_channel(channel_id, path=RECIPE_FILE, timeout=REPLAY_TIMEOUT):
+    """Fresh playlist URL for channel_id via its recorded recipe, or None"""
+    recipe = load_recipes(path).get(channel_id)
+    if not recipe:
+        return None
+    started = time.monotonic()
+    try:
+        url = replay(recipe, timeout=timeout)
+    except ReplayError as e:
+        print(f"  ⚠️  {channel_id}: token replay failed ({e}), using the browser", flush=True)
+        return None
+    print(f"  ⚡ {channel_id}: token replayed over HTTP "
+          f"({(time.monotonic() - started) * 1000:.0f}ms)", flush=True)
+    return url
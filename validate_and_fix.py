@@ -4,132 +4,175 @@ IPTV Channel Validator & Auto-Fixer
 Checks channels in Arabic.m3u and replaces broken ones with working alternatives from iptv-org
 """
 
-import re
-import requests
+import asyncio
 import subprocess
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime
+from urllib.parse import urljoin
 import sys
 
+import channel_index
+import m3u_parser
+import snrt_upstream
+
 # Config
 PLAYLIST_FILE = "Arabic.m3u"
 IPTV_ORG_DIR = "/tmp/iptv-org/streams"
 TIMEOUT = 10  # seconds for stream check
 BACKUP_DIR = "backups"
+GLOBAL_CONCURRENCY = 32   # stream checks in flight at once
+PER_HOST_CONCURRENCY = 4  # ... and against any one host:port (testr.m3u has 22 on one CDN)
+MAX_REDIRECTS = 5
+DRAIN_LIMIT = 64 * 1024   # read bodies up to this size so the connection can be reused
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Firefox/134.0'
 
 # Arabic country codes to search for replacements
 ARABIC_COUNTRIES = ["ma", "sa", "ae", "eg", "lb", "dz", "tn", "ly", "sd", "sy", "jo", "ye", "iq", "kw", "bh", "qa", "om"]
 
 
 class Channel:
-    def __init__(self, metadata: str, url: str):
+    def __init__(self, metadata: str, url: str, entry: Optional[m3u_parser.Entry] = None):
         self.metadata = metadata  # Full #EXTINF line
         self.url = url
-        self.name = self._extract_name()
+        self.entry = entry        # playlist entry this channel was read from
+        self.name = (entry.name if entry else m3u_parser.split_extinf(metadata)[2]) or "Unknown"
         self.is_working = None
-        
-    def _extract_name(self) -> str:
-        """Extract channel name from metadata"""
-        # Pattern: last comma-separated value is the name
-        match = re.search(r',\s*(.+?)$', self.metadata)
-        if match:
-            return match.group(1).strip()
-        return "Unknown"
+        self.error = None
     
     def normalize_name(self) -> str:
-        """Normalize name for matching (lowercase, remove special chars)"""
-        name = self.name.lower()
-        # Remove common words and normalize
-        name = re.sub(r'\b(tv|hd|channel|arabic|arb|international|inter)\b', '', name)
-        name = re.sub(r'[^a-z0-9\s]', '', name)
-        name = re.sub(r'\s+', ' ', name).strip()
-        return name
+        """Normalize name for matching (lowercase, drop quality tags and filler words)"""
+        return channel_index.normalize_name(self.name)
     
     def check_status(self) -> bool:
-        """Check if stream URL is accessible"""
+        """Check if stream URL is accessible (one-off; use check_channels for many)"""
+        return run(self.check_status_async(HostLimiter()))
+    
+    async def check_status_async(self, limiter: 'HostLimiter') -> bool:
+        """HEAD, then a ranged GET (streaming endpoints often don't support HEAD)"""
         if not self.url or self.url.startswith('#') or 'git@' in self.url:
             self.is_working = False
             return False
-            
-        try:
-            # Try HEAD request first (faster)
-            response = requests.head(self.url, timeout=TIMEOUT, allow_redirects=True)
-            if response.status_code < 400:
-                self.is_working = True
-                return True
-            
-            # If HEAD fails, try GET with range (streaming endpoints often don't support HEAD)
-            response = requests.get(self.url, timeout=TIMEOUT, stream=True, headers={'Range': 'bytes=0-1024'})
-            self.is_working = response.status_code < 400
-            return self.is_working
-            
-        except Exception as e:
-            print(f"  ✗ {self.name}: {str(e)[:50]}")
+        if not self.url.startswith(('http://', 'https://')):
+            self.error = "unsupported URL scheme"
             self.is_working = False
             return False
+        
+        try:
+            self.is_working = await self._probe(limiter)
+        except asyncio.TimeoutError:
+            self.error = f"no answer in {TIMEOUT}s"
+            self.is_working = False
+        except (OSError, ValueError, snrt_upstream.UpstreamError) as e:
+            self.error = str(e)[:50] or e.__class__.__name__
+            self.is_working = False
+        return self.is_working
+    
+    async def _probe(self, limiter: 'HostLimiter') -> bool:
+        try:
+            status = await fetch_status(self.url, 'HEAD', {}, limiter)
+            if status < 400:
+                return True
+        except snrt_upstream.UpstreamError:
+            pass  # garbled HEAD reply — the GET may still work
+        status = await fetch_status(self.url, 'GET', {'Range': 'bytes=0-1024'}, limiter)
+        if status >= 400:
+            self.error = f"HTTP {status}"
+        return status < 400
 
 
-def parse_m3u(file_path: Path) -> List[Channel]:
-    """Parse M3U file into Channel objects"""
-    channels = []
-    
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+class HostLimiter:
+    """Caps requests in flight globally and per (scheme, host, port)"""
     
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        if line.startswith('#EXTINF'):
-            metadata = line
-            # Next non-comment line should be the URL
-            i += 1
-            while i < len(lines) and (lines[i].strip().startswith('#') or not lines[i].strip()):
-                i += 1
-            
-            if i < len(lines):
-                url = lines[i].strip()
-                channels.append(Channel(metadata, url))
-        
-        i += 1
+    def __init__(self, total: int = GLOBAL_CONCURRENCY, per_host: int = PER_HOST_CONCURRENCY):
+        self.total = asyncio.Semaphore(total)
+        self.per_host = per_host
+        self._hosts = {}
     
-    return channels
+    def host(self, url: str) -> asyncio.Semaphore:
+        key = snrt_upstream.host_key(url)
+        if key not in self._hosts:
+            self._hosts[key] = asyncio.Semaphore(self.per_host)
+        return self._hosts[key]
 
 
-def search_iptv_org(channel_name: str) -> Optional[str]:
-    """Search iptv-org streams for a replacement URL by channel name"""
-    normalized_target = channel_name.lower()
-    
-    # Search Arabic country playlists
-    for country_code in ARABIC_COUNTRIES:
-        playlist_file = Path(IPTV_ORG_DIR) / f"{country_code}.m3u"
-        if not playlist_file.exists():
+async def _request(url: str, method: str, headers: Dict[str, str]):
+    response = await snrt_upstream.fetch(url, headers, method, TIMEOUT)
+    # Small bodies are read so the connection goes back to the pool;
+    # a live stream that ignored Range is just dropped
+    if response.content_length is not None and response.content_length <= DRAIN_LIMIT:
+        await response.read()
+    else:
+        response.close()
+    return response
+
+
+async def fetch_status(url: str, method: str, headers: Dict[str, str], limiter: HostLimiter) -> int:
+    """Final status of a request, following redirects, over pooled keep-alive connections"""
+    headers = dict(headers, **{'User-Agent': USER_AGENT})
+    for _ in range(MAX_REDIRECTS + 1):
+        # Host slot first, then a global one, so a check queued behind a busy host
+        # holds no global slot; TIMEOUT only starts once the request really goes out
+        async with limiter.host(url), limiter.total:
+            response = await asyncio.wait_for(_request(url, method, headers), TIMEOUT)
+        location = response.headers.get('location')
+        if response.status in (301, 302, 303, 307, 308) and location:
+            url = urljoin(url, location)
             continue
-        
+        return response.status
+    raise snrt_upstream.UpstreamError("too many redirects")
+
+
+def run(coro):
+    """asyncio.run() that closes the pooled connections before its loop goes away,
+    so a later run doesn't pick up connections tied to a closed loop"""
+    async def scoped():
         try:
-            with open(playlist_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            for i, line in enumerate(lines):
-                if line.startswith('#EXTINF'):
-                    # Extract name from this line
-                    match = re.search(r',\s*(.+?)$', line)
-                    if match:
-                        name = match.group(1).strip().lower()
-                        
-                        # Simple fuzzy matching
-                        if normalized_target in name or name in normalized_target:
-                            # Get the URL from next non-comment line
-                            for j in range(i + 1, min(i + 5, len(lines))):
-                                url_line = lines[j].strip()
-                                if url_line and not url_line.startswith('#'):
-                                    return url_line
-        except Exception as e:
-            print(f"  Warning: Error reading {country_code}.m3u: {e}")
+            return await coro
+        finally:
+            snrt_upstream.POOL.close_idle()
+    return asyncio.run(scoped())
+
+
+async def check_channels(channels: List[Channel], quiet: bool = False) -> List[Channel]:
+    """Check all channels concurrently, printing each result as it completes"""
+    limiter = HostLimiter()
+    
+    async def check(channel):
+        await channel.check_status_async(limiter)
+        return channel
+    
+    done = 0
+    for finished in asyncio.as_completed([check(ch) for ch in channels]):
+        channel = await finished
+        done += 1
+        if quiet:
             continue
+        if channel.is_working:
+            print(f"[{done}/{len(channels)}] ✓ {channel.name}", flush=True)
+        else:
+            reason = f": {channel.error}" if channel.error else ""
+            print(f"[{done}/{len(channels)}] ✗ BROKEN {channel.name}{reason}", flush=True)
+    return channels
+
+
+def parse_m3u(file_path: Path) -> Tuple[m3u_parser.Playlist, List[Channel]]:
+    """Parse M3U file into Channel objects (plus the playlist, for writing back)"""
+    playlist = m3u_parser.Playlist.load(file_path)
+    channels = [Channel(entry.metadata, entry.url, entry) for entry in playlist.entries]
+    return playlist, channels
+
+
+def search_iptv_org(channel_name: str, index: Optional[channel_index.ChannelIndex] = None) -> Optional[str]:
+    """Best-matching replacement URL from the Arabic country playlists of iptv-org"""
+    sources = [Path(IPTV_ORG_DIR) / f"{country_code}.m3u" for country_code in ARABIC_COUNTRIES]
+    if index is None:
+        with channel_index.ChannelIndex() as index:
+            index.update([IPTV_ORG_DIR])
+            return search_iptv_org(channel_name, index)
     
-    return None
+    matches = index.lookup(channel_name, limit=1, sources=sources)
+    return matches[0].url if matches else None
 
 
 def create_backup(file_path: Path):
@@ -148,13 +191,11 @@ def create_backup(file_path: Path):
     return backup_file
 
 
-def write_m3u(file_path: Path, channels: List[Channel]):
-    """Write channels back to M3U file"""
-    with open(file_path, 'w', encoding='utf-8') as f:
-        f.write("#EXTM3U \n")
-        for channel in channels:
-            f.write(f"{channel.metadata}\n")
-            f.write(f"{channel.url}\n")
+def write_m3u(file_path: Path, playlist: m3u_parser.Playlist, channels: List[Channel]):
+    """Write changed channel URLs back; everything else in the file stays as it was"""
+    for channel in channels:
+        channel.entry.url = channel.url
+    playlist.save(file_path)
 
 
 def main():
@@ -172,24 +213,25 @@ def main():
                        "https://github.com/iptv-org/iptv.git", 
                        "/tmp/iptv-org"], check=True)
     
+    # Index iptv-org names (only playlists changed since the last run are re-read)
+    index = channel_index.ChannelIndex()
+    stats = index.update([IPTV_ORG_DIR])
+    print(f"🗂  Channel index: {index.count()} streams "
+          f"({stats['added'] + stats['updated']} playlists re-indexed)\n")
+    
     # Parse playlist
     print(f"📋 Parsing {PLAYLIST_FILE}...")
-    channels = parse_m3u(playlist_path)
+    playlist, channels = parse_m3u(playlist_path)
     print(f"   Found {len(channels)} channels\n")
     
     # Validate channels
-    print("🔎 Checking channel availability...")
-    broken_channels = []
-    working_channels = []
-    
-    for i, channel in enumerate(channels, 1):
-        print(f"[{i}/{len(channels)}] {channel.name}...", end=" ")
-        if channel.check_status():
-            print("✓")
-            working_channels.append(channel)
-        else:
-            print("✗ BROKEN")
-            broken_channels.append(channel)
+    print(f"🔎 Checking channel availability ({GLOBAL_CONCURRENCY} at once, "
+          f"{PER_HOST_CONCURRENCY} per host)...")
+    started = datetime.now()
+    run(check_channels(channels))
+    working_channels = [ch for ch in channels if ch.is_working]
+    broken_channels = [ch for ch in channels if not ch.is_working]
+    print(f"   Checked in {(datetime.now() - started).total_seconds():.1f}s")
     
     print(f"\n📊 Results: {len(working_channels)} working, {len(broken_channels)} broken\n")
     
@@ -200,23 +242,25 @@ def main():
     # Try to fix broken channels
     print("🔧 Searching for replacements...\n")
     fixed_count = 0
+    candidates = []
     
     for channel in broken_channels:
-        print(f"  Searching for: {channel.name}...")
-        replacement_url = search_iptv_org(channel.normalize_name())
-        
+        replacement_url = search_iptv_org(channel.name, index)
         if replacement_url:
-            # Verify replacement works
-            temp_channel = Channel(channel.metadata, replacement_url)
-            if temp_channel.check_status():
-                print(f"    ✓ Found working replacement")
-                channel.url = replacement_url
-                channel.is_working = True
-                fixed_count += 1
-            else:
-                print(f"    ✗ Replacement also broken")
+            candidates.append((channel, Channel(channel.metadata, replacement_url)))
+        else:
+            print(f"  {channel.name}: ✗ No replacement found")
+    
+    # Verify replacements work, all at once
+    run(check_channels([temp for _, temp in candidates], quiet=True))
+    for channel, temp_channel in candidates:
+        if temp_channel.is_working:
+            print(f"  {channel.name}: ✓ Found working replacement")
+            channel.url = temp_channel.url
+            channel.is_working = True
+            fixed_count += 1
         else:
-            print(f"    ✗ No replacement found")
+            print(f"  {channel.name}: ✗ Replacement also broken")
     
     print(f"\n✨ Fixed {fixed_count}/{len(broken_channels)} broken channels\n")
     
@@ -225,7 +269,7 @@ def main():
         create_backup(playlist_path)
         
         # Write updated playlist
-        write_m3u(playlist_path, channels)
+        write_m3u(playlist_path, playlist, channels)
         print(f"✓ Updated {PLAYLIST_FILE}")
         
         # Show remaining issues
@@ -1,105 +1,151 @@
 #!/usr/bin/env python3
 """
 Comprehensive channel verification - actually tests stream data, not just HTTP status
+Streams are checked in-process by hls_probe (MPEG-TS packets, PAT/PMT); ffprobe
+is only spawned for formats it can't judge (fMP4, encrypted, DASH, ...).
 """
 
-import re
+import os
+import signal
 import subprocess
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
+
+import hls_probe
+import m3u_parser
 
 TIMEOUT = 15
 PLAYLIST_FILE = Path(__file__).parent / "Arabic.m3u"
+PROBES_PER_CPU = 4                 # ffprobe mostly waits on the network
+PROBE_MEMORY = 64 * 1024 * 1024    # budget per ffprobe process (RSS is ~30-60MB on HLS)
+MAX_PROBES = 32
+
+_running = set()                   # live ffprobe processes, killed on Ctrl-C
+_running_lock = threading.Lock()
+
+
+def available_memory() -> Optional[int]:
+    """Bytes of memory available to new processes, if the OS will say"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def probe_limit() -> int:
+    """Concurrent ffprobe processes: bounded by CPUs and by free memory"""
+    limit = min((os.cpu_count() or 1) * PROBES_PER_CPU, MAX_PROBES)
+    memory = available_memory()
+    if memory is not None:
+        limit = min(limit, memory // PROBE_MEMORY)
+    return max(1, limit)
+
+
+def _kill(proc: subprocess.Popen):
+    """Kill ffprobe and anything it spawned (it runs in its own session)"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
 
+_ffprobe_limit = probe_limit()
+_ffprobe_slots = threading.BoundedSemaphore(_ffprobe_limit)
 
-def test_stream_with_ffprobe(url: str) -> bool:
+
+def test_stream_with_ffprobe(url: str, headers: Optional[Dict[str, str]] = None) -> bool:
     """Use ffprobe to verify stream is actually playable"""
+    extra = ['-headers', ''.join(f"{k}: {v}\r\n" for k, v in headers.items())] if headers else []
+    with _ffprobe_slots:
+        return _run_ffprobe(['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', 
+                             '-read_intervals', '%+#1', '-timeout', '10000000', *extra, url])
+
+
+def _run_ffprobe(command) -> bool:
     try:
-        result = subprocess.run(
-            ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', 
-             '-read_intervals', '%+#1', '-timeout', '10000000', url],
-            capture_output=True,
-            timeout=TIMEOUT
+        proc = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            start_new_session=True
         )
+    except OSError:
+        return False
+    with _running_lock:
+        _running.add(proc)
+    try:
+        stdout, _ = proc.communicate(timeout=TIMEOUT)
         # If ffprobe can read stream info, it's valid
-        return result.returncode == 0 and len(result.stdout) > 10
-    except:
+        return proc.returncode == 0 and len(stdout) > 10
+    except subprocess.TimeoutExpired:
+        _kill(proc)
+        proc.communicate()  # reap it and close the pipe
         return False
+    finally:
+        with _running_lock:
+            _running.discard(proc)
 
 
-def test_stream_http(url: str) -> bool:
-    """Fallback HTTP test"""
-    try:
-        response = requests.get(url, timeout=TIMEOUT, stream=True, 
-                              headers={'Range': 'bytes=0-8192'})
-        if response.status_code >= 400:
-            return False
-        
-        # Try to read some actual data
-        data = next(response.iter_content(8192), None)
-        return data is not None and len(data) > 0
-    except:
-        return False
+def check_channel(name: str, url: str, headers: Dict[str, str], session):
+    """(status line, reason) for one channel; reason is None when it works"""
+    # Skip obviously broken
+    if not url or url.startswith('#') or 'git@' in url:
+        return "✗ Invalid URL", "Invalid URL"
+    
+    result = hls_probe.probe(url, headers, session)
+    if result.ok:
+        slow = " - slower than its bitrate" if result.ratio is not None and result.ratio < 1 else ""
+        return f"✅ WORKING ({result.summary()}){slow}", None
+    if result.unsupported:
+        # Reachable but not plain HLS/TS: let ffprobe decode it
+        if test_stream_with_ffprobe(url, headers):
+            return "✅ WORKING (verified with ffprobe)", None
+        return f"⚠️  HTTP OK (couldn't verify stream data: {result.error})", None
+    return f"✗ BROKEN ({result.error})", result.error
 
 
 def parse_and_test_all():
-    """Parse M3U and test every channel"""
-    with open(PLAYLIST_FILE, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    channels = []
-    i = 0
+    """Parse M3U and test every channel (concurrently; reported in playlist order)"""
+    channels = [(entry.name or "Unknown", entry.url, hls_probe.entry_headers(entry))
+                for entry in m3u_parser.iter_entries(PLAYLIST_FILE)]
     
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        if line.startswith('#EXTINF'):
-            match = re.search(r',\s*(.+?)$', line)
-            channel_name = match.group(1).strip() if match else "Unknown"
-            
-            # Find URL
-            i += 1
-            while i < len(lines) and (lines[i].strip().startswith('#') or not lines[i].strip()):
-                i += 1
-            
-            if i < len(lines):
-                url = lines[i].strip()
-                channels.append((channel_name, url))
-        
-        i += 1
-    
-    print(f"📋 Testing {len(channels)} channels...\n")
+    print(f"📋 Testing {len(channels)} channels ({hls_probe.PROBE_WORKERS} at once, "
+          f"{_ffprobe_limit} ffprobe fallbacks)...\n")
     
     working = []
     broken = []
     
-    for name, url in channels:
-        print(f"🔍 {name}...", end=" ", flush=True)
-        
-        # Skip obviously broken
-        if not url or url.startswith('#') or 'git@' in url:
-            print("✗ Invalid URL")
-            broken.append((name, url, "Invalid URL"))
-            continue
-        
-        # Try ffprobe first (most reliable)
-        if test_stream_with_ffprobe(url):
-            print("✅ WORKING (verified with ffprobe)")
-            working.append((name, url))
-        elif test_stream_http(url):
-            print("⚠️  HTTP OK (couldn't verify stream data)")
-            working.append((name, url))
-        else:
-            print("✗ BROKEN")
-            broken.append((name, url, "Connection failed"))
+    session = hls_probe.new_session()
+    pool = ThreadPoolExecutor(max_workers=hls_probe.PROBE_WORKERS)
+    try:
+        checks = [pool.submit(check_channel, name, url, headers, session) for name, url, headers in channels]
+        for (name, url, _), check in zip(channels, checks):
+            status, reason = check.result()
+            print(f"🔍 {name}... {status}", flush=True)
+            if reason is None:
+                working.append((name, url))
+            else:
+                broken.append((name, url, reason))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        with _running_lock:
+            for proc in list(_running):
+                _kill(proc)
     
     return working, broken
 
 
 def main():
     print("🔬 Comprehensive Channel Verification\n")
-    print("This will take a few minutes - testing actual stream playback...\n")
+    print("Testing actual stream playback, many channels at once...\n")
     
     working, broken = parse_and_test_all()
     